@@ -1,38 +1,116 @@
 from axiomtradeapi import AxiomTradeClient
-from typing import Dict, List
-from config import AXIOM_ACCESS_TOKEN, AXIOM_REFRESH_TOKEN, WALLET_ADDRESS, PRIVATE_KEY, DEFAULT_SETTINGS
-from storage import PositionStorage
-from reports import ReportsManager
+from typing import Callable, Dict, Generator, Iterator, List, Optional, Tuple
+from config import (
+    AXIOM_ACCESS_TOKEN, AXIOM_REFRESH_TOKEN, WALLET_ADDRESS, PRIVATE_KEY, DEFAULT_SETTINGS,
+    TRADE_EXECUTOR_WORKERS, EXECUTION_MAX_CONCURRENT, MAX_CONCURRENT_TRIGGERS, BUY_CONFIRM_TIMEOUT, BUY_CONFIRM_INITIAL_DELAY, BUY_CONFIRM_MAX_DELAY,
+    SELL_BATCH_WINDOW, SELL_BATCH_MAX, FLATTEN_MAX_CONCURRENT
+)
+from storage import position_storage
+from reports import reports_manager
 from notifications import notification_manager
+from jupiter_prices import fetch_token_prices, fetch_token_prices_sync
+from price_cache import price_cache
+from wallet_balances import wallet_balances
+from token_ledger import token_ledger
+from sell_batcher import SellBatcher, is_split_amount
+from execution_queue import (
+    ExecutionQueue, create_execution_queue, PRIORITY_EXIT, PRIORITY_TAKE_PROFIT, PRIORITY_BUY
+)
+from metrics import axiom_request_seconds
 import asyncio
+import functools
 import logging
+import threading
 import time
-import requests
+from concurrent.futures import ThreadPoolExecutor
 
 logger = logging.getLogger(__name__)
 
+# Общий ограниченный пул потоков для блокирующих вызовов SDK и HTTP
+trade_executor = ThreadPoolExecutor(max_workers=TRADE_EXECUTOR_WORKERS, thread_name_prefix='axiom')
+
+# Общая очередь свопов: выходы из позиций не ждут за пачкой новых покупок. У очереди свой пул:
+# операции из trade_executor ждут в ней свопы и не должны занимать потоки, которые их исполняют
+swap_executor = ThreadPoolExecutor(max_workers=EXECUTION_MAX_CONCURRENT, thread_name_prefix='swap')
+execution_queue = create_execution_queue(swap_executor)
+
+# Стоп-лоссы ждут свой своп в отдельных потоках: тейк-профиты и ручные сделки, ожидающие очереди
+# в trade_executor, не задерживают выход. Размер - лимит одновременных SL монитора
+stop_loss_executor = ThreadPoolExecutor(max_workers=MAX_CONCURRENT_TRIGGERS, thread_name_prefix='exit')
+
+def balance_poll_delays(started: float, timeout: float,
+                        initial_delay: float = BUY_CONFIRM_INITIAL_DELAY,
+                        max_delay: float = BUY_CONFIRM_MAX_DELAY) -> Iterator[float]:
+    """Задержки между опросами баланса: экспоненциальный рост до max_delay, не дольше дедлайна"""
+    delay = initial_delay
+    deadline = started + timeout
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return
+        yield min(delay, remaining)
+        delay = min(delay * 2, max_delay)
+
+def balance_confirmation(contract_address: str, previous_balance: float,
+                         timeout: float = None) -> Generator[float, float, Tuple[Optional[float], float]]:
+    """
+    Ожидание подтверждения покупки без привязки к способу ожидания: отдает задержку до следующего
+    опроса и принимает прочитанный баланс. Результат - (баланс, секунд до подтверждения);
+    если баланс не изменился до timeout, баланс None - количество позиции тогда назначит сверка.
+    """
+    timeout = BUY_CONFIRM_TIMEOUT if timeout is None else timeout
+    started = time.monotonic()
+    for delay in balance_poll_delays(started, timeout):
+        balance = yield delay
+        if balance != previous_balance:
+            elapsed = time.monotonic() - started
+            logger.info(f"Balance confirmed for {contract_address[:8]}... in {elapsed:.2f}s: {balance}")
+            return balance, elapsed
+    
+    elapsed = time.monotonic() - started
+    logger.warning(f"Balance for {contract_address[:8]}... did not change within {timeout}s")
+    return None, elapsed
+
 class AxiomClient:
-    def __init__(self):
-        self.api = AxiomTradeClient(
+    def __init__(self, api: AxiomTradeClient = None, storage=None, reports=None, ledger=None):
+        """Зависимости по умолчанию - SDK с токенами из config и глобальные хранилища модулей"""
+        self.api = api or AxiomTradeClient(
             auth_token=AXIOM_ACCESS_TOKEN,
             refresh_token=AXIOM_REFRESH_TOKEN
         )
         self.wallet_address = WALLET_ADDRESS
         self.private_key = PRIVATE_KEY
-        self.storage = PositionStorage()
-        self.reports = ReportsManager()  # ДОБАВЛЕННАЯ СТРОКА
+        self.storage = storage or position_storage
+        self.reports = reports or reports_manager  # ДОБАВЛЕННАЯ СТРОКА
+        self.balances = wallet_balances  # Снимок балансов всех токенов кошелька
+        self.ledger = ledger or token_ledger  # Учет токенов по позициям (кошелек общий для всех пользователей)
+        # Продажи объединяются в пределах клиента: бот и монитор работают с одним экземпляром (bot.axiom_client)
+        self.sell_batcher = SellBatcher(self._submit_sell, window=SELL_BATCH_WINDOW, max_batch=SELL_BATCH_MAX)
+        self.loop = None  # Event loop бота: уведомления из пула потоков отправляются в него
+        self.queue = None  # Очередь свопов (задает AsyncAxiomClient); без нее свопы идут напрямую
+    
+    def _schedule(self, coro):
+        """Запускаем корутину уведомления из event loop или из рабочего потока"""
+        try:
+            asyncio.get_running_loop().create_task(coro)
+        except RuntimeError:
+            if self.loop is not None and self.loop.is_running():
+                asyncio.run_coroutine_threadsafe(coro, self.loop)
+            else:
+                coro.close()
+                logger.debug("Уведомление пропущено: event loop недоступен")
     
-    def get_token_price(self, contract_address: str) -> float:
+    def get_token_price(self, contract_address: str, max_age: float = None) -> float:
+        """Цена токена из общего кэша; при отсутствии или устаревании - через Jupiter API"""
+        return price_cache.get_or_fetch_sync(contract_address, self._fetch_token_price, max_age)
+    
+    def _fetch_token_price(self, contract_address: str) -> float:
         """Получаем текущую цену токена через Jupiter API (синхронная версия)"""
         try:
-            url = f"https://quote-api.jup.ag/v6/price?ids={contract_address}"
-            response = requests.get(url, timeout=10)
-            if response.status_code == 200:
-                data = response.json()
-                if 'data' in data and contract_address in data['data']:
-                    return float(data['data'][contract_address]['price'])
-            logger.warning(f"Failed to get price for {contract_address}")
-            return 0.0
+            price = fetch_token_prices_sync([contract_address]).get(contract_address, 0.0)
+            if price <= 0:
+                logger.warning(f"Failed to get price for {contract_address}")
+            return price
         except Exception as e:
             logger.error(f"Ошибка получения цены токена {contract_address}: {e}")
             return 0.0
@@ -48,184 +126,369 @@ class AxiomClient:
     
     def open_position(self, user_id: int, contract_address: str, amount: float, sl: float, tp: list, breakeven: float, slippage: float = None) -> Dict:
         try:
-            # Используем пользовательский слиппедж или значение по умолчанию
-            slippage_percent = slippage if slippage is not None else DEFAULT_SETTINGS['slippage_percent']
-            
-            # Получаем текущую цену токена
-            entry_price = self.get_token_price(contract_address)
-            
-            if entry_price <= 0:
-                raise Exception("Не удалось получить цену токена")
-            
-            logger.info(f"Opening position for {contract_address} at price {entry_price} with {slippage_percent}% slippage")
-            
-            # Проверяем аутентификацию перед покупкой
-            if not self.is_authenticated():
-                raise Exception("API не аутентифицирован")
-            
-            # Используем метод buy_token с пользовательским слиппеджем
-            result = self.api.buy_token(
-                private_key=self.private_key,
-                token_mint=contract_address,
-                amount_sol=amount,
-                slippage_percent=slippage_percent  # Используем пользовательский слиппедж
-            )
-            
-            if not result.get('success', False):
-                raise Exception(f"Ошибка покупки: {result.get('error', 'Unknown error')}")
-            
-            # Ждем немного для обновления баланса
-            time.sleep(3)
-            
-            # Получаем баланс токена после покупки
-            token_balance = self.get_token_balance(contract_address)
-            
-            # Сохраняем информацию о позиции с новой структурой TP
-            position_id = f"{contract_address}_{int(time.time())}"
-            position_info = {
-                'id': position_id,
-                'contract_address': contract_address,
-                'invested_sol': amount,
-                'token_amount': token_balance,
-                'entry_price': entry_price,
-                'current_price': entry_price,
-                'pnl': 0.0,
-                'sl': sl,
-                'tp_levels': tp,
-                'breakeven_percent': breakeven,
-                'slippage_percent': slippage_percent,  # Сохраняем слиппедж в позиции
-                'transaction_hash': result.get('signature', ''),
-                'timestamp': time.time(),
-                'breakeven_moved': False,
-                'tp_executed': []
-            }
-            
-            # Сохраняем позицию в хранилище
-            self.storage.add_position(user_id, position_info)
-            
-            # ДОБАВЛЕННЫЕ СТРОКИ:
-            # Логируем в отчеты
-            self.reports.log_position_open(user_id, position_info)
-            
-            # Отправляем уведомление
-            asyncio.create_task(
-                notification_manager.notify_position_opened(user_id, position_info)
+            with self.ledger.buying(contract_address):
+                entry_price, slippage_percent, result, pre_balance = self._execute_buy(contract_address, amount, slippage)
+                
+                # Ждем, пока баланс токена изменится после покупки
+                token_balance, confirmation_time = self.wait_for_balance_change(contract_address, pre_balance)
+            
+            # Позиции принадлежит только прирост баланса: кошелек общий
+            token_amount, fill_pending = self.ledger.filled_amount(pre_balance, token_balance)
+            return self._register_position(
+                user_id, contract_address, amount, sl, tp, breakeven,
+                slippage_percent, entry_price, token_amount, result, confirmation_time, fill_pending
             )
             
-            logger.info(f"Position opened successfully: {position_id}")
-            return position_info
-            
         except Exception as e:
             # ДОБАВЛЕННОЕ УВЕДОМЛЕНИЕ ОБ ОШИБКЕ:
-            asyncio.create_task(
+            self._schedule(
                 notification_manager.notify_error(user_id, str(e), "Открытие позиции")
             )
             logger.error(f"Ошибка открытия позиции: {e}")
             raise
     
-    def close_position(self, user_id: int, contract_address: str, percentage: float = 100.0, slippage: float = None) -> Dict:
+    def _execute_buy(self, contract_address: str, amount: float, slippage: float = None,
+                     entry_price: float = None) -> Tuple[float, float, Dict, float]:
+        """Покупка токена: возвращает (цена входа, слиппедж, результат SDK, баланс токена до покупки)"""
+        # Используем пользовательский слиппедж или значение по умолчанию
+        slippage_percent = slippage if slippage is not None else DEFAULT_SETTINGS['slippage_percent']
+        
+        # Получаем текущую цену токена, если ее не передали (для входа - всегда свежую)
+        if entry_price is None:
+            entry_price = self.get_token_price(contract_address, max_age=0)
+        
+        if entry_price <= 0:
+            raise Exception("Не удалось получить цену токена")
+        
+        logger.info(f"Opening position for {contract_address} at price {entry_price} with {slippage_percent}% slippage")
+        
+        # Проверяем аутентификацию перед покупкой
+        if not self.is_authenticated():
+            raise Exception("API не аутентифицирован")
+        
+        # Баланс до сделки - по его изменению подтверждаем покупку, поэтому читаем его из RPC, а не из снимка
+        pre_balance = self.get_token_balance(contract_address, max_age=0)
+        
+        # Используем метод buy_token с пользовательским слиппеджем
+        with axiom_request_seconds.time(operation='buy'):
+            result = self.api.buy_token(
+                private_key=self.private_key,
+                token_mint=contract_address,
+                amount_sol=amount,
+                slippage_percent=slippage_percent  # Используем пользовательский слиппедж
+            )
+        
+        if not result.get('success', False):
+            raise Exception(f"Ошибка покупки: {result.get('error', 'Unknown error')}")
+        
+        self.balances.invalidate()
+        
+        return entry_price, slippage_percent, result, pre_balance
+    
+    def wait_for_balance_change(self, contract_address: str, previous_balance: float,
+                                timeout: float = None) -> Tuple[Optional[float], float]:
+        """
+        Опрашиваем баланс токена с экспоненциальной задержкой, пока он не изменится
+        относительно previous_balance или не истечет timeout.
+        Возвращает (баланс или None по таймауту, время до подтверждения в секундах)
+        """
+        confirmation = balance_confirmation(contract_address, previous_balance, timeout)
+        try:
+            delay = next(confirmation)
+            while True:
+                time.sleep(delay)
+                delay = confirmation.send(self.get_token_balance(contract_address, max_age=0))
+        except StopIteration as done:
+            return done.value
+    
+    def _register_position(self, user_id: int, contract_address: str, amount: float, sl: float, tp: list,
+                           breakeven: float, slippage_percent: float, entry_price: float,
+                           token_amount: float, result: Dict, confirmation_time: float = None,
+                           fill_pending: bool = False) -> Dict:
+        """Сохраняем открытую позицию, пишем в отчеты и уведомляем пользователя"""
+        # Сохраняем информацию о позиции с новой структурой TP
+        position_id = f"{contract_address}_{int(time.time())}"
+        position_info = {
+            'id': position_id,
+            'contract_address': contract_address,
+            'invested_sol': amount,
+            'token_amount': token_amount,  # Ведется учетом token_ledger
+            'fill_pending': fill_pending,  # Покупка не подтвердилась - количество назначит сверка
+            'entry_price': entry_price,
+            'current_price': entry_price,
+            'pnl': 0.0,
+            'sl': sl,
+            'tp_levels': tp,
+            'breakeven_percent': breakeven,
+            'slippage_percent': slippage_percent,  # Сохраняем слиппедж в позиции
+            'transaction_hash': result.get('signature', ''),
+            'confirmation_time': confirmation_time,  # Секунды от отправки до изменения баланса
+            'timestamp': time.time(),
+            'breakeven_moved': False,
+            'tp_executed': []
+        }
+        
+        # Сохраняем позицию в хранилище
+        self.storage.add_position(user_id, position_info)
+        
+        # ДОБАВЛЕННЫЕ СТРОКИ:
+        # Логируем в отчеты
+        self.reports.log_position_open(user_id, position_info)
+        
+        # Отправляем уведомление
+        self._schedule(
+            notification_manager.notify_position_opened(user_id, position_info)
+        )
+        
+        logger.info(f"Position opened successfully: {position_id}")
+        return position_info
+    
+    def close_position(self, user_id: int, contract_address: str, percentage: float = 100.0, slippage: float = None,
+                       trade_records: Optional[List] = None, notify: bool = True, position_id: str = None) -> Dict:
         """
         Закрываем позицию полностью или частично
         percentage: процент позиции для закрытия (по умолчанию 100%)
         slippage: пользовательский слиппедж (если None, берем из позиции или настроек по умолчанию)
+        trade_records: список для записи о закрытии вместо немедленного логирования (массовое закрытие)
+        notify: уведомлять владельца о закрытии (при массовом закрытии инициатор видит итог в одном сообщении)
+        position_id: какую позицию закрывать (триггеры); по умолчанию - первая позиция пользователя по контракту
         """
         try:
-            # Получаем слиппедж из позиции или используем переданный
-            if slippage is None:
-                positions = self.storage.get_positions(user_id)
-                position = next((p for p in positions if p['contract_address'] == contract_address), None)
-                if position:
-                    slippage = position.get('slippage_percent', DEFAULT_SETTINGS['slippage_percent'])
+            with self.ledger.closing(user_id, contract_address):
+                # Позицию читаем под блокировкой: параллельная продажа могла ее уже закрыть или уменьшить
+                if position_id is None:
+                    position = self.storage.find_position(user_id, contract_address)
                 else:
-                    slippage = DEFAULT_SETTINGS['slippage_percent']
-            
-            logger.info(f"Closing position for {contract_address} ({percentage}%) with {slippage}% slippage")
-            
-            # Получаем текущий баланс токена
-            token_balance = self.get_token_balance(contract_address)
-            
-            if token_balance <= 0:
-                logger.warning(f"No tokens to sell for {contract_address}")
-                # Если токенов нет, удаляем позицию из хранилища
-                positions = self.storage.get_positions(user_id)
-                position_to_remove = next((p for p in positions if p['contract_address'] == contract_address), None)
-                if position_to_remove:
-                    self.storage.remove_position(user_id, position_to_remove['id'])
-                return {'signature': 'no_tokens_to_sell'}
-            
-            # Рассчитываем количество токенов для продажи
-            amount_to_sell = token_balance * (percentage / 100.0)
-            
-            if not self.is_authenticated():
-                raise Exception("API не аутентифицирован")
-            
-            # Используем метод sell_token с пользовательским слиппеджем
-            result = self.api.sell_token(
-                private_key=self.private_key,
-                token_mint=contract_address,
-                amount_tokens=amount_to_sell,
-                slippage_percent=slippage  # Используем пользовательский слиппедж
-            )
-            
-            if not result.get('success', False):
-                raise Exception(f"Ошибка продажи: {result.get('error', 'Unknown error')}")
-            
-            # ДОБАВЛЕННЫЕ СТРОКИ - получаем данные для уведомлений до удаления позиции
-            if result.get('success') or result.get('signature'):
-                # Получаем данные позиции для логирования
-                positions = self.storage.get_positions(user_id)
-                position = next((p for p in positions if p['contract_address'] == contract_address), None)
+                    position = self.storage.get_position(user_id, position_id)
                 
-                if position:
-                    current_price = self.get_token_price(contract_address)
-                    pnl_percent = position.get('pnl', 0)
-                    
-                    # ДОБАВЛЕННЫЕ СТРОКИ:
-                    # Логируем закрытие
-                    self.reports.log_position_close(
-                        user_id=user_id,
-                        contract_address=contract_address,
-                        action='close',
-                        amount_sol=position.get('invested_sol', 0),
-                        token_amount=amount_to_sell,
-                        current_price=current_price,
-                        pnl_percent=pnl_percent,
-                        entry_price=position.get('entry_price')
-                    )
+                # Получаем слиппедж из позиции или используем переданный
+                if slippage is None:
+                    if position:
+                        slippage = position.get('slippage_percent', DEFAULT_SETTINGS['slippage_percent'])
+                    else:
+                        slippage = DEFAULT_SETTINGS['slippage_percent']
+            
+                # Кошелек общий: без позиции продавать нечего - весь баланс контракта принадлежит другим позициям
+                if position is None:
+                    logger.warning(f"No position for {contract_address} (user {user_id}), nothing to sell")
+                    return {'success': False, 'error': 'Позиция не найдена или уже закрыта'}
+            
+                position_id = position['id']
+                logger.info(f"Closing position for {contract_address} ({percentage}%) with {slippage}% slippage")
+            
+                # Продаем токены позиции по учету, а не весь баланс общего кошелька
+                token_balance = self.ledger.available(user_id, position)
+            
+                if token_balance <= 0:
+                    logger.warning(f"No tokens to sell for {contract_address}")
+                    # Если токенов нет, удаляем позицию из хранилища
+                    self.storage.remove_position(user_id, position_id)
+                    return {'signature': 'no_tokens_to_sell'}
+            
+                # Рассчитываем количество токенов для продажи
+                amount_to_sell = token_balance * (percentage / 100.0)
+            
+                if not self.is_authenticated():
+                    raise Exception("API не аутентифицирован")
+            
+                # Продажи того же контракта из других позиций за окно батчинга уйдут одним свопом.
+                # Полное закрытие (SL, panic) - защитный выход, частичная продажа - на уровне тейк-профита
+                priority = PRIORITY_EXIT if percentage >= 100.0 else PRIORITY_TAKE_PROFIT
+                with self.ledger.trading(contract_address):
+                    result = self.sell_batcher.sell(contract_address, amount_to_sell, slippage, priority)
+            
+                if not result.get('success', False):
+                    raise Exception(f"Ошибка продажи: {result.get('error', 'Unknown error')}")
+            
+                self.balances.invalidate()
+            
+                # ДОБАВЛЕННЫЕ СТРОКИ - получаем данные для уведомлений до удаления позиции
+                if result.get('success') or result.get('signature'):
+                    # Получаем данные позиции для логирования
+                    position = self.storage.get_position(user_id, position_id)
+                
+                    if position:
+                        current_price = self.get_token_price(contract_address)
+                        pnl_percent = position.get('pnl', 0)
                     
-                    # Отправляем уведомление
-                    pnl_sol = position.get('invested_sol', 0) * (pnl_percent / 100)
-                    asyncio.create_task(
-                        notification_manager.notify_position_closed(
-                            user_id, contract_address, pnl_percent, pnl_sol, "manual"
+                        # ДОБАВЛЕННЫЕ СТРОКИ:
+                        # Логируем закрытие
+                        close_record = dict(
+                            user_id=user_id,
+                            contract_address=contract_address,
+                            action='close',
+                            amount_sol=position.get('invested_sol', 0),
+                            token_amount=amount_to_sell,
+                            current_price=current_price,
+                            pnl_percent=pnl_percent,
+                            entry_price=position.get('entry_price'),
+                            details=self._fill_details(result)
                         )
-                    )
-            
-            # Если продаем все токены (100%), удаляем позицию
-            if percentage >= 100.0:
-                positions = self.storage.get_positions(user_id)
-                position_to_remove = next((p for p in positions if p['contract_address'] == contract_address), None)
-                if position_to_remove:
-                    self.storage.remove_position(user_id, position_to_remove['id'])
-                    logger.info(f"Position removed from storage: {position_to_remove['id']}")
-            else:
-                # Обновляем количество токенов в позиции
-                positions = self.storage.get_positions(user_id)
-                position = next((p for p in positions if p['contract_address'] == contract_address), None)
-                if position:
-                    new_token_amount = self.get_token_balance(contract_address)
-                    self.storage.update_position(user_id, position['id'], {'token_amount': new_token_amount})
+                        if trade_records is not None:
+                            # Массовое закрытие: записи сохраняются одной пачкой
+                            trade_records.append(self.reports.build_close_record(**close_record))
+                        else:
+                            self.reports.log_position_close(**close_record)
+                    
+                        if notify:
+                            # Отправляем уведомление
+                            pnl_sol = position.get('invested_sol', 0) * (pnl_percent / 100)
+                            self._schedule(
+                                notification_manager.notify_position_closed(
+                                    user_id, contract_address, pnl_percent, pnl_sol, "manual"
+                                )
+                            )
+            
+                # Если продаем все токены (100%), удаляем позицию
+                if percentage >= 100.0:
+                    if self.storage.get_position(user_id, position_id) is not None:
+                        self.storage.remove_position(user_id, position_id)
+                        logger.info(f"Position removed from storage: {position_id}")
+                else:
+                    # Списываем проданное с позиции по учету - без повторного чтения баланса
+                    self.ledger.record_sell(user_id, position_id, amount_to_sell, token_balance)
             
-            return result
+                return result
             
         except Exception as e:
             # ДОБАВЛЕННОЕ УВЕДОМЛЕНИЕ ОБ ОШИБКЕ:
-            asyncio.create_task(
+            self._schedule(
                 notification_manager.notify_error(user_id, str(e), "Закрытие позиции")
             )
             logger.error(f"Ошибка закрытия позиции: {e}")
             raise
     
+    def flatten_groups(self, user_id: int = None) -> List[Tuple[int, str, int]]:
+        """
+        Позиции для массового закрытия: (пользователь, контракт, число позиций).
+        close_position находит позицию по контракту под блокировкой пользователя и контракта
+        (той же, что у триггеров монитора), поэтому позиции группы закрываются последовательно,
+        а разные группы - параллельно.
+        """
+        if user_id is None:
+            positions_data = self.storage.load_positions()
+        else:
+            positions_data = {str(user_id): self.storage.get_positions(user_id)}
+        
+        groups: Dict[Tuple[int, str], int] = {}
+        for uid, positions in positions_data.items():
+            for position in positions:
+                key = (int(uid), position['contract_address'])
+                groups[key] = groups.get(key, 0) + 1
+        return [(uid, contract_address, count) for (uid, contract_address), count in groups.items()]
+    
+    @staticmethod
+    def _flatten_summary(groups: List[Tuple[int, str, int]]) -> Dict:
+        return {'total': sum(count for _, _, count in groups), 'closed': 0, 'skipped': 0, 'failed': 0, 'errors': []}
+    
+    @staticmethod
+    def _flatten_closed(summary: Dict, result: Dict, remaining: int) -> bool:
+        """
+        Учитываем результат закрытия. Если позиции уже нет (ее закрыли SL или panic sell),
+        оставшиеся позиции группы тоже закрыты - считаем их пропущенными и прекращаем группу
+        """
+        if result.get('success') or result.get('signature'):
+            summary['closed'] += 1
+            return True
+        summary['skipped'] += remaining
+        return False
+    
+    @staticmethod
+    def _flatten_failed(summary: Dict, user_id: int, contract_address: str, count: int, error: Exception):
+        """Ошибка закрытия группы: оставшиеся позиции группы считаем незакрытыми"""
+        summary['failed'] += count
+        summary['errors'].append({'user_id': user_id, 'contract_address': contract_address, 'error': str(error)})
+    
+    def flatten_positions(self, user_id: int = None, max_concurrent: int = FLATTEN_MAX_CONCURRENT,
+                          progress: Callable[[Dict], None] = None, requested_by: int = None) -> Dict:
+        """
+        Закрываем все позиции пользователя (user_id=None - всего кошелька). Продажи идут параллельно,
+        не более max_concurrent одновременно; продажи одного контракта объединяет SellBatcher.
+        Все закрытия записываются в отчеты одной пачкой. progress получает копию итогов после каждой позиции.
+        Владельцы позиций, кроме requested_by (по умолчанию user_id), получают обычные уведомления о закрытии.
+        Возвращаем {'total', 'closed', 'skipped', 'failed', 'errors'}.
+        """
+        requested_by = user_id if requested_by is None else requested_by
+        groups = self.flatten_groups(user_id)
+        summary = self._flatten_summary(groups)
+        records = []
+        lock = threading.Lock()
+        logger.info(f"🧹 Массовое закрытие: {summary['total']} позиций, до {max_concurrent} одновременно")
+        
+        def close_group(uid: int, contract_address: str, count: int):
+            for i in range(count):
+                try:
+                    result = self.close_position(
+                        uid, contract_address, 100.0, trade_records=records, notify=uid != requested_by
+                    )
+                    with lock:
+                        if not self._flatten_closed(summary, result, count - i):
+                            return
+                except Exception as e:
+                    with lock:
+                        self._flatten_failed(summary, uid, contract_address, count - i, e)
+                    return
+                finally:
+                    if progress is not None:
+                        with lock:
+                            snapshot = dict(summary, errors=list(summary['errors']))
+                        progress(snapshot)
+        
+        if groups:
+            with ThreadPoolExecutor(max_workers=max_concurrent, thread_name_prefix='flatten') as pool:
+                list(pool.map(lambda group: close_group(*group), groups))
+        
+        self.reports.add_trade_records(records)
+        logger.info(
+            f"🧹 Массовое закрытие завершено: закрыто {summary['closed']}, "
+            f"уже закрыто {summary['skipped']}, ошибок {summary['failed']}"
+        )
+        return summary
+    
+    def _submit_sell(self, contract_address: str, amount_tokens: float, slippage: float,
+                     priority: int = PRIORITY_EXIT) -> Dict:
+        """
+        Один своп токена в SOL; вызывается SellBatcher с суммарным объемом пачки.
+        Из рабочего потока при запущенном боте своп ставится в очередь исполнения одной операцией
+        """
+        if self.queue is not None and self.loop is not None and not self._in_loop():
+            return asyncio.run_coroutine_threadsafe(
+                self.queue.submit(priority, self._sell_token, contract_address, amount_tokens, slippage), self.loop
+            ).result()
+        return self._sell_token(contract_address, amount_tokens, slippage)
+    
+    def _in_loop(self) -> bool:
+        try:
+            return asyncio.get_running_loop() is self.loop
+        except RuntimeError:
+            return False
+    
+    def _sell_token(self, contract_address: str, amount_tokens: float, slippage: float) -> Dict:
+        with axiom_request_seconds.time(operation='sell'):
+            return self.api.sell_token(
+                private_key=self.private_key,
+                token_mint=contract_address,
+                amount_tokens=amount_tokens,
+                slippage_percent=slippage  # Используем пользовательский слиппедж
+            )
+    
+    @staticmethod
+    def _fill_details(result: Dict) -> Dict:
+        """
+        Данные исполнения для истории: подпись свопа, доля позиции в объединенной продаже
+        и объемы исполнения (полученные SOL и т.п.), уже пересчитанные на долю позиции
+        """
+        details = {
+            key: value for key, value in result.items()
+            if is_split_amount(key, value) and key not in ('amount_tokens', 'batch_size', 'batch_share')
+        }
+        details.update(
+            tx_hash=result.get('signature'),
+            batch_size=result.get('batch_size', 1),
+            batch_share=result.get('batch_share', 1.0)
+        )
+        return details
+    
     def execute_stop_loss(self, user_id: int, position: Dict) -> bool:
         """Выполняем стоп-лосс"""
         try:
@@ -235,7 +498,7 @@ class AxiomClient:
             # Получаем данные для уведомления
             pnl_percent = position.get('pnl', 0)
             
-            result = self.close_position(user_id, contract_address, 100.0)
+            result = self.close_position(user_id, contract_address, 100.0, position_id=position['id'])
             
             if result.get('success') or result.get('signature'):
                 logger.info(f"Stop Loss executed successfully for {contract_address}")
@@ -251,11 +514,12 @@ class AxiomClient:
                     token_amount=position.get('token_amount', 0),
                     current_price=current_price,
                     pnl_percent=pnl_percent,
-                    entry_price=position.get('entry_price')
+                    entry_price=position.get('entry_price'),
+                    details=self._fill_details(result)
                 )
                 
                 # Отправляем уведомление
-                asyncio.create_task(
+                self._schedule(
                     notification_manager.notify_stop_loss(user_id, contract_address, pnl_percent)
                 )
                 
@@ -267,7 +531,7 @@ class AxiomClient:
         except Exception as e:
             logger.error(f"Ошибка выполнения Stop Loss: {e}")
             # Уведомление об ошибке
-            asyncio.create_task(
+            self._schedule(
                 notification_manager.notify_error(user_id, str(e), "Stop Loss")
             )
             return False
@@ -291,7 +555,7 @@ class AxiomClient:
             
             logger.info(f"Executing Take Profit {tp_level}x for {contract_address} ({volume_percent}%)")
             
-            result = self.close_position(user_id, contract_address, volume_percent)
+            result = self.close_position(user_id, contract_address, volume_percent, position_id=position['id'])
             
             if result.get('success') or result.get('signature'):
                 logger.info(f"Take Profit {tp_level}x executed successfully for {contract_address}")
@@ -309,11 +573,12 @@ class AxiomClient:
                     token_amount=position.get('token_amount', 0) * (volume_percent / 100),
                     current_price=current_price,
                     pnl_percent=pnl_percent,
-                    entry_price=position.get('entry_price')
+                    entry_price=position.get('entry_price'),
+                    details=self._fill_details(result)
                 )
                 
                 # Отправляем уведомление
-                asyncio.create_task(
+                self._schedule(
                     notification_manager.notify_take_profit(
                         user_id, contract_address, tp_level, volume_percent, pnl_percent
                     )
@@ -327,7 +592,7 @@ class AxiomClient:
         except Exception as e:
             logger.error(f"Ошибка выполнения Take Profit: {e}")
             # Уведомление об ошибке
-            asyncio.create_task(
+            self._schedule(
                 notification_manager.notify_error(user_id, str(e), "Take Profit")
             )
             return False
@@ -351,7 +616,7 @@ class AxiomClient:
             # ДОБАВЛЕННЫЕ СТРОКИ:
             # Отправляем уведомление
             pnl_percent = position.get('pnl', 0)
-            asyncio.create_task(
+            self._schedule(
                 notification_manager.notify_breakeven(user_id, contract_address, pnl_percent)
             )
             
@@ -360,17 +625,24 @@ class AxiomClient:
         except Exception as e:
             logger.error(f"Ошибка перемещения в безубыток: {e}")
             # Уведомление об ошибке
-            asyncio.create_task(
+            self._schedule(
                 notification_manager.notify_error(user_id, str(e), "Breakeven")
             )
             return False
     
-    def get_token_balance(self, contract_address: str) -> float:
+    def get_token_balance(self, contract_address: str, max_age: float = None) -> float:
+        """Баланс токена из снимка кошелька (max_age=0 - только что перечитанный); SDK - запасной путь"""
         try:
-            balance = self.api.get_token_balance(
-                wallet_address=self.wallet_address,
-                token_mint=contract_address
-            )
+            return self.balances.get_balance(contract_address, max_age)
+        except Exception as e:
+            logger.warning(f"Снимок балансов недоступен, запрашиваем баланс через SDK: {e}")
+        
+        try:
+            with axiom_request_seconds.time(operation='balance'):
+                balance = self.api.get_token_balance(
+                    wallet_address=self.wallet_address,
+                    token_mint=contract_address
+                )
             logger.debug(f"Token balance for {contract_address}: {balance}")
             return balance if balance is not None else 0.0
         except Exception as e:
@@ -403,3 +675,150 @@ class AxiomClient:
     
     def get_user_positions(self, user_id: int) -> List[Dict]:
         return self.storage.get_positions(user_id)
+
+class AsyncAxiomClient:
+    """
+    Асинхронный фасад над AxiomClient.
+    Блокирующие вызовы SDK выполняются в ограниченном пуле потоков, поэтому покупка
+    одного пользователя не останавливает бота и стоп-лоссы остальных.
+    """
+    
+    def __init__(self, client: AxiomClient, executor: ThreadPoolExecutor = None, queue: ExecutionQueue = None,
+                 exit_executor: ThreadPoolExecutor = None):
+        self.client = client
+        self.executor = executor or trade_executor
+        self.exit_executor = exit_executor or stop_loss_executor
+        self.queue = queue or execution_queue
+        client.queue = self.queue  # Свопы продаж из пула потоков идут в ту же очередь
+        self.storage = client.storage
+        self.reports = client.reports
+        self.ledger = client.ledger
+        self.wallet_address = client.wallet_address
+    
+    async def _run(self, func, *args, **kwargs):
+        """Выполняем синхронный метод клиента в пуле потоков"""
+        return await self._run_in(self.executor, func, *args, **kwargs)
+    
+    async def _run_in(self, executor: ThreadPoolExecutor, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        self.client.loop = loop
+        return await loop.run_in_executor(executor, functools.partial(func, *args, **kwargs))
+    
+    async def _submit(self, priority: int, func, *args, **kwargs):
+        """Торговую операцию исполняем через очередь с приоритетами"""
+        self.client.loop = asyncio.get_running_loop()
+        return await self.queue.submit(priority, func, *args, **kwargs)
+    
+    async def get_token_price(self, contract_address: str, max_age: float = None) -> float:
+        """Цена из общего кэша; при отсутствии или устаревании - через общую HTTP сессию"""
+        return await price_cache.get_or_fetch(contract_address, self._fetch_token_price, max_age)
+    
+    async def _fetch_token_price(self, contract_address: str) -> float:
+        prices = await fetch_token_prices([contract_address])
+        return prices.get(contract_address, 0.0)
+    
+    async def get_account_info(self) -> Dict:
+        return await self._run(self.client.get_account_info)
+    
+    async def get_token_balance(self, contract_address: str, max_age: float = None) -> float:
+        # Свежий снимок читаем прямо из памяти, без переключения в пул потоков
+        balance = self.client.balances.get_cached(contract_address, max_age)
+        if balance is not None:
+            return balance
+        return await self._run(self.client.get_token_balance, contract_address, max_age)
+    
+    async def is_authenticated(self) -> bool:
+        return await self._run(self.client.is_authenticated)
+    
+    async def open_position(self, user_id: int, contract_address: str, amount: float, sl: float, tp: list, breakeven: float, slippage: float = None) -> Dict:
+        try:
+            entry_price = await self.get_token_price(contract_address, max_age=0)
+            async with self.ledger.buying_async(contract_address):
+                entry_price, slippage_percent, result, pre_balance = await self._submit(
+                    PRIORITY_BUY, self.client._execute_buy, contract_address, amount, slippage, entry_price
+                )
+                
+                # Ждем подтверждения покупки, не блокируя event loop
+                token_balance, confirmation_time = await self.wait_for_balance_change(contract_address, pre_balance)
+            
+            token_amount, fill_pending = self.ledger.filled_amount(pre_balance, token_balance)
+            return await self._run(
+                self.client._register_position,
+                user_id, contract_address, amount, sl, tp, breakeven,
+                slippage_percent, entry_price, token_amount, result, confirmation_time, fill_pending
+            )
+            
+        except Exception as e:
+            self.client._schedule(
+                notification_manager.notify_error(user_id, str(e), "Открытие позиции")
+            )
+            logger.error(f"Ошибка открытия позиции: {e}")
+            raise
+    
+    async def wait_for_balance_change(self, contract_address: str, previous_balance: float,
+                                      timeout: float = None) -> Tuple[Optional[float], float]:
+        """Асинхронная версия AxiomClient.wait_for_balance_change"""
+        confirmation = balance_confirmation(contract_address, previous_balance, timeout)
+        try:
+            delay = next(confirmation)
+            while True:
+                await asyncio.sleep(delay)
+                delay = confirmation.send(await self.get_token_balance(contract_address, max_age=0))
+        except StopIteration as done:
+            return done.value
+    
+    async def close_position(self, user_id: int, contract_address: str, percentage: float = 100.0, slippage: float = None) -> Dict:
+        # В очередь исполнения попадает только своп (см. AxiomClient._submit_sell), уже объединенный SellBatcher
+        return await self._run(self.client.close_position, user_id, contract_address, percentage, slippage)
+    
+    async def flatten_positions(self, user_id: int = None, max_concurrent: int = FLATTEN_MAX_CONCURRENT,
+                                progress: Callable[[Dict], None] = None, requested_by: int = None) -> Dict:
+        """
+        Асинхронная версия AxiomClient.flatten_positions: продажи идут через очередь исполнения
+        как защитные выходы, но не больше max_concurrent одновременно - остальным выходам остается место
+        """
+        requested_by = user_id if requested_by is None else requested_by
+        groups = await self._run(self.client.flatten_groups, user_id)
+        summary = self.client._flatten_summary(groups)
+        records = []
+        semaphore = asyncio.Semaphore(max_concurrent)
+        logger.info(f"🧹 Массовое закрытие: {summary['total']} позиций, до {max_concurrent} одновременно")
+        
+        async def close_group(uid: int, contract_address: str, count: int):
+            async with semaphore:
+                for i in range(count):
+                    try:
+                        result = await self._run(
+                            self.client.close_position, uid, contract_address, 100.0,
+                            trade_records=records, notify=uid != requested_by
+                        )
+                        if not self.client._flatten_closed(summary, result, count - i):
+                            return
+                    except Exception as e:
+                        self.client._flatten_failed(summary, uid, contract_address, count - i, e)
+                        return
+                    finally:
+                        if progress is not None:
+                            progress(dict(summary, errors=list(summary['errors'])))
+        
+        await asyncio.gather(*(close_group(*group) for group in groups))
+        await self._run(self.reports.add_trade_records, records)
+        logger.info(
+            f"🧹 Массовое закрытие завершено: закрыто {summary['closed']}, "
+            f"уже закрыто {summary['skipped']}, ошибок {summary['failed']}"
+        )
+        return summary
+    
+    async def execute_stop_loss(self, user_id: int, position: Dict) -> bool:
+        # Свои потоки: SL не ждет освобождения trade_executor от тейк-профитов в очереди свопов
+        return await self._run_in(self.exit_executor, self.client.execute_stop_loss, user_id, position)
+    
+    async def execute_take_profit(self, user_id: int, position: Dict, tp_index: int) -> bool:
+        return await self._run(self.client.execute_take_profit, user_id, position, tp_index)
+    
+    async def move_to_breakeven(self, user_id: int, position: Dict) -> bool:
+        # Только запись в хранилище: через очередь свопов защитный перенос SL мог бы отклониться или истечь
+        return await self._run(self.client.move_to_breakeven, user_id, position)
+    
+    def get_user_positions(self, user_id: int) -> List[Dict]:
+        return self.client.get_user_positions(user_id)
@@ -0,0 +1,536 @@
+"""
+Офлайн бенчмарк мониторинга цен, хранилища позиций и отчетов.
+
+Для каждого размера (по умолчанию 10 / 1000 / 100000 строк) в отдельном процессе:
+  * генерируются синтетические positions.json и trade_history.json;
+  * поднимается локальный фейковый Jupiter Price API, SDK Axiom заменяется заглушкой с задержкой;
+  * замеряются загрузка и сброс позиций, загрузка истории и статистика, время цикла
+    PriceMonitor, доставка пачки цен через WebSocket источник, задержка от срабатывания SL
+    до подписанной продажи (p50/p99), CPU и пиковый RSS.
+
+Запуск:
+    python benchmark.py
+    python benchmark.py --sizes 10,1000 --backend sqlite --sdk-latency 0.1 --output bench_output.txt
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List, Set
+
+from aiohttp import web
+
+try:
+    import resource
+except ImportError:  # Windows: CPU и RSS не замеряются
+    resource = None
+
+DEFAULT_SIZES = (10, 1000, 100000)
+POSITIONS_PER_MINT = 10
+TRADES_PER_USER = 1000
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def _percentile(values: List[float], percent: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(int(round(percent / 100 * (len(ordered) - 1))), len(ordered) - 1)
+    return ordered[index]
+
+def mint_address(index: int) -> str:
+    return f"BENCH{index:039d}"
+
+def generate_positions(size: int) -> Dict[str, List[dict]]:
+    """Синтетические позиции в формате positions.json: по POSITIONS_PER_MINT держателей на контракт"""
+    now = time.time()
+    positions = {}
+    for i in range(size):
+        user_id = str(100000 + i % max(1, size // 100))
+        contract_address = mint_address(i // POSITIONS_PER_MINT)
+        positions.setdefault(user_id, []).append({
+            'id': f"{contract_address}_{i}",
+            'contract_address': contract_address,
+            'invested_sol': 0.1,
+            'token_amount': 1000.0,
+            'entry_price': 1.0,
+            'current_price': 1.0,
+            'pnl': 0.0,
+            'sl': 15,
+            'tp_levels': [
+                {'level': 1.5, 'volume_percent': 25},
+                {'level': 2, 'volume_percent': 25},
+                {'level': 5, 'volume_percent': 50}
+            ],
+            'breakeven_percent': 15,
+            'slippage_percent': 15,
+            'transaction_hash': f"bench_{i}",
+            'confirmation_time': 1.0,
+            'timestamp': now - i,
+            'breakeven_moved': False,
+            'tp_executed': []
+        })
+    return positions
+
+def generate_trades(size: int, seed: int = 42) -> List[dict]:
+    """Синтетическая история в формате trade_history.json: пары открытие/закрытие за 90 дней"""
+    rng = random.Random(seed)
+    now = time.time()
+    users = max(1, size // TRADES_PER_USER)
+    trades = []
+    for i in range(0, size, 2):
+        user_id = 100000 + (i // 2) % users
+        contract_address = mint_address(rng.randrange(max(1, size // 20)))
+        opened_at = now - rng.uniform(0, 90 * 86400)
+        pnl_percent = rng.uniform(-50, 200)
+        pair = [('open', opened_at, 0.0)]
+        if i + 1 < size:
+            pair.append((rng.choice(('close', 'sl', 'tp')), opened_at + rng.uniform(60, 86400), pnl_percent))
+        for action, timestamp, pnl in pair:
+            trades.append({
+                'id': f"{contract_address}_{action}_{i}",
+                'user_id': user_id,
+                'contract_address': contract_address,
+                'action': action,
+                'amount_sol': 0.1,
+                'token_amount': 1000.0,
+                'price': 1.0 + pnl / 100,
+                'pnl_percent': pnl,
+                'pnl_sol': 0.1 * pnl / 100,
+                'timestamp': timestamp,
+                'date': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(timestamp)),
+                'details': {}
+            })
+    return trades
+
+class FakeJupiterServer:
+    """
+    Локальный Price API в формате Jupiter: GET /price?ids=a,b,c.
+    Заодно отвечает на getTokenAccountsByOwner (POST /rpc) для снимка балансов кошелька
+    """
+
+    def __init__(self, port: int, latency: float = 0.0):
+        self.port = port
+        self.latency = latency
+        self.prices: Dict[str, float] = {}
+        self.requests = 0
+        self.rpc_requests = 0
+        self._runner = None
+
+    async def start(self):
+        async def handle_price(request):
+            self.requests += 1
+            if self.latency:
+                await asyncio.sleep(self.latency)
+            ids = [i for i in request.query.get('ids', '').split(',') if i]
+            data = {i: {'id': i, 'price': self.prices[i]} for i in ids if i in self.prices}
+            return web.json_response({'data': data})
+
+        async def handle_rpc(request):
+            self.rpc_requests += 1
+            responses = []
+            for call in await request.json():
+                # Все токены - в первой программе, во второй (Token-2022) аккаунтов нет
+                accounts = [] if call['id'] else [
+                    {'account': {'data': {'parsed': {'info': {
+                        'mint': mint, 'tokenAmount': {'amount': '1000000', 'decimals': 3, 'uiAmountString': '1000'}
+                    }}}}}
+                    for mint in self.prices
+                ]
+                responses.append({'jsonrpc': '2.0', 'id': call['id'], 'result': {'value': accounts}})
+            return web.json_response(responses)
+
+        app = web.Application()
+        app.router.add_get('/price', handle_price)
+        app.router.add_post('/rpc', handle_rpc)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, '127.0.0.1', self.port).start()
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+class FakePriceStreamServer:
+    """
+    Локальный WebSocket сервер цен в протоколе StreamingPriceSource; цены рассылаются через publish().
+    subscribed срабатывает, когда клиент прислал подписку
+    """
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0):
+        self.host = host
+        self.port = port
+        self.subscribed = asyncio.Event()
+        self._clients: Dict[web.WebSocketResponse, Set[str]] = {}
+        self._runner = None
+
+    @property
+    def url(self) -> str:
+        return f"ws://{self.host}:{self.port}/ws"
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get('/ws', self._handle_ws)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        # Если порт выбран системой - узнаем фактический
+        self.port = self._runner.addresses[0][1]
+
+    async def stop(self):
+        for ws in list(self._clients):
+            await ws.close()
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def publish(self, prices: Dict[str, float]):
+        """Рассылаем цены всем подписанным клиентам"""
+        for ws, subscriptions in list(self._clients.items()):
+            data = {k: {'price': v} for k, v in prices.items() if k in subscriptions}
+            if data and not ws.closed:
+                await ws.send_json({'data': data})
+
+    async def _handle_ws(self, request):
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        self._clients[ws] = set()
+        try:
+            async for message in ws:
+                if message.type != web.WSMsgType.TEXT:
+                    continue
+                payload = json.loads(message.data)
+                if payload.get('action') == 'subscribe':
+                    self._clients[ws] = set(payload.get('ids') or [])
+                    self.subscribed.set()
+        finally:
+            self._clients.pop(ws, None)
+        return ws
+
+class StubAxiomTradeClient:
+    """Заглушка AxiomTradeClient: каждый вызов SDK блокирует поток на latency секунд"""
+
+    def __init__(self, latency: float = 0.05):
+        self.latency = latency
+        self.calls = 0
+
+    def _call(self):
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def buy_token(self, private_key, token_mint, amount_sol, slippage_percent):
+        self._call()
+        return {'success': True, 'signature': f"stub_buy_{self.calls}"}
+
+    def sell_token(self, private_key, token_mint, amount_tokens, slippage_percent):
+        self._call()
+        return {'success': True, 'signature': f"stub_sell_{self.calls}"}
+
+    def get_token_balance(self, wallet_address, token_mint):
+        self._call()
+        return 1000.0
+
+    def is_authenticated(self):
+        return True
+
+    def GetBalance(self, wallet_address):
+        self._call()
+        return {'sol': 100.0}
+
+class LatencyRecorder:
+    """Собирает сырые замеры задержки триггеров для расчета перцентилей"""
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+        self.samples: List[float] = []
+
+    def observe(self, value: float, **labels):
+        self.samples.append(value)
+        self.histogram.observe(value, **labels)
+
+def _configure_environment(workdir: str, port: int, backend: str):
+    # Конфиг читается при импорте модулей бота - окружение задаем до него.
+    # Реальные ключи из .env не используются: SDK все равно заменен заглушкой
+    os.environ.update({
+        'BOT_TOKEN': '123456:BENCHMARK',
+        'ALLOWED_USER_IDS': '100000',
+        'WALLET_ADDRESS': 'BenchmarkWallet1111111111111111111111111111',
+        'PRIVATE_KEY': 'benchmark',
+        'JUPITER_PRICE_URL': f"http://127.0.0.1:{port}/price",
+        'SOLANA_RPC_URL': f"http://127.0.0.1:{port}/rpc",
+        'STORAGE_BACKEND': backend,
+        'SQLITE_DB_PATH': os.path.join(workdir, 'axiom.db'),
+        'METRICS_FILE': '',
+        'PRICE_STREAM_URL': ''
+    })
+
+async def _run_scenario(size: int, args, port: int, data_dir: str) -> Dict:
+    # Модули бота импортируются только после настройки окружения
+    import price_monitor as price_monitor_module
+    from api_client import AxiomClient, AsyncAxiomClient
+    from http_session import close_session
+    from notifications import notification_manager
+    from price_monitor import PriceMonitor
+    from reports import ReportsManager, SQLiteReportsManager
+    from sqlite_storage import SQLitePositionStorage
+    from storage import PositionStorage
+    from token_ledger import TokenLedger
+    from wallet_balances import wallet_balances
+
+    async def discard_notification(user_id, message, notification_type='info'):
+        pass
+
+    notification_manager.send_notification = discard_notification
+
+    result = {'size': size, 'backend': args.backend}
+    positions_file = os.path.join(data_dir, 'positions.json')
+    history_file = os.path.join(data_dir, 'trade_history.json')
+
+    # Хранилище позиций
+    started = time.perf_counter()
+    if args.backend == 'sqlite':
+        storage = SQLitePositionStorage(os.path.join(data_dir, 'bench.db'), positions_file)
+    else:
+        storage = PositionStorage(positions_file, flush_interval=3600)
+    result['storage_load_s'] = time.perf_counter() - started
+
+    # История сделок и статистика
+    started = time.perf_counter()
+    if args.backend == 'sqlite':
+        reports = SQLiteReportsManager(os.path.join(data_dir, 'bench.db'), history_file,
+                                       history_dir=os.path.join(data_dir, 'trade_history'))
+    else:
+        reports = ReportsManager(os.path.join(data_dir, 'trade_history'), (history_file,))
+    result['reports_load_s'] = time.perf_counter() - started
+
+    # Первый запрос строит агрегаты по всей истории, последующие читают только дневные корзины
+    started = time.perf_counter()
+    reports.get_user_statistics(100000, days=7)
+    result['stats_first_s'] = time.perf_counter() - started
+    started = time.perf_counter()
+    reports.get_user_statistics(100000, days=30)
+    result['stats_30d_s'] = time.perf_counter() - started
+    started = time.perf_counter()
+    reports.get_user_statistics(100000)
+    result['stats_all_s'] = time.perf_counter() - started
+
+    # Настоящий конструктор клиента (батчер продаж, очередь и т.д.) с заглушкой SDK и хранилищами замера
+    client = AxiomClient(
+        api=StubAxiomTradeClient(args.sdk_latency),
+        storage=storage,
+        reports=reports,
+        ledger=TokenLedger(storage, wallet_balances, reconcile_interval=0)
+    )
+
+    server = FakeJupiterServer(port, args.price_latency)
+    mint_count = (size + POSITIONS_PER_MINT - 1) // POSITIONS_PER_MINT
+    server.prices = {mint_address(i): 1.0 for i in range(mint_count)}
+    await server.start()
+
+    recorder = LatencyRecorder(price_monitor_module.trigger_to_signature_seconds)
+    price_monitor_module.trigger_to_signature_seconds = recorder
+
+    monitor = PriceMonitor(
+        AsyncAxiomClient(client),
+        check_interval=args.check_interval,
+        batch_size=args.batch_size,
+        max_concurrent_triggers=args.max_concurrent_triggers
+    )
+
+    async def full_cycle():
+        """Один цикл опроса всех контрактов, как в check_prices при наступлении срока у каждого"""
+        mint_index = monitor.refresh_mint_index(force=True)
+        prices = await monitor.get_token_prices(list(mint_index))
+        for contract_address, holders in mint_index.items():
+            current_price = prices.get(contract_address, 0.0)
+            if current_price > 0:
+                await monitor.process_mint_price(contract_address, current_price, holders)
+
+    try:
+        # Циклы без срабатываний
+        cycle_times = []
+        for _ in range(args.cycles):
+            started = time.perf_counter()
+            await full_cycle()
+            cycle_times.append(time.perf_counter() - started)
+        result['cycle_avg_s'] = sum(cycle_times) / len(cycle_times)
+        result['cycle_max_s'] = max(cycle_times)
+        result['price_requests'] = server.requests
+
+        # Потоковые котировки: от публикации на сервере до получения всех цен источником
+        result['stream_tick_s'] = await _measure_stream_tick(server.prices)
+
+        # Сброс накопленных изменений цен на диск
+        started = time.perf_counter()
+        storage.flush()
+        result['flush_s'] = time.perf_counter() - started
+
+        # Обвал цены: SL срабатывает примерно у args.triggers позиций
+        crashed_mints = max(1, min(args.triggers, size) // POSITIONS_PER_MINT)
+        for i in range(min(crashed_mints, mint_count)):
+            server.prices[mint_address(i)] = 0.5
+        await full_cycle()
+        await asyncio.gather(*list(monitor._trigger_tasks), return_exceptions=True)
+
+        result['triggers'] = len(recorder.samples)
+        result['trigger_p50_s'] = _percentile(recorder.samples, 50)
+        result['trigger_p99_s'] = _percentile(recorder.samples, 99)
+        result['balance_requests'] = server.rpc_requests
+    finally:
+        await server.stop()
+        reports.close()
+        await close_session()
+
+    return result
+
+async def _measure_stream_tick(prices: Dict[str, float]) -> float:
+    """Время доставки одной пачки цен через StreamingPriceSource от локального WebSocket сервера"""
+    from price_sources import StreamingPriceSource
+
+    stream_server = FakePriceStreamServer()
+    await stream_server.start()
+    source = StreamingPriceSource(stream_server.url)
+    received: Dict[str, float] = {}
+    delivered = asyncio.Event()
+
+    async def on_prices(tick: Dict[str, float]):
+        received.update(tick)
+        if len(received) >= len(prices):
+            delivered.set()
+
+    try:
+        await source.start(on_prices)
+        await source.subscribe(prices)
+        await asyncio.wait_for(stream_server.subscribed.wait(), timeout=10)
+        started = time.perf_counter()
+        await stream_server.publish(prices)
+        await asyncio.wait_for(delivered.wait(), timeout=30)
+        return time.perf_counter() - started
+    finally:
+        await source.stop()
+        await stream_server.stop()
+
+def run_size(size: int, args) -> Dict:
+    """Прогон одного размера: вызывается в дочернем процессе"""
+    workdir = tempfile.mkdtemp(prefix='axiom_bench_')
+    data_dir = os.path.join(workdir, 'data')
+    os.makedirs(data_dir)
+    try:
+        with open(os.path.join(data_dir, 'positions.json'), 'w') as f:
+            json.dump(generate_positions(size), f)
+        with open(os.path.join(data_dir, 'trade_history.json'), 'w') as f:
+            json.dump(generate_trades(size), f)
+
+        port = _free_port()
+        _configure_environment(workdir, port, args.backend)
+        # Глобальные хранилища модулей создаются в рабочем каталоге и не трогают данные бота
+        os.chdir(workdir)
+        sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+        cpu_before = _cpu_seconds()
+        result = asyncio.run(_run_scenario(size, args, port, data_dir))
+        result['cpu_s'] = _cpu_seconds() - cpu_before
+        result['peak_rss_mb'] = _peak_rss_mb()
+        return result
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def _cpu_seconds() -> float:
+    if resource is None:
+        return 0.0
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+def _peak_rss_mb() -> float:
+    if resource is None:
+        return 0.0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux отдает килобайты, macOS - байты
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+COLUMNS = (
+    ('size', 'строк', '{:d}'),
+    ('storage_load_s', 'загр.поз', '{:.3f}'),
+    ('flush_s', 'сброс', '{:.3f}'),
+    ('reports_load_s', 'загр.ист', '{:.3f}'),
+    ('stats_first_s', 'стат.1й', '{:.3f}'),
+    ('stats_30d_s', 'стат30д', '{:.4f}'),
+    ('stats_all_s', 'стат.все', '{:.4f}'),
+    ('cycle_avg_s', 'цикл.ср', '{:.3f}'),
+    ('cycle_max_s', 'цикл.макс', '{:.3f}'),
+    ('stream_tick_s', 'поток', '{:.3f}'),
+    ('triggers', 'SL', '{:d}'),
+    ('trigger_p50_s', 'SL p50', '{:.3f}'),
+    ('trigger_p99_s', 'SL p99', '{:.3f}'),
+    ('cpu_s', 'CPU,с', '{:.2f}'),
+    ('peak_rss_mb', 'RSS,МБ', '{:.1f}'),
+)
+
+def format_results(results: List[Dict], args) -> str:
+    lines = [
+        f"Бэкенд: {args.backend}, задержка SDK: {args.sdk_latency}с, задержка цен: {args.price_latency}с, "
+        f"циклов: {args.cycles} (время в секундах)",
+        '  '.join(f"{title:>10}" for _, title, _ in COLUMNS)
+    ]
+    for result in results:
+        lines.append('  '.join(f"{fmt.format(result.get(key, 0)):>10}" for key, _, fmt in COLUMNS))
+    return '\n'.join(lines)
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Офлайн бенчмарк мониторинга, хранилища и отчетов')
+    parser.add_argument('--sizes', default=','.join(map(str, DEFAULT_SIZES)),
+                        help='Размеры наборов позиций и сделок через запятую')
+    parser.add_argument('--backend', choices=('json', 'sqlite'), default='json')
+    parser.add_argument('--sdk-latency', type=float, default=0.05, help='Задержка каждого вызова SDK (с)')
+    parser.add_argument('--price-latency', type=float, default=0.0, help='Задержка ответа Price API (с)')
+    parser.add_argument('--cycles', type=int, default=3, help='Циклов опроса без срабатываний')
+    parser.add_argument('--triggers', type=int, default=100, help='Сколько позиций получают SL')
+    parser.add_argument('--batch-size', type=int, default=100)
+    parser.add_argument('--check-interval', type=float, default=30)
+    parser.add_argument('--max-concurrent-triggers', type=int, default=5)
+    parser.add_argument('--output', help='Дополнительно записать таблицу в файл')
+    parser.add_argument('--run-size', type=int, help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    if args.run_size is not None:
+        logging.basicConfig(level=logging.WARNING)
+        print(json.dumps(run_size(args.run_size, args)))
+        return
+
+    # Каждый размер - в отдельном процессе, чтобы RSS и CPU не смешивались
+    passthrough = list(argv if argv is not None else sys.argv[1:])
+    results = []
+    for size in (int(s) for s in args.sizes.split(',') if s.strip()):
+        print(f"⏱ Размер {size}...", file=sys.stderr)
+        completed = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), *passthrough, '--run-size', str(size)],
+            capture_output=True, text=True
+        )
+        if completed.returncode != 0:
+            print(completed.stderr, file=sys.stderr)
+            raise SystemExit(f"Прогон размера {size} завершился с ошибкой")
+        results.append(json.loads(completed.stdout.strip().splitlines()[-1]))
+
+    table = format_results(results, args)
+    print(table)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(table + '\n')
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,5 @@
 import logging
-from aiogram import Bot, Dispatcher, types, F
+from aiogram import Dispatcher, types, F
 from aiogram.filters import Command
 from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.fsm.context import FSMContext
@@ -9,12 +9,12 @@ import asyncio
 import re
 from datetime import datetime
 
-from config import BOT_TOKEN, DEFAULT_SETTINGS, ALLOWED_USER_IDS
-from api_client import AxiomClient
-from storage import PositionStorage
+from config import DEFAULT_SETTINGS, ALLOWED_USER_IDS, ADMIN_USER_IDS, FLATTEN_PROGRESS_INTERVAL
+from api_client import AxiomClient, AsyncAxiomClient
 from middleware import WhitelistMiddleware  # Импортируем наш middleware
-from reports import ReportsManager  # ДОБАВЛЕННЫЙ ИМПОРТ
+from reports import reports_manager  # ДОБАВЛЕННЫЙ ИМПОРТ
 from notifications import notification_manager  # ДОБАВЛЕННЫЙ ИМПОРТ
+from telegram_bot import get_bot, close_bot
 
 # Настройка логирования
 logging.basicConfig(
@@ -23,8 +23,8 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Инициализация бота и диспетчера
-bot = Bot(token=BOT_TOKEN)
+# Инициализация бота и диспетчера (бот общий с системой уведомлений)
+bot = get_bot()
 storage_fsm = MemoryStorage()
 dp = Dispatcher(storage=storage_fsm)
 
@@ -35,11 +35,8 @@ dp.callback_query.middleware(whitelist_middleware)
 
 logger.info(f"🔒 Whitelist активирован для пользователей: {ALLOWED_USER_IDS}")
 
-# Инициализация клиентов
-axiom_client = AxiomClient()
-
-# ДОБАВЛЕННАЯ ИНИЦИАЛИЗАЦИЯ СИСТЕМ ОТЧЕТНОСТИ
-reports_manager = ReportsManager()
+# Инициализация клиентов (блокирующие вызовы SDK выполняются в пуле потоков)
+axiom_client = AsyncAxiomClient(AxiomClient())
 
 # Состояния для FSM
 class TradeStates(StatesGroup):
@@ -124,6 +121,13 @@ def position_details_keyboard(contract_address):
     ]
     return types.InlineKeyboardMarkup(inline_keyboard=keyboard)
 
+def flatten_confirm_keyboard(scope):
+    keyboard = [
+        [types.InlineKeyboardButton(text="🧹 Да, закрыть все", callback_data=f'flatten_confirm_{scope}')],
+        [types.InlineKeyboardButton(text="🔙 Отмена", callback_data='back_to_menu')]
+    ]
+    return types.InlineKeyboardMarkup(inline_keyboard=keyboard)
+
 # НОВЫЕ КЛАВИАТУРЫ
 def reports_keyboard():
     keyboard = [
@@ -483,7 +487,7 @@ async def show_balance(callback_query: CallbackQuery):
     
     try:
         # Проверяем аутентификацию
-        if not axiom_client.is_authenticated():
+        if not await axiom_client.is_authenticated():
             await callback_query.message.edit_text(
                 "❌ Ошибка аутентификации с Axiom Trade API.\n"
                 "Проверьте токены в конфигурации.",
@@ -491,7 +495,7 @@ async def show_balance(callback_query: CallbackQuery):
             )
             return
         
-        account_info = axiom_client.get_account_info()
+        account_info = await axiom_client.get_account_info()
         balance = account_info.get('balance', 0)
         
         text = f"""
@@ -700,8 +704,7 @@ async def show_position_details(callback_query: CallbackQuery):
     contract_address = callback_query.data.replace('position_details_', '')
     
     try:
-        positions = axiom_client.get_user_positions(callback_query.from_user.id)
-        position = next((p for p in positions if p['contract_address'] == contract_address), None)
+        position = axiom_client.storage.find_position(callback_query.from_user.id, contract_address)
         
         if not position:
             await callback_query.message.edit_text(
@@ -711,7 +714,7 @@ async def show_position_details(callback_query: CallbackQuery):
             return
         
         # Получаем актуальную информацию
-        current_price = axiom_client.get_token_price(contract_address)
+        current_price = await axiom_client.get_token_price(contract_address)
         if current_price > 0:
             entry_price = position.get('entry_price', 0)
             pnl = ((current_price - entry_price) / entry_price * 100) if entry_price > 0 else 0
@@ -785,7 +788,7 @@ async def partial_sell(callback_query: CallbackQuery):
     try:
         processing_msg = await callback_query.message.edit_text("🔄 Выполняем частичную продажу...")
         
-        result = axiom_client.close_position(callback_query.from_user.id, contract_address, percentage)
+        result = await axiom_client.close_position(callback_query.from_user.id, contract_address, percentage)
         
         if result.get('success') or result.get('signature'):
             await processing_msg.edit_text(
@@ -817,7 +820,7 @@ async def panic_sell(callback_query: CallbackQuery):
     try:
         processing_msg = await callback_query.message.edit_text("🚨 Выполняем экстренную продажу...")
         
-        result = axiom_client.close_position(callback_query.from_user.id, contract_address, 100.0)
+        result = await axiom_client.close_position(callback_query.from_user.id, contract_address, 100.0)
         
         if result.get('success') or result.get('signature'):
             await processing_msg.edit_text(
@@ -839,6 +842,103 @@ async def panic_sell(callback_query: CallbackQuery):
             reply_markup=back_to_menu_keyboard()
         )
 
+# Массовое закрытие позиций: /flatten - свои позиции, /flatten all - весь кошелек
+@dp.message(Command("flatten"))
+async def flatten_command(message: types.Message, state: FSMContext):
+    await state.clear()
+    
+    scope = 'all' if message.text.split()[1:] == ['all'] else 'me'
+    if scope == 'all':
+        # Закрытие чужих позиций доступно только администраторам
+        if message.from_user.id not in ADMIN_USER_IDS:
+            logger.warning(f"⛔ /flatten all отклонен для пользователя {message.from_user.id}")
+            await message.answer("⛔ Закрыть позиции всего кошелька может только администратор",
+                                 reply_markup=back_to_menu_keyboard())
+            return
+        positions_count = sum(count for _, _, count in axiom_client.client.flatten_groups())
+        target = "ВСЕ позиции кошелька (всех пользователей)"
+    else:
+        positions_count = len(axiom_client.get_user_positions(message.from_user.id))
+        target = "все ваши позиции"
+    
+    if not positions_count:
+        await message.answer("📭 Нет открытых позиций для закрытия", reply_markup=back_to_menu_keyboard())
+        return
+    
+    await message.answer(
+        f"⚠️ Будут закрыты {target}: {positions_count} шт.\n"
+        f"Продажи выполняются по рынку. Продолжить?",
+        reply_markup=flatten_confirm_keyboard(scope)
+    )
+
+def format_flatten_progress(summary, finished=False):
+    done = summary['closed'] + summary['skipped'] + summary['failed']
+    title = "✅ Массовое закрытие завершено" if finished else "🧹 Закрываем позиции..."
+    text = (
+        f"{title}\n\n"
+        f"Обработано: {done}/{summary['total']}\n"
+        f"✅ Закрыто: {summary['closed']}\n"
+        f"⏭ Уже были закрыты: {summary['skipped']}\n"
+        f"❌ Ошибок: {summary['failed']}"
+    )
+    if finished and summary['errors']:
+        text += "\n\nНе закрыты:\n" + "\n".join(
+            f"• {e['contract_address'][:8]}... ({e['user_id']}): {e['error'][:80]}"
+            for e in summary['errors'][:10]
+        )
+    return text
+
+@dp.callback_query(F.data.startswith("flatten_confirm_"))
+async def flatten_confirm(callback_query: CallbackQuery):
+    requested_by = callback_query.from_user.id
+    # Callback data присылает клиент: права на закрытие всего кошелька проверяем еще раз
+    if callback_query.data == 'flatten_confirm_all' and requested_by not in ADMIN_USER_IDS:
+        logger.warning(f"⛔ flatten_confirm_all отклонен для пользователя {requested_by}")
+        await callback_query.answer("⛔ Только для администратора", show_alert=True)
+        return
+    await callback_query.answer()
+    
+    user_id = None if callback_query.data == 'flatten_confirm_all' else requested_by
+    state = {'summary': None}
+    
+    try:
+        processing_msg = await callback_query.message.edit_text("🧹 Закрываем позиции...")
+        
+        async def update_progress():
+            # Одно сообщение обновляется не чаще FLATTEN_PROGRESS_INTERVAL и только при изменениях
+            shown = None
+            while True:
+                await asyncio.sleep(FLATTEN_PROGRESS_INTERVAL)
+                if state['summary'] is None:
+                    continue
+                text = format_flatten_progress(state['summary'])
+                if text != shown:
+                    try:
+                        await processing_msg.edit_text(text)
+                        shown = text
+                    except Exception as e:
+                        logger.debug(f"Не удалось обновить прогресс массового закрытия: {e}")
+        
+        progress_task = asyncio.create_task(update_progress())
+        try:
+            summary = await axiom_client.flatten_positions(
+                user_id, progress=lambda summary: state.update(summary=summary), requested_by=requested_by
+            )
+        finally:
+            progress_task.cancel()
+        
+        await processing_msg.edit_text(
+            format_flatten_progress(summary, finished=True),
+            reply_markup=back_to_menu_keyboard()
+        )
+        
+    except Exception as e:
+        logger.error(f"Ошибка массового закрытия: {e}")
+        await callback_query.message.edit_text(
+            f"❌ Ошибка массового закрытия: {str(e)}",
+            reply_markup=back_to_menu_keyboard()
+        )
+
 # Обработчики текстовых сообщений в состояниях
 @dp.message(TradeStates.awaiting_contract)
 async def handle_contract_address(message: types.Message, state: FSMContext):
@@ -860,7 +960,7 @@ async def handle_contract_address(message: types.Message, state: FSMContext):
     
     try:
         # Проверяем аутентификацию
-        if not axiom_client.is_authenticated():
+        if not await axiom_client.is_authenticated():
             await message.answer(
                 "❌ Ошибка аутентификации с Axiom Trade API.\n"
                 "Проверьте токены в конфигурации.",
@@ -870,7 +970,7 @@ async def handle_contract_address(message: types.Message, state: FSMContext):
             return
             
         # Получаем баланс
-        account_info = axiom_client.get_account_info()
+        account_info = await axiom_client.get_account_info()
         balance = account_info.get('balance', 0)
         
         if balance <= 0:
@@ -905,7 +1005,7 @@ async def handle_contract_address(message: types.Message, state: FSMContext):
         )
         
         # Открываем позицию с пользовательскими настройками слиппеджа
-        position = axiom_client.open_position(
+        position = await axiom_client.open_position(
             user_id=user_id,
             contract_address=contract_address,
             amount=amount,
@@ -1096,9 +1196,16 @@ async def handle_slippage(message: types.Message, state: FSMContext):
 async def main():
     logger.info("🚀 Бот запущен с активным whitelist")
     try:
-        await dp.start_polling(bot, skip_updates=True)
+        # Сессией бота владеет telegram_bot: ее закрывает close_bot() при остановке приложения
+        await dp.start_polling(bot, skip_updates=True, close_bot_session=False)
     except Exception as e:
         logger.error(f"Ошибка запуска бота: {e}")
 
+async def run_standalone():
+    try:
+        await main()
+    finally:
+        await close_bot()
+
 if __name__ == "__main__":
-    asyncio.run(main())
+    asyncio.run(run_standalone())
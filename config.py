@@ -26,6 +26,13 @@ else:
         "Чтобы узнать свой ID, напишите @userinfobot в Telegram"
     )
 
+# Администраторы: только они могут закрыть позиции всего кошелька (/flatten all)
+ADMIN_USER_IDS_STR = os.getenv('ADMIN_USER_IDS', '')
+try:
+    ADMIN_USER_IDS = [int(uid.strip()) for uid in ADMIN_USER_IDS_STR.split(',') if uid.strip()]
+except ValueError:
+    raise ValueError("ADMIN_USER_IDS должны быть числами, разделенными запятыми. Пример: 123456789")
+
 # Кошелек пользователя
 WALLET_ADDRESS = os.getenv('WALLET_ADDRESS')
 PRIVATE_KEY = os.getenv('PRIVATE_KEY')
@@ -44,5 +51,65 @@ DEFAULT_SETTINGS = {
 
 # Настройки мониторинга
 PRICE_CHECK_INTERVAL = 30  # Проверка цен каждые 30 секунд
+JUPITER_PRICE_BATCH_SIZE = 100  # Максимум адресов в одном запросе ids= к Jupiter Price API
+JUPITER_PRICE_URL = os.getenv('JUPITER_PRICE_URL', 'https://quote-api.jup.ag/v6/price')
+PRICE_STREAM_URL = os.getenv('PRICE_STREAM_URL')  # WebSocket поток цен; без него - только опрос
+PRICE_CACHE_TTL = 15  # Цена из кэша считается свежей N секунд
+PRICE_CACHE_STALE_TTL = 60  # До N секунд устаревшая цена отдается сразу и обновляется в фоне
+MIN_POLL_INTERVAL = 0.5  # Самый частый опрос контракта, цена которого рядом с SL/TP (секунды)
+POLL_SAFETY_FACTOR = 0.25  # Доля ожидаемого времени до триггера, через которую опрашиваем снова
+DEFAULT_PRICE_VOLATILITY = 0.005  # Волатильность (доля цены за sqrt(секунды)), пока нет истории котировок
+MIN_PRICE_VOLATILITY = 0.001  # Нижняя граница волатильности: "застывшая" цена не отключает опрос
 MAX_RETRIES = 3  # Максимальное количество попыток при ошибках
-RETRY_DELAY = 5  # Задержка между попытками в секундах
\ No newline at end of file
+RETRY_DELAY = 5  # Задержка между попытками в секундах
+MAX_CONCURRENT_TRIGGERS = 5  # Сколько SL и отдельно TP/Breakeven исполняется одновременно
+
+# Настройки HTTP соединений (общие для всех модулей)
+HTTP_POOL_LIMIT = 100  # Всего одновременных соединений
+HTTP_LIMIT_PER_HOST = 20  # Одновременных соединений к одному хосту
+HTTP_DNS_CACHE_TTL = 300  # Время жизни DNS кэша (секунды)
+HTTP_KEEPALIVE_TIMEOUT = 60  # Сколько держать простаивающее соединение открытым (секунды)
+HTTP_TOTAL_TIMEOUT = 10  # Общий таймаут запроса (секунды)
+HTTP_CONNECT_TIMEOUT = 5  # Таймаут установки соединения (секунды)
+
+# Лимиты отправки сообщений Telegram
+TELEGRAM_GLOBAL_RATE = 30  # Сообщений в секунду от бота суммарно
+TELEGRAM_PER_CHAT_RATE = 1  # Сообщений в секунду в один чат
+TELEGRAM_PER_CHAT_BURST = 1  # Сколько сообщений в один чат можно отправить подряд без ожидания
+NOTIFICATION_QUEUE_SIZE = 1000  # Максимум чатов, ожидающих отправки уведомлений
+NOTIFICATION_COALESCE_WINDOW = 2.0  # Уведомления одному пользователю за это время объединяются (секунды)
+NOTIFICATION_MAX_BATCH = 20  # Сколько уведомлений перечислять в одном объединенном сообщении
+NOTIFICATION_WORKERS = 4  # Параллельных отправителей уведомлений
+NOTIFICATION_MAX_RETRIES = 3  # Повторы отправки после 429 (retry_after) и сетевых ошибок
+
+# Метрики (формат Prometheus)
+METRICS_FILE = os.getenv('METRICS_FILE', '')  # Файл для периодического дампа метрик, например metrics.prom; пусто - отключен
+METRICS_DUMP_INTERVAL = 60  # Как часто записывать дамп (секунды)
+METRICS_PORT = int(os.getenv('METRICS_PORT', '0'))  # HTTP эндпоинт /metrics; 0 - отключен
+
+# Настройки хранилища
+POSITIONS_FLUSH_INTERVAL = 5  # Сброс изменений позиций на диск каждые 5 секунд
+STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 'json')  # 'json' или 'sqlite'
+SQLITE_DB_PATH = os.getenv('SQLITE_DB_PATH', 'axiom.db')
+TRADE_JOURNAL_FSYNC_BATCH = 20  # fsync журнала сделок после N записей...
+TRADE_JOURNAL_FSYNC_INTERVAL = 1.0  # ...или через N секунд после предыдущего fsync
+TRADE_HISTORY_DIR = os.getenv('TRADE_HISTORY_DIR', 'trade_history')  # История сделок по месяцам
+TRADE_HISTORY_COMPACT_AFTER_MONTHS = int(os.getenv('TRADE_HISTORY_COMPACT_AFTER_MONTHS', '0'))  # 0 - не сжимать
+
+# Настройки исполнения сделок
+TRADE_EXECUTOR_WORKERS = 8  # Размер пула потоков для блокирующих вызовов Axiom SDK
+BUY_CONFIRM_TIMEOUT = 30  # Максимальное ожидание изменения баланса после покупки (секунды)
+BUY_CONFIRM_INITIAL_DELAY = 0.25  # Первая пауза между опросами баланса, далее удваивается...
+BUY_CONFIRM_MAX_DELAY = 4  # ...но не больше этого значения
+SOLANA_RPC_URL = os.getenv('SOLANA_RPC_URL', 'https://api.mainnet-beta.solana.com')  # Для снимка балансов кошелька
+WALLET_BALANCE_TTL = 5  # Снимок балансов токенов кошелька считается свежим N секунд
+LEDGER_RECONCILE_INTERVAL = 300  # Сверка учета токенов по позициям с балансами кошелька (секунды, 0 - отключена)
+LEDGER_SETTLE_TIME = 30  # Контракт не сверяем столько секунд после нашей сделки по нему
+LEDGER_TOLERANCE = 0.01  # Допустимое относительное расхождение учета и кошелька
+SELL_BATCH_WINDOW = 0.25  # Продажи одного контракта за это время объединяются в один своп (секунды, 0 - отключено)
+SELL_BATCH_MAX = 20  # Максимум продаж в одном объединенном свопе
+EXECUTION_MAX_CONCURRENT = 4  # Сколько свопов (покупок и объединенных продаж) исполняется одновременно
+EXECUTION_DEADLINES = {'exit': 60, 'tp': 30, 'buy': 15}  # Максимальное ожидание в очереди по классам (секунды)
+EXECUTION_QUEUE_LIMITS = {'exit': 0, 'tp': 100, 'buy': 20}  # Максимум ожидающих операций по классам (0 - без ограничения)
+FLATTEN_MAX_CONCURRENT = 5  # Сколько продаж массового закрытия (/flatten) выполняется одновременно
+FLATTEN_PROGRESS_INTERVAL = 1.0  # Как часто обновлять сообщение с прогрессом массового закрытия (секунды)
\ No newline at end of file
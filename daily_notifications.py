@@ -1,50 +1,45 @@
 import asyncio
 import logging
 from datetime import datetime, time
-from reports import ReportsManager
+from reports import reports_manager
 from notifications import notification_manager
-from storage import PositionStorage
+from storage import position_storage
 
 logger = logging.getLogger(__name__)
 
 class DailyReporter:
     def __init__(self):
-        self.reports = ReportsManager()
-        self.storage = PositionStorage()
+        self.reports = reports_manager
+        self.storage = position_storage
         self.is_running = False
         self.task = None
     
     async def send_daily_reports(self):
-        """Отправляем ежедневные отчеты всем пользователям"""
+        """Отправляем ежедневные отчеты всем подписанным пользователям"""
         try:
-            # Получаем всех пользователей с позициями
+            user_ids = notification_manager.get_subscribed_users('daily_summary')
+            if not user_ids:
+                return
+
+            # Один снимок позиций и один проход по агрегатам истории на всех пользователей
             positions_data = self.storage.load_positions()
-            
-            for user_id_str in positions_data.keys():
-                user_id = int(user_id_str)
-                
-                # Проверяем настройки уведомлений пользователя
-                settings = notification_manager.get_user_settings(user_id)
-                if not settings.get('daily_summary', False):
-                    continue
-                
-                # Генерируем отчет за день
-                summary = self.reports.format_trade_summary(user_id, days=1)
-                
-                # Добавляем информацию об активных позициях
-                active_positions = self.storage.get_positions(user_id)
-                
+            summaries = self.reports.format_trade_summaries(user_ids, days=1)
+
+            for user_id in user_ids:
+                active_positions = positions_data.get(str(user_id), [])
                 if active_positions:
-                    summary += f"\n\n🔄 Активных позиций: {len(active_positions)}"
-                
-                # Отправляем отчет
-                await notification_manager.send_daily_summary(user_id, summary)
-                
-                logger.info(f"📊 Ежедневный отчет отправлен пользователю {user_id}")
-                
-                # Небольшая задержка между отправками
-                await asyncio.sleep(1)
-                
+                    summaries[user_id] += f"\n\n🔄 Активных позиций: {len(active_positions)}"
+
+            # Рассылаем параллельно: темп задает ограничитель Telegram, а не фиксированная пауза
+            started = asyncio.get_running_loop().time()
+            results = await asyncio.gather(*(
+                notification_manager.send_daily_summary(user_id, summaries[user_id])
+                for user_id in user_ids
+            ))
+            elapsed = asyncio.get_running_loop().time() - started
+
+            logger.info(f"📊 Ежедневные отчеты приняты к отправке: {sum(results)}/{len(user_ids)} за {elapsed:.1f}с")
+
         except Exception as e:
             logger.error(f"Ошибка отправки ежедневных отчетов: {e}")
     
@@ -0,0 +1,142 @@
+import asyncio
+import functools
+import heapq
+import itertools
+import logging
+import time
+from concurrent.futures import Executor
+from typing import Callable, Dict, List, Optional
+
+from config import EXECUTION_MAX_CONCURRENT, EXECUTION_DEADLINES, EXECUTION_QUEUE_LIMITS
+from metrics import execution_wait_seconds, execution_total
+
+logger = logging.getLogger(__name__)
+
+# Классы приоритета: чем меньше число, тем раньше исполняется
+PRIORITY_EXIT = 0  # Stop Loss, panic sell, полное закрытие
+PRIORITY_TAKE_PROFIT = 1  # Тейк-профиты, безубыток, частичные продажи
+PRIORITY_BUY = 2  # Новые покупки
+
+PRIORITY_NAMES = {PRIORITY_EXIT: 'exit', PRIORITY_TAKE_PROFIT: 'tp', PRIORITY_BUY: 'buy'}
+
+class ExecutionRejected(Exception):
+    """Операция не принята или не дождалась исполнения (перегрузка, истек срок)"""
+
+class _Job:
+    __slots__ = ('priority', 'seq', 'func', 'future', 'enqueued_at', 'timer', 'queued')
+
+    def __init__(self, priority: int, seq: int, func: Callable, future: asyncio.Future):
+        self.priority = priority
+        self.seq = seq
+        self.func = func
+        self.future = future
+        self.enqueued_at = time.monotonic()
+        self.timer: Optional[asyncio.TimerHandle] = None
+        self.queued = True
+
+    def __lt__(self, other: '_Job') -> bool:
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+class ExecutionQueue:
+    """
+    Центральная очередь торговых операций. Блокирующие вызовы AxiomClient исполняются в пуле
+    потоков не более max_concurrent одновременно, в порядке классов приоритета: защитные выходы
+    (SL, panic) обгоняют тейк-профиты, а те - новые покупки. Операция, не начатая до дедлайна
+    своего класса, отклоняется; при переполнении класса новые операции отклоняются сразу.
+    """
+
+    def __init__(self, executor: Executor = None, max_concurrent: int = 4,
+                 deadlines: Dict[int, float] = None, queue_limits: Dict[int, int] = None):
+        self.executor = executor
+        self.max_concurrent = max_concurrent
+        self.deadlines = deadlines or {}  # класс -> секунд ожидания в очереди (0/нет - без срока)
+        self.queue_limits = queue_limits or {}  # класс -> максимум ожидающих (0/нет - без ограничения)
+        self._heap: List[_Job] = []
+        self._queued: Dict[int, int] = {}  # класс -> ожидающих операций
+        self._running = 0
+        self._seq = itertools.count()
+
+    async def submit(self, priority: int, func: Callable, *args, **kwargs):
+        """Ставим блокирующий вызов в очередь и ждем его результата"""
+        name = PRIORITY_NAMES.get(priority, str(priority))
+        limit = self.queue_limits.get(priority)
+        if limit and self._queued.get(priority, 0) >= limit:
+            execution_total.inc(priority=name, result='rejected')
+            raise ExecutionRejected(f"Очередь исполнения перегружена ({name}), попробуйте позже")
+
+        loop = asyncio.get_running_loop()
+        job = _Job(priority, next(self._seq), functools.partial(func, *args, **kwargs), loop.create_future())
+        deadline = self.deadlines.get(priority)
+        if deadline:
+            job.timer = loop.call_later(deadline, self._expire, job)
+        heapq.heappush(self._heap, job)
+        self._queued[priority] = self._queued.get(priority, 0) + 1
+        # Истек срок или вызывающий отменил ожидание - операция больше не занимает место в очереди
+        job.future.add_done_callback(lambda _: self._unqueue(job))
+        self._dispatch()
+        return await job.future
+
+    def _expire(self, job: _Job):
+        """Операция не дождалась свободного слота до дедлайна своего класса"""
+        if job.future.done():
+            return
+        name = PRIORITY_NAMES.get(job.priority, str(job.priority))
+        execution_total.inc(priority=name, result='expired')
+        logger.warning(f"⏱️ Операция {name} не исполнена: ожидание в очереди дольше {self.deadlines[job.priority]}с")
+        job.future.set_exception(ExecutionRejected(f"Операция {name} не дождалась исполнения"))
+
+    def _unqueue(self, job: _Job):
+        if job.queued:
+            job.queued = False
+            self._queued[job.priority] -= 1
+
+    def _dispatch(self):
+        while self._heap and self._running < self.max_concurrent:
+            job = heapq.heappop(self._heap)
+            if job.future.done():
+                continue  # Истек срок или вызывающий отменил ожидание
+            self._unqueue(job)
+            if job.timer is not None:
+                job.timer.cancel()
+            self._running += 1
+            execution_wait_seconds.observe(time.monotonic() - job.enqueued_at,
+                                           priority=PRIORITY_NAMES.get(job.priority, str(job.priority)))
+            asyncio.get_running_loop().create_task(self._execute(job))
+
+    async def _execute(self, job: _Job):
+        name = PRIORITY_NAMES.get(job.priority, str(job.priority))
+        try:
+            result = await asyncio.get_running_loop().run_in_executor(self.executor, job.func)
+            execution_total.inc(priority=name, result='ok')
+            if not job.future.done():
+                job.future.set_result(result)
+        except Exception as e:
+            execution_total.inc(priority=name, result='error')
+            if not job.future.done():
+                job.future.set_exception(e)
+        finally:
+            self._running -= 1
+            self._dispatch()
+
+    def get_stats(self) -> Dict:
+        return {
+            'running': self._running,
+            'queued': {PRIORITY_NAMES.get(p, str(p)): n for p, n in self._queued.items()}
+        }
+
+def create_execution_queue(executor: Executor = None) -> ExecutionQueue:
+    """Очередь с лимитами и дедлайнами из конфига"""
+    return ExecutionQueue(
+        executor,
+        max_concurrent=EXECUTION_MAX_CONCURRENT,
+        deadlines={
+            PRIORITY_EXIT: EXECUTION_DEADLINES['exit'],
+            PRIORITY_TAKE_PROFIT: EXECUTION_DEADLINES['tp'],
+            PRIORITY_BUY: EXECUTION_DEADLINES['buy']
+        },
+        queue_limits={
+            PRIORITY_EXIT: EXECUTION_QUEUE_LIMITS['exit'],
+            PRIORITY_TAKE_PROFIT: EXECUTION_QUEUE_LIMITS['tp'],
+            PRIORITY_BUY: EXECUTION_QUEUE_LIMITS['buy']
+        }
+    )
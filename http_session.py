@@ -0,0 +1,63 @@
+import logging
+import threading
+from typing import Optional
+
+import aiohttp
+import requests
+from requests.adapters import HTTPAdapter
+
+from config import (
+    HTTP_POOL_LIMIT, HTTP_LIMIT_PER_HOST, HTTP_DNS_CACHE_TTL, HTTP_KEEPALIVE_TIMEOUT,
+    HTTP_TOTAL_TIMEOUT, HTTP_CONNECT_TIMEOUT
+)
+
+logger = logging.getLogger(__name__)
+
+# Общая асинхронная HTTP сессия процесса: keep-alive соединения и DNS кэш
+# переиспользуются всеми модулями, TLS рукопожатие оплачивается один раз
+_session: Optional[aiohttp.ClientSession] = None
+
+# Пул соединений для синхронных вызовов из рабочих потоков AxiomClient
+_sync_session: Optional[requests.Session] = None
+_sync_lock = threading.Lock()
+
+def get_session() -> aiohttp.ClientSession:
+    """Возвращаем общую aiohttp сессию, создавая ее при первом обращении"""
+    global _session
+    if _session is None or _session.closed:
+        connector = aiohttp.TCPConnector(
+            limit=HTTP_POOL_LIMIT,
+            limit_per_host=HTTP_LIMIT_PER_HOST,
+            ttl_dns_cache=HTTP_DNS_CACHE_TTL,
+            keepalive_timeout=HTTP_KEEPALIVE_TIMEOUT
+        )
+        timeout = aiohttp.ClientTimeout(total=HTTP_TOTAL_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT)
+        _session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+        logger.info(f"🌐 HTTP сессия создана (до {HTTP_LIMIT_PER_HOST} соединений на хост)")
+    return _session
+
+def get_sync_session() -> requests.Session:
+    """Возвращаем общую requests сессию с пулом keep-alive соединений"""
+    global _sync_session
+    with _sync_lock:
+        if _sync_session is None:
+            adapter = HTTPAdapter(pool_connections=HTTP_LIMIT_PER_HOST, pool_maxsize=HTTP_LIMIT_PER_HOST)
+            _sync_session = requests.Session()
+            _sync_session.mount('https://', adapter)
+            _sync_session.mount('http://', adapter)
+        return _sync_session
+
+def is_session_active() -> bool:
+    return _session is not None and not _session.closed
+
+async def close_session():
+    """Закрываем общие HTTP сессии при остановке"""
+    global _session, _sync_session
+    if _session is not None and not _session.closed:
+        await _session.close()
+        logger.info("🌐 HTTP сессия закрыта")
+    _session = None
+    with _sync_lock:
+        if _sync_session is not None:
+            _sync_session.close()
+            _sync_session = None
@@ -0,0 +1,92 @@
+import asyncio
+import logging
+import time
+from typing import Dict, Iterable, List
+
+from config import JUPITER_PRICE_URL, JUPITER_PRICE_BATCH_SIZE, HTTP_TOTAL_TIMEOUT
+from http_session import get_session, get_sync_session
+from metrics import price_request_seconds, price_fetch_total
+
+logger = logging.getLogger(__name__)
+
+def _unique(contract_addresses: Iterable[str]) -> List[str]:
+    return list(dict.fromkeys(a for a in contract_addresses if a))
+
+def _chunks(addresses: List[str], batch_size: int) -> List[List[str]]:
+    return [addresses[i:i + batch_size] for i in range(0, len(addresses), batch_size)]
+
+def _parse_prices(payload: dict, chunk: List[str]) -> Dict[str, float]:
+    data = (payload or {}).get('data') or {}
+    prices = {}
+    for contract_address in chunk:
+        token_data = data.get(contract_address)
+        if token_data and token_data.get('price') is not None:
+            prices[contract_address] = float(token_data['price'])
+    return prices
+
+def _record_fetch(chunk: List[str], prices: Dict[str, float], elapsed: float):
+    """Метрики запроса: длительность пачки и доля контрактов без цены"""
+    price_request_seconds.observe(elapsed)
+    price_fetch_total.inc(len(prices), result='ok')
+    price_fetch_total.inc(len(chunk) - len(prices), result='missing')
+
+async def _fetch_chunk(chunk: List[str]) -> Dict[str, float]:
+    """Запрашиваем цены для одной пачки адресов одним HTTP запросом"""
+    started = time.perf_counter()
+    try:
+        async with get_session().get(JUPITER_PRICE_URL, params={'ids': ','.join(chunk)}) as response:
+            if response.status != 200:
+                logger.warning(f"Jupiter API returned status {response.status} for {len(chunk)} tokens")
+                price_fetch_total.inc(len(chunk), result='error')
+                return {}
+            prices = _parse_prices(await response.json(), chunk)
+            _record_fetch(chunk, prices, time.perf_counter() - started)
+            return prices
+    except asyncio.TimeoutError:
+        logger.warning(f"Timeout getting prices for {len(chunk)} tokens")
+        price_fetch_total.inc(len(chunk), result='error')
+        return {}
+    except Exception as e:
+        logger.error(f"Ошибка получения цен для {len(chunk)} токенов: {e}")
+        price_fetch_total.inc(len(chunk), result='error')
+        return {}
+
+async def fetch_token_prices(contract_addresses: Iterable[str],
+                             batch_size: int = JUPITER_PRICE_BATCH_SIZE) -> Dict[str, float]:
+    """
+    Получаем цены сразу для набора токенов через общую HTTP сессию.
+    Адреса дедуплицируются и разбиваются на пачки по batch_size (лимит ids= у Jupiter),
+    пачки запрашиваются параллельно. Токены без цены в результат не попадают.
+    """
+    addresses = _unique(contract_addresses)
+    if not addresses:
+        return {}
+
+    results = await asyncio.gather(*(_fetch_chunk(chunk) for chunk in _chunks(addresses, batch_size)))
+
+    prices = {}
+    for chunk_prices in results:
+        prices.update(chunk_prices)
+    return prices
+
+def fetch_token_prices_sync(contract_addresses: Iterable[str],
+                            batch_size: int = JUPITER_PRICE_BATCH_SIZE) -> Dict[str, float]:
+    """Синхронный вариант для рабочих потоков: использует общий пул соединений requests"""
+    prices = {}
+    for chunk in _chunks(_unique(contract_addresses), batch_size):
+        started = time.perf_counter()
+        try:
+            response = get_sync_session().get(
+                JUPITER_PRICE_URL, params={'ids': ','.join(chunk)}, timeout=HTTP_TOTAL_TIMEOUT
+            )
+            if response.status_code == 200:
+                chunk_prices = _parse_prices(response.json(), chunk)
+                _record_fetch(chunk, chunk_prices, time.perf_counter() - started)
+                prices.update(chunk_prices)
+            else:
+                logger.warning(f"Jupiter API returned status {response.status_code} for {len(chunk)} tokens")
+                price_fetch_total.inc(len(chunk), result='error')
+        except Exception as e:
+            logger.error(f"Ошибка получения цен для {len(chunk)} токенов: {e}")
+            price_fetch_total.inc(len(chunk), result='error')
+    return prices
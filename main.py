@@ -3,10 +3,19 @@ import logging
 import signal
 import sys
 from concurrent.futures import ThreadPoolExecutor
-from api_client import AxiomClient
 from price_monitor import PriceMonitor
 from daily_notifications import daily_reporter  # ДОБАВЛЕННЫЙ ИМПОРТ
-from bot import main as bot_main
+from bot import main as bot_main, axiom_client as bot_axiom_client
+from config import JUPITER_PRICE_BATCH_SIZE, MAX_CONCURRENT_TRIGGERS, PRICE_STREAM_URL, MIN_POLL_INTERVAL
+from storage import position_storage
+from reports import reports_manager
+from notifications import notification_manager
+from token_ledger import token_ledger
+from http_session import close_session
+from telegram_bot import close_bot
+from price_sources import StreamingPriceSource
+from metrics import metrics, MetricsExporter
+from config import METRICS_FILE, METRICS_DUMP_INTERVAL, METRICS_PORT
 
 # Настройка логирования
 logging.basicConfig(
@@ -25,6 +34,7 @@ bot_task = None
 monitor_task = None
 daily_task = None  # ДОБАВЛЕННАЯ ПЕРЕМЕННАЯ
 shutdown_event = None
+metrics_exporter = MetricsExporter(metrics, METRICS_FILE or None, METRICS_DUMP_INTERVAL, METRICS_PORT)
 
 async def shutdown_handler():
     """Обработчик корректного завершения работы"""
@@ -54,6 +64,25 @@ async def shutdown_handler():
         except asyncio.CancelledError:
             logger.info("📊 Задача мониторинга остановлена")
     
+    # Останавливаем сверку учета токенов
+    await token_ledger.stop()
+    
+    # Сохраняем несброшенные изменения позиций
+    logger.info("💾 Сохраняем позиции...")
+    await position_storage.stop()
+    
+    # Сбрасываем журнал сделок на диск
+    reports_manager.close()
+    
+    # Досылаем накопленные уведомления
+    await notification_manager.stop()
+    
+    # Финальный дамп метрик
+    await metrics_exporter.stop()
+    
+    # Закрываем общие HTTP соединения
+    await close_session()
+    
     # ДОБАВЛЕННАЯ СЕКЦИЯ:
     # Останавливаем задачу ежедневных отчетов
     if daily_task:
@@ -72,6 +101,9 @@ async def shutdown_handler():
         except asyncio.CancelledError:
             logger.info("🤖 Telegram бот остановлен")
     
+    # Закрываем общую сессию Telegram (бот и уведомления)
+    await close_bot()
+    
     logger.info("✅ Все сервисы остановлены")
 
 def signal_handler(sig, frame):
@@ -120,7 +152,8 @@ async def main():
     try:
         # Инициализируем клиенты
         logger.info("🔧 Инициализация клиента Axiom Trade...")
-        axiom_client = AxiomClient()
+        # Клиент общий с ботом: продажи монитора и бота по одному контракту объединяет один SellBatcher
+        axiom_client = bot_axiom_client.client
         
         # Проверяем подключение к Axiom API
         if not axiom_client.is_authenticated():
@@ -144,7 +177,17 @@ async def main():
         
         # Инициализируем мониторинг цен
         logger.info("📊 Инициализация системы мониторинга цен...")
-        price_monitor = PriceMonitor(axiom_client, check_interval=30)  # Проверяем каждые 30 секунд
+        price_source = StreamingPriceSource(PRICE_STREAM_URL) if PRICE_STREAM_URL else None
+        if price_source:
+            logger.info(f"📡 Потоковые цены: {PRICE_STREAM_URL} (опрос остается резервом)")
+        price_monitor = PriceMonitor(
+            bot_axiom_client,
+            check_interval=30,  # Спокойные позиции проверяем раз в 30 секунд...
+            min_poll_interval=MIN_POLL_INTERVAL,  # ...а близкие к SL/TP - вплоть до этого интервала
+            batch_size=JUPITER_PRICE_BATCH_SIZE,
+            max_concurrent_triggers=MAX_CONCURRENT_TRIGGERS,
+            price_source=price_source
+        )
         
         # ДОБАВЛЕННЫЕ СТРОКИ:
         # Инициализируем систему ежедневных отчетов
@@ -157,6 +200,18 @@ async def main():
         # Запускаем компоненты системы
         logger.info("🎯 Запуск основных компонентов системы...")
         
+        # Отложенная запись позиций на диск
+        await position_storage.start()
+        
+        # Периодическая сверка учета токенов по позициям с кошельком
+        await token_ledger.start()
+        
+        # Выгрузка метрик (файл и, если задан порт, HTTP эндпоинт)
+        await metrics_exporter.start()
+        
+        # Очередь исходящих уведомлений (объединение пачек и лимиты Telegram)
+        await notification_manager.start()
+        
         # Создаем задачи для параллельного выполнения
         tasks = []
         
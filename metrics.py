@@ -0,0 +1,289 @@
+import asyncio
+import logging
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+# Границы корзин гистограмм по умолчанию (секунды)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+LabelValues = Tuple[Tuple[str, str], ...]
+
+def _label_key(labels: Dict[str, str]) -> LabelValues:
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(labels: LabelValues) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels) + '}'
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+class Counter:
+    """Монотонно растущий счетчик"""
+
+    type_name = 'counter'
+
+    def __init__(self, name: str, documentation: str):
+        self.name = name
+        self.documentation = documentation
+        self._values: Dict[LabelValues, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def get(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(_label_key(labels), 0)
+
+    def samples(self) -> List[Tuple[str, LabelValues, float]]:
+        with self._lock:
+            return [(self.name, key, value) for key, value in self._values.items()]
+
+class Gauge(Counter):
+    """Текущее значение, которое может как расти, так и уменьшаться"""
+
+    type_name = 'gauge'
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[_label_key(labels)] = value
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+class Histogram:
+    """Распределение значений по корзинам (совместимо с форматом Prometheus)"""
+
+    type_name = 'histogram'
+
+    def __init__(self, name: str, documentation: str, buckets: Iterable[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+        self._series: Dict[LabelValues, List] = {}  # метки -> [счетчики корзин, сумма, количество]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Замеряем длительность блока кода"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def get_summary(self, **labels) -> Dict:
+        with self._lock:
+            series = self._series.get(_label_key(labels))
+            if series is None:
+                return {'count': 0, 'sum': 0.0, 'avg': 0.0}
+            return {'count': series[2], 'sum': series[1], 'avg': series[1] / series[2] if series[2] else 0.0}
+
+    def samples(self) -> List[Tuple[str, LabelValues, float]]:
+        result = []
+        with self._lock:
+            for key, (bucket_counts, total, count) in self._series.items():
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, bucket_counts):
+                    cumulative += bucket_count
+                    result.append((f'{self.name}_bucket', key + (('le', _format_value(bound)),), cumulative))
+                result.append((f'{self.name}_sum', key, total))
+                result.append((f'{self.name}_count', key, count))
+        return result
+
+class MetricsRegistry:
+    """
+    Реестр метрик процесса. Выдает текст в формате Prometheus (exposition format 0.0.4),
+    который можно отдать по HTTP или сохранить в файл для офлайн анализа.
+    """
+
+    def __init__(self):
+        self._metrics: Dict[str, object] = {}
+        self._collectors: List[Callable[[], None]] = []
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name: str, documentation: str) -> Counter:
+        return self._register(Counter(name, documentation))
+
+    def gauge(self, name: str, documentation: str) -> Gauge:
+        return self._register(Gauge(name, documentation))
+
+    def histogram(self, name: str, documentation: str, buckets: Iterable[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, buckets))
+
+    def add_collector(self, collector: Callable[[], None]):
+        """Функция, обновляющая gauge-метрики непосредственно перед выгрузкой"""
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        for collector in list(self._collectors):
+            try:
+                collector()
+            except Exception as e:
+                logger.debug(f"Ошибка сбора метрик: {e}")
+
+        lines = []
+        with self._lock:
+            metrics = list(self._metrics.values())
+        for metric in metrics:
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.type_name}')
+            for sample_name, labels, value in metric.samples():
+                lines.append(f'{sample_name}{_format_labels(labels)} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+    def dump(self, filename: str):
+        """Атомарно записываем текущие значения метрик в файл"""
+        directory = os.path.dirname(os.path.abspath(filename))
+        fd, tmp_path = tempfile.mkstemp(prefix='.metrics_', suffix='.tmp', dir=directory)
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                f.write(self.render())
+            os.replace(tmp_path, filename)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+class MetricsExporter:
+    """
+    Выгрузка метрик: периодический дамп в файл (работает без сети)
+    и, если задан порт, HTTP эндпоинт /metrics для Prometheus.
+    """
+
+    def __init__(self, registry: MetricsRegistry, filename: Optional[str] = None,
+                 dump_interval: float = 60, port: int = 0, host: str = '127.0.0.1'):
+        self.registry = registry
+        self.filename = filename
+        self.dump_interval = dump_interval
+        self.port = port
+        self.host = host
+        self._dump_task = None
+        self._runner = None
+
+    async def start(self):
+        if self.filename and self._dump_task is None:
+            self._dump_task = asyncio.create_task(self._dump_loop())
+        if self.port and self._runner is None:
+            async def handle_metrics(request):
+                return web.Response(text=self.registry.render(), content_type='text/plain', charset='utf-8')
+
+            app = web.Application()
+            app.router.add_get('/metrics', handle_metrics)
+            self._runner = web.AppRunner(app)
+            await self._runner.setup()
+            await web.TCPSite(self._runner, self.host, self.port).start()
+            logger.info(f"📈 Метрики доступны на http://{self.host}:{self.port}/metrics")
+
+    async def _dump_loop(self):
+        while True:
+            await asyncio.sleep(self.dump_interval)
+            try:
+                self.registry.dump(self.filename)
+            except Exception as e:
+                logger.error(f"Ошибка записи метрик в {self.filename}: {e}")
+
+    async def stop(self):
+        if self._dump_task is not None:
+            self._dump_task.cancel()
+            try:
+                await self._dump_task
+            except asyncio.CancelledError:
+                pass
+            self._dump_task = None
+        if self.filename:
+            try:
+                self.registry.dump(self.filename)
+            except Exception as e:
+                logger.error(f"Ошибка записи метрик в {self.filename}: {e}")
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+# Глобальный реестр и метрики, общие для всех модулей
+metrics = MetricsRegistry()
+
+monitor_cycle_seconds = metrics.histogram(
+    'price_monitor_cycle_seconds', 'Длительность цикла опроса цен PriceMonitor'
+)
+monitor_polled_mints = metrics.gauge(
+    'price_monitor_polled_mints', 'Сколько контрактов опрошено в последнем цикле'
+)
+price_request_seconds = metrics.histogram(
+    'price_request_seconds', 'Длительность одного запроса цен к Jupiter (пачка до batch_size контрактов)'
+)
+price_fetch_total = metrics.counter(
+    'price_fetch_total', 'Результаты получения цен по контрактам (ok, missing, error)'
+)
+price_age_seconds = metrics.gauge(
+    'price_age_seconds', 'Возраст последней котировки контракта'
+)
+trigger_to_signature_seconds = metrics.histogram(
+    'trigger_to_signature_seconds', 'От обнаружения SL/TP до подписанной транзакции продажи'
+)
+trigger_total = metrics.counter(
+    'trigger_total', 'Исполненные триггеры по типу и результату'
+)
+axiom_request_seconds = metrics.histogram(
+    'axiom_request_seconds', 'Длительность вызовов Axiom SDK по операциям'
+)
+execution_wait_seconds = metrics.histogram(
+    'execution_wait_seconds', 'Ожидание торговой операции в очереди исполнения по классам приоритета'
+)
+execution_total = metrics.counter(
+    'execution_total', 'Торговые операции по классу приоритета и результату (ok, error, rejected, expired)'
+)
+sell_batch_size = metrics.histogram(
+    'sell_batch_size', 'Сколько продаж позиций объединено в один своп', buckets=(1, 2, 3, 5, 10, 20)
+)
+rpc_request_seconds = metrics.histogram(
+    'rpc_request_seconds', 'Длительность запросов к Solana RPC по методам'
+)
+notification_total = metrics.counter(
+    'notification_total', 'Исходящие уведомления Telegram по результату (sent, coalesced, retry, failed, dropped)'
+)
+notification_queue_chats = metrics.gauge(
+    'notification_queue_chats', 'Чатов с уведомлениями, ожидающими отправки'
+)
+storage_flush_seconds = metrics.histogram(
+    'storage_flush_seconds', 'Время записи позиций в хранилище'
+)
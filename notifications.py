@@ -1,16 +1,65 @@
 import asyncio
+import html
 import logging
+import re
+import time
 from datetime import datetime
 from typing import Dict, List, Optional
 from aiogram import Bot
-from config import BOT_TOKEN
+from aiogram.exceptions import TelegramNetworkError, TelegramRetryAfter
+from config import (
+    NOTIFICATION_QUEUE_SIZE, NOTIFICATION_COALESCE_WINDOW, NOTIFICATION_MAX_BATCH,
+    NOTIFICATION_WORKERS, NOTIFICATION_MAX_RETRIES
+)
+from metrics import metrics, notification_total, notification_queue_chats
+from rate_limiter import telegram_rate_limiter
+from telegram_bot import get_bot
 
 logger = logging.getLogger(__name__)
 
+TELEGRAM_MESSAGE_LIMIT = 4096  # Максимальная длина сообщения Telegram
+BATCH_SEPARATOR = "\n➖➖➖➖➖\n"
+HTML_TAG = re.compile(r'<[^>]+>')
+
+def fit_html(text: str, limit: int) -> str:
+    """
+    Укладываем HTML сообщение в limit символов. Обрезка посреди разметки ломает теги, и Telegram
+    отклоняет сообщение, поэтому слишком длинный текст отправляем без форматирования
+    """
+    if len(text) <= limit:
+        return text
+    shortened = html.escape(html.unescape(HTML_TAG.sub('', text)), quote=False)[:limit - 1]
+    # Не оставляем обрезанную сущность вроде "&am"
+    entity = shortened.rfind('&')
+    if entity > shortened.rfind(';'):
+        shortened = shortened[:entity]
+    return shortened + "…"
+
 class NotificationManager:
-    def __init__(self, bot_token: str = BOT_TOKEN):
-        self.bot = Bot(token=bot_token)
+    """
+    Уведомления пользователям. После start() сообщения идут через ограниченную очередь:
+    уведомления одному пользователю за coalesce_window секунд объединяются в одно сообщение,
+    отправка учитывает лимиты Telegram и повторяется после 429 (retry_after).
+    """
+
+    def __init__(self, bot: Optional[Bot] = None, queue_size: int = 1000, coalesce_window: float = 2.0,
+                 max_batch: int = 20, workers: int = 4, max_retries: int = 3):
+        self._bot = bot  # None - общий бот процесса из telegram_bot
         self.notification_settings = {}  # user_id -> settings
+        self.queue_size = queue_size
+        self.coalesce_window = coalesce_window
+        self.max_batch = max_batch
+        self.workers = workers
+        self.max_retries = max_retries
+        self._queue: Optional[asyncio.Queue] = None  # (user_id, момент отправки) - по одной записи на чат
+        self._pending: Dict[int, List[str]] = {}  # user_id -> накопленные сообщения
+        self._overflow: Dict[int, int] = {}  # user_id -> сколько уведомлений не вошло в пачку
+        self._worker_tasks: List[asyncio.Task] = []
+        metrics.add_collector(lambda: notification_queue_chats.set(len(self._pending)))
+    
+    @property
+    def bot(self) -> Bot:
+        return self._bot or get_bot()
         
     def set_user_notifications(self, user_id: int, settings: dict):
         """Настройки уведомлений пользователя"""
@@ -28,21 +77,135 @@ class NotificationManager:
             'errors': True
         })
     
-    async def send_notification(self, user_id: int, message: str, notification_type: str = 'info'):
-        """Отправляем уведомление пользователю"""
+    def get_subscribed_users(self, notification_type: str) -> List[int]:
+        """Пользователи, явно включившие данный тип уведомлений"""
+        return [user_id for user_id, settings in self.notification_settings.items()
+                if settings.get(notification_type, False)]
+    
+    async def send_notification(self, user_id: int, message: str, notification_type: str = 'info') -> bool:
+        """Отправляем уведомление пользователю (через очередь, если она запущена)"""
         try:
             settings = self.get_user_settings(user_id)
             if not settings.get(notification_type, True):
-                return
+                return False
             
-            await self.bot.send_message(
-                chat_id=user_id,
-                text=message,
-                parse_mode='HTML'
-            )
-            logger.debug(f"📨 Уведомление отправлено пользователю {user_id}: {notification_type}")
+            if not self._worker_tasks:
+                return await self._deliver(user_id, message)
+            return self._enqueue(user_id, message)
         except Exception as e:
             logger.error(f"Ошибка отправки уведомления пользователю {user_id}: {e}")
+            return False
+    
+    def _enqueue(self, user_id: int, message: str) -> bool:
+        """Кладем сообщение в очередь; если у пользователя уже есть ожидающая пачка - дописываем в нее"""
+        pending = self._pending.get(user_id)
+        if pending is not None:
+            if len(pending) < self.max_batch:
+                pending.append(message)
+            else:
+                self._overflow[user_id] = self._overflow.get(user_id, 0) + 1
+            notification_total.inc(result='coalesced')
+            return True
+        
+        try:
+            self._queue.put_nowait((user_id, time.monotonic() + self.coalesce_window))
+        except asyncio.QueueFull:
+            logger.error(f"Очередь уведомлений переполнена, сообщение пользователю {user_id} пропущено")
+            notification_total.inc(result='dropped')
+            return False
+        self._pending[user_id] = [message]
+        return True
+    
+    def _compose(self, messages: List[str], overflow: int) -> List[str]:
+        """Собираем пачку уведомлений в одно или несколько сообщений в пределах лимита Telegram"""
+        if len(messages) == 1 and not overflow:
+            return [fit_html(messages[0], TELEGRAM_MESSAGE_LIMIT)]
+        
+        parts = [m.strip() for m in messages]
+        if overflow:
+            parts.append(f"… и еще {overflow} уведомлений")
+        header = f"📬 <b>Уведомлений: {len(messages) + overflow}</b>\n\n"
+        
+        # Сообщения делим только по границам уведомлений; длинное уведомление сокращается целиком
+        texts, current = [], header
+        for part in parts:
+            separator = BATCH_SEPARATOR if current not in (header, "") else ""
+            if len(current) + len(separator) + len(part) > TELEGRAM_MESSAGE_LIMIT and current != header:
+                texts.append(current)
+                current, separator = "", ""
+            current += separator + fit_html(part, TELEGRAM_MESSAGE_LIMIT - len(current) - len(separator))
+        texts.append(current)
+        return texts
+    
+    async def _deliver(self, user_id: int, text: str) -> bool:
+        """Отправляем одно сообщение с учетом лимитов и повторами после 429 и сетевых ошибок"""
+        for attempt in range(self.max_retries + 1):
+            await telegram_rate_limiter.acquire(user_id)
+            try:
+                await self.bot.send_message(
+                    chat_id=user_id,
+                    text=text,
+                    parse_mode='HTML'
+                )
+                notification_total.inc(result='sent')
+                logger.debug(f"📨 Уведомление отправлено пользователю {user_id}")
+                return True
+            except TelegramRetryAfter as e:
+                logger.warning(f"⏳ Telegram ограничил отправку пользователю {user_id}, ждем {e.retry_after}с")
+                telegram_rate_limiter.pause(user_id, e.retry_after)
+            except TelegramNetworkError as e:
+                logger.warning(f"Сетевая ошибка отправки пользователю {user_id}: {e}")
+                await asyncio.sleep(min(2 ** attempt, 10))
+            except Exception as e:
+                logger.error(f"Ошибка отправки уведомления пользователю {user_id}: {e}")
+                notification_total.inc(result='failed')
+                return False
+            notification_total.inc(result='retry')
+        
+        logger.error(f"Уведомление пользователю {user_id} не отправлено после {self.max_retries} повторов")
+        notification_total.inc(result='failed')
+        return False
+    
+    async def _worker(self):
+        while True:
+            user_id, send_at = await self._queue.get()
+            try:
+                # Ждем окончания окна объединения: за это время к пачке могут добавиться сообщения
+                delay = send_at - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                messages = self._pending.pop(user_id, [])
+                overflow = self._overflow.pop(user_id, 0)
+                for text in self._compose(messages, overflow):
+                    await self._deliver(user_id, text)
+            except Exception as e:
+                logger.error(f"Ошибка обработки очереди уведомлений: {e}")
+            finally:
+                self._queue.task_done()
+    
+    async def start(self):
+        """Запускаем очередь исходящих уведомлений"""
+        if self._worker_tasks:
+            return
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        self._worker_tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        logger.info(f"📨 Очередь уведомлений запущена ({self.workers} отправителей)")
+    
+    async def stop(self, timeout: float = 10):
+        """Досылаем накопленные уведомления (не дольше timeout секунд) и останавливаем очередь"""
+        if not self._worker_tasks:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"⚠️ Не отправлено уведомлений для {len(self._pending)} пользователей")
+        for task in self._worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self._worker_tasks, return_exceptions=True)
+        self._worker_tasks = []
+        self._pending.clear()
+        self._overflow.clear()
+        logger.info("📨 Очередь уведомлений остановлена")
     
     async def notify_position_opened(self, user_id: int, position: dict):
         """Уведомление об открытии позиции"""
@@ -140,7 +303,7 @@ class NotificationManager:
 """
         await self.send_notification(user_id, message, 'errors')
     
-    async def send_daily_summary(self, user_id: int, summary_text: str):
+    async def send_daily_summary(self, user_id: int, summary_text: str) -> bool:
         """Ежедневная сводка"""
         message = f"""
 📊 <b>Ежедневный отчет</b>
@@ -149,7 +312,7 @@ class NotificationManager:
 
 📅 {datetime.now().strftime('%d.%m.%Y')}
 """
-        await self.send_notification(user_id, message, 'daily_summary')
+        return await self.send_notification(user_id, message, 'daily_summary')
     
     def format_notification_settings(self, user_id: int) -> str:
         """Форматируем текущие настройки уведомлений"""
@@ -169,4 +332,10 @@ class NotificationManager:
         return text
 
 # Глобальный экземпляр для использования в других модулях
-notification_manager = NotificationManager()
\ No newline at end of file
+notification_manager = NotificationManager(
+    queue_size=NOTIFICATION_QUEUE_SIZE,
+    coalesce_window=NOTIFICATION_COALESCE_WINDOW,
+    max_batch=NOTIFICATION_MAX_BATCH,
+    workers=NOTIFICATION_WORKERS,
+    max_retries=NOTIFICATION_MAX_RETRIES
+)
\ No newline at end of file
@@ -0,0 +1,118 @@
+import asyncio
+import logging
+import threading
+import time
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+from config import PRICE_CACHE_TTL, PRICE_CACHE_STALE_TTL
+
+logger = logging.getLogger(__name__)
+
+class PriceCache:
+    """
+    Общий кэш цен по адресу контракта.
+    Котировка моложе ttl считается свежей. Котировка моложе stale_ttl отдается сразу,
+    а в фоне запускается обновление (stale-while-revalidate). Старше - запрашивается заново.
+    """
+
+    def __init__(self, ttl: float = 15, stale_ttl: float = 60):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self._entries: Dict[str, Tuple[float, float]] = {}  # контракт -> (цена, время котировки)
+        self._lock = threading.Lock()  # Кэш читается и из пула потоков AxiomClient
+        self._refreshing: Dict[str, asyncio.Task] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def set(self, contract_address: str, price: float, quoted_at: float = None):
+        if price <= 0:
+            return
+        with self._lock:
+            self._entries[contract_address] = (price, quoted_at or time.time())
+
+    def set_many(self, prices: Dict[str, float], quoted_at: float = None):
+        quoted_at = quoted_at or time.time()
+        with self._lock:
+            for contract_address, price in prices.items():
+                if price > 0:
+                    self._entries[contract_address] = (price, quoted_at)
+
+    def get_entry(self, contract_address: str) -> Optional[Tuple[float, float]]:
+        """(цена, время котировки) или None"""
+        with self._lock:
+            return self._entries.get(contract_address)
+
+    def get_age(self, contract_address: str) -> Optional[float]:
+        entry = self.get_entry(contract_address)
+        return time.time() - entry[1] if entry else None
+
+    def get(self, contract_address: str, max_age: float = None) -> Optional[float]:
+        """Цена из кэша, если она не старше max_age (по умолчанию ttl)"""
+        max_age = self.ttl if max_age is None else max_age
+        entry = self.get_entry(contract_address)
+        if entry and time.time() - entry[1] <= max_age:
+            return entry[0]
+        return None
+
+    def invalidate(self, contract_address: str):
+        with self._lock:
+            self._entries.pop(contract_address, None)
+
+    async def get_or_fetch(self, contract_address: str,
+                           fetch: Callable[[str], Awaitable[float]], max_age: float = None) -> float:
+        """Цена из кэша или из fetch; устаревшая в пределах stale_ttl цена обновляется в фоне"""
+        max_age = self.ttl if max_age is None else max_age
+        entry = self.get_entry(contract_address)
+        if entry:
+            age = time.time() - entry[1]
+            if age <= max_age:
+                self.hits += 1
+                return entry[0]
+            if max_age > 0 and age <= self.stale_ttl:
+                self.hits += 1
+                self._schedule_refresh(contract_address, fetch)
+                return entry[0]
+
+        self.misses += 1
+        price = await fetch(contract_address)
+        self.set(contract_address, price)
+        return price
+
+    def get_or_fetch_sync(self, contract_address: str, fetch: Callable[[str], float],
+                          max_age: float = None) -> float:
+        """Синхронный вариант для рабочих потоков: устаревшая цена отдается без фонового обновления"""
+        max_age = self.ttl if max_age is None else max_age
+        entry = self.get_entry(contract_address)
+        if entry:
+            age = time.time() - entry[1]
+            if age <= max_age or (max_age > 0 and age <= self.stale_ttl):
+                self.hits += 1
+                return entry[0]
+
+        self.misses += 1
+        price = fetch(contract_address)
+        self.set(contract_address, price)
+        return price
+
+    def _schedule_refresh(self, contract_address: str, fetch: Callable[[str], Awaitable[float]]):
+        task = self._refreshing.get(contract_address)
+        if task is not None and not task.done():
+            return  # Обновление уже идет
+
+        async def refresh():
+            try:
+                self.set(contract_address, await fetch(contract_address))
+            except Exception as e:
+                logger.warning(f"Ошибка фонового обновления цены {contract_address[:8]}...: {e}")
+            finally:
+                self._refreshing.pop(contract_address, None)
+
+        self._refreshing[contract_address] = asyncio.get_running_loop().create_task(refresh())
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            size = len(self._entries)
+        return {'size': size, 'hits': self.hits, 'misses': self.misses}
+
+# Глобальный экземпляр: монитор цен наполняет его, бот и исполнение сделок читают
+price_cache = PriceCache(ttl=PRICE_CACHE_TTL, stale_ttl=PRICE_CACHE_STALE_TTL)
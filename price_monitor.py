@@ -1,172 +1,388 @@
 import time
+import math
 import asyncio
-import aiohttp
-from typing import Dict
+from typing import Dict, List, Optional, Tuple
 import logging
 
+from config import POLL_SAFETY_FACTOR, DEFAULT_PRICE_VOLATILITY, MIN_PRICE_VOLATILITY
+from http_session import is_session_active
+from jupiter_prices import fetch_token_prices
+from metrics import (
+    metrics, monitor_cycle_seconds, monitor_polled_mints, price_age_seconds,
+    trigger_to_signature_seconds, trigger_total
+)
+from price_cache import price_cache
+from price_sources import PriceSource
+from trigger_index import TriggerIndex
+
 logger = logging.getLogger(__name__)
 
 class PriceMonitor:
-    def __init__(self, axiom_client, check_interval: int = 30):
+    def __init__(self, axiom_client, check_interval: int = 30, batch_size: int = 100,
+                 max_concurrent_triggers: int = 5, price_source: Optional[PriceSource] = None,
+                 min_poll_interval: float = 0.5):
         self.axiom_client = axiom_client
         self.storage = axiom_client.storage
-        self.check_interval = check_interval
+        self.check_interval = check_interval  # Максимальный интервал опроса контракта
+        self.min_poll_interval = min(min_poll_interval, check_interval)
+        self.batch_size = batch_size  # Максимум адресов в одном запросе ids= к Jupiter
         self.is_running = False
-        self.session = None
         self.monitoring_task = None
+        # Исполнение триггеров: общий лимит параллельных сделок и блокировка на позицию.
+        # Сама продажа идет под ledger.closing (пользователь, контракт) - общей с ручным и массовым закрытием
+        self.trigger_semaphore = asyncio.Semaphore(max_concurrent_triggers)
+        # У стоп-лоссов свой лимит: тейк-профиты, ждущие своп в очереди, не занимают места выходов
+        self.exit_semaphore = asyncio.Semaphore(max_concurrent_triggers)
+        self._position_locks: Dict[str, asyncio.Lock] = {}
+        self._pending_triggers = set()  # id позиций, для которых задача уже запущена
+        self._trigger_tasks = set()
+        # Потоковый источник цен (опционально); опрос по check_interval остается резервом
+        self.price_source = price_source
+        self.mint_index: Dict[str, List[Tuple[int, Dict]]] = {}
+        self.trigger_index = TriggerIndex()
+        self._index_version = None
+        self._index_dirty = True
+        self._last_full_refresh = 0.0
+        # Адаптивный опрос: чем ближе цена к триггеру и чем волатильнее токен, тем чаще запрос
+        self._next_poll_at: Dict[str, float] = {}
+        self._poll_intervals: Dict[str, float] = {}
+        self._last_quotes: Dict[str, Tuple[float, float]] = {}  # контракт -> (цена, время)
+        self._volatility: Dict[str, float] = {}
+        metrics.add_collector(self._collect_metrics)
     
     async def get_token_price(self, contract_address: str) -> float:
         """Получаем текущую цену токена через Jupiter API"""
-        try:
-            if not self.session:
-                self.session = aiohttp.ClientSession()
-            
-            url = f"https://quote-api.jup.ag/v6/price?ids={contract_address}"
-            async with self.session.get(url, timeout=10) as response:
-                if response.status == 200:
-                    data = await response.json()
-                    if 'data' in data and contract_address in data['data']:
-                        return float(data['data'][contract_address]['price'])
-                else:
-                    logger.warning(f"Jupiter API returned status {response.status} for {contract_address}")
-                    return 0.0
-        except asyncio.TimeoutError:
-            logger.warning(f"Timeout getting price for {contract_address}")
-            return 0.0
-        except Exception as e:
-            logger.error(f"Ошибка получения цены токена {contract_address}: {e}")
-            return 0.0
+        prices = await self.get_token_prices([contract_address])
+        return prices.get(contract_address, 0.0)
+    
+    async def get_token_prices(self, contract_addresses: List[str]) -> Dict[str, float]:
+        """Получаем цены сразу для набора токенов пачками по batch_size через общую HTTP сессию"""
+        prices = await fetch_token_prices(contract_addresses, self.batch_size)
+        # Свежие котировки сразу доступны боту и исполнению сделок
+        price_cache.set_many(prices)
+        return prices
+    
+    @staticmethod
+    def build_mint_index(positions_data: Dict) -> Dict[str, List[Tuple[int, Dict]]]:
+        """Строим индекс контракт -> список (user_id, позиция) для текущего цикла"""
+        mint_index = {}
+        for user_id_str, positions in positions_data.items():
+            user_id = int(user_id_str)
+            for position in positions:
+                contract_address = position.get('contract_address')
+                if not contract_address:
+                    continue
+                mint_index.setdefault(contract_address, []).append((user_id, position))
+        return mint_index
+    
+    def refresh_mint_index(self, force: bool = False) -> Dict[str, List[Tuple[int, Dict]]]:
+        """Перестраиваем индекс, если позиции добавлялись/удалялись или менялись триггерами"""
+        version = getattr(self.storage, 'version', None)
+        if force or self._index_dirty or version is None or version != self._index_version:
+            self.mint_index = self.build_mint_index(self.storage.load_positions())
+            self.trigger_index = TriggerIndex.build(self.mint_index)
+            self._index_version = version
+            self._index_dirty = False
+        return self.mint_index
+    
+    async def handle_price_ticks(self, prices: Dict[str, float]):
+        """Обрабатываем котировки из потокового источника сразу по мере прихода"""
+        price_cache.set_many(prices)
+        mint_index = self.refresh_mint_index()
+        for contract_address, current_price in prices.items():
+            holders = mint_index.get(contract_address)
+            if holders and current_price > 0:
+                await self.process_mint_price(contract_address, current_price, holders)
+    
+    def poll_interval(self, distance: float, volatility: Optional[float]) -> float:
+        """
+        Интервал опроса по расстоянию до триггера и волатильности.
+        При случайном блуждании цена проходит расстояние d примерно за (d / sigma)^2 секунд,
+        опрашиваем за POLL_SAFETY_FACTOR этого времени, в пределах [min_poll_interval, check_interval].
+        """
+        sigma = max(volatility if volatility is not None else DEFAULT_PRICE_VOLATILITY, MIN_PRICE_VOLATILITY)
+        interval = POLL_SAFETY_FACTOR * (distance / sigma) ** 2
+        return min(max(interval, self.min_poll_interval), self.check_interval)
+    
+    def _update_volatility(self, contract_address: str, price: float, now: float):
+        """Скользящая (EWMA) оценка волатильности: |лог-доходность| / sqrt(интервал между котировками)"""
+        last = self._last_quotes.get(contract_address)
+        if last is not None:
+            last_price, last_at = last
+            elapsed = now - last_at
+            if elapsed < 0.1 or last_price <= 0:
+                return  # Слишком частые котировки дают шумную оценку
+            sample = abs(math.log(price / last_price)) / math.sqrt(elapsed)
+            previous = self._volatility.get(contract_address)
+            self._volatility[contract_address] = sample if previous is None else 0.7 * previous + 0.3 * sample
+        self._last_quotes[contract_address] = (price, now)
+    
+    def _schedule_mint(self, contract_address: str, current_price: float):
+        """Планируем следующий опрос контракта по ближайшему порогу среди всех держателей"""
+        now = time.time()
+        self._update_volatility(contract_address, current_price, now)
+        
+        distance = self.trigger_index.distance(contract_address, current_price)
+        interval = self.check_interval if distance is None else \
+            self.poll_interval(distance, self._volatility.get(contract_address))
+        self._poll_intervals[contract_address] = interval
+        self._next_poll_at[contract_address] = now + interval
+    
+    def _forget_mint(self, contract_address: str):
+        for state in (self._next_poll_at, self._poll_intervals, self._last_quotes, self._volatility):
+            state.pop(contract_address, None)
+    
+    def _due_mints(self, mint_index: Dict[str, List[Tuple[int, Dict]]], now: float) -> List[str]:
+        """Контракты, чей срок опроса наступил. Котировки из потока сдвигают срок так же, как опрос"""
+        for contract_address in [m for m in self._next_poll_at if m not in mint_index]:
+            self._forget_mint(contract_address)
+        return [m for m in mint_index if self._next_poll_at.get(m, 0) <= now]
+    
+    def _sleep_interval(self, now: float) -> float:
+        """Спим до ближайшего запланированного опроса"""
+        if not self._next_poll_at:
+            return self.check_interval
+        delay = min(self._next_poll_at.values()) - now
+        return min(max(delay, self.min_poll_interval), self.check_interval)
     
     async def check_prices(self):
-        """Проверяем цены всех отслеживаемых позиций"""
+        """
+        Проверяем цены отслеживаемых позиций с адаптивной частотой:
+        контракты рядом с SL/TP опрашиваются часто, спокойные - раз в check_interval
+        """
         while self.is_running:
             try:
-                positions_data = self.storage.load_positions()
+                now = time.time()
+                # Полностью перечитываем позиции раз в check_interval (изменения SL/TP из бота),
+                # в промежутках - только если позиции добавлялись/удалялись
+                force_refresh = now - self._last_full_refresh >= self.check_interval
+                previous_index = self.mint_index
+                mint_index = self.refresh_mint_index(force=force_refresh)
+                if force_refresh:
+                    self._last_full_refresh = now
                 
-                for user_id_str, positions in positions_data.items():
-                    user_id = int(user_id_str)
-                    
-                    # Создаем копию списка для безопасной итерации
-                    positions_copy = positions.copy()
-                    
-                    for position in positions_copy:
-                        contract_address = position.get('contract_address')
-                        if not contract_address:
-                            continue
-                        
-                        # Получаем текущую цену
-                        current_price = await self.get_token_price(contract_address)
+                if self.price_source is not None and mint_index is not previous_index:
+                    await self.price_source.subscribe(mint_index.keys())
+                
+                # Каждый контракт запрашиваем одним запросом на всех держателей
+                due_mints = self._due_mints(mint_index, now)
+                monitor_polled_mints.set(len(due_mints))
+                if due_mints:
+                    with monitor_cycle_seconds.time():
+                        prices = await self.get_token_prices(due_mints)
+                        logger.debug(f"Получено {len(prices)} цен для {len(due_mints)} контрактов")
                         
-                        if current_price > 0:
-                            entry_price = position.get('entry_price', 0)
-                            if entry_price > 0:
-                                # Рассчитываем PnL в процентах
-                                pnl_percent = ((current_price - entry_price) / entry_price) * 100
-                                
-                                # Обновляем текущую цену и PnL в позиции
-                                self.storage.update_position(
-                                    user_id,
-                                    position['id'],
-                                    {
-                                        'current_price': current_price, 
-                                        'pnl': pnl_percent
-                                    }
-                                )
-                                
-                                logger.debug(f"Updated price for {contract_address[:8]}...: {current_price:.8f}, PnL: {pnl_percent:.2f}%")
-                                
-                                # Проверяем условия для автоматических действий
-                                await self.check_automation_triggers(user_id, position, current_price, pnl_percent)
+                        for contract_address in due_mints:
+                            current_price = prices.get(contract_address, 0.0)
+                            if current_price > 0:
+                                await self.process_mint_price(contract_address, current_price, mint_index[contract_address])
+                            else:
+                                # Цены нет - повторяем с прежним интервалом
+                                self._next_poll_at[contract_address] = time.time() + \
+                                    self._poll_intervals.get(contract_address, self.check_interval)
                 
-                await asyncio.sleep(self.check_interval)
+                await asyncio.sleep(self._sleep_interval(time.time()))
                 
             except Exception as e:
                 logger.error(f"Ошибка в мониторинге цен: {e}")
                 await asyncio.sleep(self.check_interval)
     
+    async def process_mint_price(self, contract_address: str, current_price: float, holders: List[Tuple[int, Dict]]):
+        """Раздаем цену контракта всем держателям; сработавшие триггеры ищем по индексу порогов"""
+        for user_id, position in holders:
+            entry_price = position.get('entry_price', 0)
+            if entry_price <= 0:
+                continue
+            
+            # Рассчитываем PnL в процентах
+            pnl_percent = ((current_price - entry_price) / entry_price) * 100
+            
+            # Обновляем текущую цену и PnL в позиции
+            self.storage.update_position(
+                user_id,
+                position['id'],
+                {
+                    'current_price': current_price, 
+                    'pnl': pnl_percent
+                }
+            )
+            
+            logger.debug(f"Updated price for {contract_address[:8]}...: {current_price:.8f}, PnL: {pnl_percent:.2f}%")
+        
+        # Бинарный поиск по отсортированным порогам находит только позиции, пересекшие SL/TP/безубыток;
+        # evaluate_triggers уточняет действия, исполнение - отдельной задачей
+        for user_id, position in self.trigger_index.crossed(contract_address, current_price):
+            entry_price = position['entry_price']
+            pnl_percent = ((current_price - entry_price) / entry_price) * 100
+            if self.evaluate_triggers(position, pnl_percent):
+                self.dispatch_triggers(user_id, position, pnl_percent)
+        
+        self._schedule_mint(contract_address, current_price)
+    
+    def dispatch_triggers(self, user_id: int, position: Dict, pnl_percent: float):
+        """Запускаем исполнение триггеров позиции отдельной задачей, не блокируя цикл мониторинга"""
+        position_id = position['id']
+        if position_id in self._pending_triggers:
+            logger.debug(f"Trigger for {position_id} is already in progress, skipping")
+            return
+        
+        self._pending_triggers.add(position_id)
+        task = asyncio.create_task(self._run_triggers(user_id, position_id, pnl_percent, time.perf_counter()))
+        self._trigger_tasks.add(task)
+        
+        def on_done(finished_task):
+            self._trigger_tasks.discard(finished_task)
+            self._pending_triggers.discard(position_id)
+        
+        task.add_done_callback(on_done)
+    
+    async def _run_triggers(self, user_id: int, position_id: str, pnl_percent: float, detected_at: float = None):
+        """Исполняем триггеры под блокировкой позиции в рамках лимита: у SL он свой, отдельно от TP/Breakeven"""
+        lock = self._position_locks.setdefault(position_id, asyncio.Lock())
+        try:
+            async with lock:
+                # Перечитываем позицию: пока задача ждала, ее могли закрыть или изменить
+                position = self.storage.get_position(user_id, position_id)
+                if position is None:
+                    return
+                actions = self.evaluate_triggers(position, pnl_percent)
+                if not actions:
+                    return
+                semaphore = self.exit_semaphore if actions[0][0] == 'sl' else self.trigger_semaphore
+                async with semaphore:
+                    await self.execute_trigger_actions(user_id, position, pnl_percent, actions, detected_at)
+                    # Состояние триггеров позиции изменилось - индекс нужно перечитать
+                    self._index_dirty = True
+        finally:
+            if self.storage.get_position(user_id, position_id) is None and not lock.locked():
+                self._position_locks.pop(position_id, None)
+    
+    @staticmethod
+    def evaluate_triggers(position: Dict, pnl_percent: float) -> List[Tuple[str, Optional[int]]]:
+        """
+        Определяем, какие автоматические действия нужно выполнить для позиции.
+        Чистая функция без I/O: возвращает список ('sl' | 'breakeven' | 'tp', индекс TP или None)
+        """
+        sl = position.get('sl', 15)
+        tp_levels = position.get('tp_levels', [])
+        breakeven_percent = position.get('breakeven_percent', 15)
+        breakeven_moved = position.get('breakeven_moved', False)
+        tp_executed = position.get('tp_executed', [])
+        
+        # 1. Стоп-лосс - после него больше ничего не проверяем
+        if pnl_percent <= -sl:
+            return [('sl', None)]
+        
+        actions = []
+        
+        # 2. Перемещение в безубыток
+        if pnl_percent >= breakeven_percent and not breakeven_moved:
+            actions.append(('breakeven', None))
+        
+        # 3. Тейк-профиты
+        for i, tp_config in enumerate(tp_levels):
+            if i in tp_executed:
+                continue  # Этот TP уже выполнен
+            
+            tp_level = tp_config.get('level', 0) if isinstance(tp_config, dict) else tp_config
+            
+            if tp_level <= 0:
+                logger.warning(f"Invalid TP level at index {i}: {tp_level}")
+                continue
+            
+            tp_percent = (tp_level - 1) * 100  # Конвертируем множитель в проценты
+            
+            if pnl_percent >= tp_percent:
+                actions.append(('tp', i))
+        
+        return actions
+    
     async def check_automation_triggers(self, user_id: int, position: Dict, current_price: float, pnl_percent: float):
         """Проверяем условия для автоматического выполнения SL/TP/Breakeven с новой логикой TP"""
+        contract_address = position.get('contract_address')
+        try:
+            if self.evaluate_triggers(position, pnl_percent):
+                await self._run_triggers(user_id, position['id'], pnl_percent, time.perf_counter())
+        except Exception as e:
+            logger.error(f"Ошибка в check_automation_triggers для {contract_address}: {e}")
+    
+    async def execute_trigger_actions(self, user_id: int, position: Dict, pnl_percent: float,
+                                      actions: List[Tuple[str, Optional[int]]], detected_at: float = None):
+        """Выполняем действия, найденные evaluate_triggers; detected_at - момент обнаружения (perf_counter)"""
+        contract_address = position.get('contract_address')
+        detected_at = detected_at or time.perf_counter()
         try:
             position_id = position['id']
-            contract_address = position['contract_address']
             sl = position.get('sl', 15)
             tp_levels = position.get('tp_levels', [])
             breakeven_percent = position.get('breakeven_percent', 15)
-            breakeven_moved = position.get('breakeven_moved', False)
-            tp_executed = position.get('tp_executed', [])
+            tp_executed = list(position.get('tp_executed', []))
             
-            # 1. Проверяем стоп-лосс
-            if pnl_percent <= -sl:
-                logger.warning(f"🛑 STOP LOSS triggered for {contract_address[:8]}...: {pnl_percent:.2f}% <= -{sl}%")
-                success = self.axiom_client.execute_stop_loss(user_id, position)
-                if success:
-                    logger.info(f"✅ Stop Loss executed successfully for {contract_address[:8]}...")
-                else:
-                    logger.error(f"❌ Stop Loss execution failed for {contract_address[:8]}...")
-                return  # После SL больше ничего не проверяем
-            
-            # 2. Проверяем перемещение в безубыток
-            if pnl_percent >= breakeven_percent and not breakeven_moved:
-                logger.info(f"⚖️ Moving to breakeven for {contract_address[:8]}...: PnL {pnl_percent:.2f}% >= {breakeven_percent}%")
-                success = self.axiom_client.move_to_breakeven(user_id, position)
-                if success:
-                    logger.info(f"✅ Moved to breakeven for {contract_address[:8]}...")
-                else:
-                    logger.error(f"❌ Failed to move to breakeven for {contract_address[:8]}...")
-            
-            # 3. Проверяем тейк-профиты с новой логикой
-            for i, tp_config in enumerate(tp_levels):
-                if i in tp_executed:
-                    continue  # Этот TP уже выполнен
+            for action, tp_index in actions:
+                # 1. Стоп-лосс
+                if action == 'sl':
+                    logger.warning(f"🛑 STOP LOSS triggered for {contract_address[:8]}...: {pnl_percent:.2f}% <= -{sl}%")
+                    success = await self.axiom_client.execute_stop_loss(user_id, position)
+                    trigger_total.inc(action='sl', result='ok' if success else 'failed')
+                    if success:
+                        trigger_to_signature_seconds.observe(time.perf_counter() - detected_at, action='sl')
+                        logger.info(f"✅ Stop Loss executed successfully for {contract_address[:8]}...")
+                    else:
+                        logger.error(f"❌ Stop Loss execution failed for {contract_address[:8]}...")
+                    return  # После SL больше ничего не выполняем
                 
+                # 2. Перемещение в безубыток
+                if action == 'breakeven':
+                    logger.info(f"⚖️ Moving to breakeven for {contract_address[:8]}...: PnL {pnl_percent:.2f}% >= {breakeven_percent}%")
+                    success = await self.axiom_client.move_to_breakeven(user_id, position)
+                    trigger_total.inc(action='breakeven', result='ok' if success else 'failed')
+                    if success:
+                        logger.info(f"✅ Moved to breakeven for {contract_address[:8]}...")
+                    else:
+                        logger.error(f"❌ Failed to move to breakeven for {contract_address[:8]}...")
+                    continue
+                
+                # 3. Тейк-профит
+                tp_config = tp_levels[tp_index]
                 tp_level = tp_config.get('level', 0) if isinstance(tp_config, dict) else tp_config
                 volume_percent = tp_config.get('volume_percent', 25) if isinstance(tp_config, dict) else 25
+                tp_percent = (tp_level - 1) * 100
                 
-                if tp_level <= 0:
-                    logger.warning(f"Invalid TP level at index {i}: {tp_level}")
-                    continue
-                
-                tp_percent = (tp_level - 1) * 100  # Конвертируем множитель в проценты
+                logger.info(f"🎯 TAKE PROFIT {tp_level}x triggered for {contract_address[:8]}...: PnL {pnl_percent:.2f}% >= {tp_percent:.2f}%")
+                success = await self.axiom_client.execute_take_profit(user_id, position, tp_index)
+                trigger_total.inc(action='tp', result='ok' if success else 'failed')
+                if success:
+                    trigger_to_signature_seconds.observe(time.perf_counter() - detected_at, action='tp')
+                    # Добавляем индекс выполненного TP
+                    tp_executed.append(tp_index)
+                    self.storage.update_position(
+                        user_id, 
+                        position_id, 
+                        {'tp_executed': list(tp_executed)}
+                    )
+                    logger.info(f"✅ Take Profit {tp_level}x executed successfully for {contract_address[:8]}... ({volume_percent}%)")
+                else:
+                    logger.error(f"❌ Take Profit {tp_level}x execution failed for {contract_address[:8]}...")
                 
-                if pnl_percent >= tp_percent:
-                    logger.info(f"🎯 TAKE PROFIT {tp_level}x triggered for {contract_address[:8]}...: PnL {pnl_percent:.2f}% >= {tp_percent:.2f}%")
-                    success = self.axiom_client.execute_take_profit(user_id, position, i)
-                    if success:
-                        # Добавляем индекс выполненного TP
-                        new_tp_executed = tp_executed.copy()
-                        new_tp_executed.append(i)
-                        self.storage.update_position(
-                            user_id, 
-                            position_id, 
-                            {'tp_executed': new_tp_executed}
-                        )
-                        logger.info(f"✅ Take Profit {tp_level}x executed successfully for {contract_address[:8]}... ({volume_percent}%)")
-                    else:
-                        logger.error(f"❌ Take Profit {tp_level}x execution failed for {contract_address[:8]}...")
-                    
-                    # Проверяем, нужно ли удалить позицию после выполнения TP
-                    await self.check_position_after_tp(user_id, position, contract_address)
+                # Проверяем, нужно ли удалить позицию после выполнения TP
+                await self.check_position_after_tp(user_id, position, contract_address)
                     
         except Exception as e:
-            logger.error(f"Ошибка в check_automation_triggers для {contract_address}: {e}")
+            logger.error(f"Ошибка выполнения триггеров для {contract_address}: {e}")
     
     async def check_position_after_tp(self, user_id: int, position: Dict, contract_address: str):
         """Проверяем состояние позиции после выполнения TP"""
         try:
-            # Получаем актуальный баланс токена
-            token_balance = self.axiom_client.get_token_balance(contract_address)
+            # Остаток позиции по учету токенов (close_position уже списал проданное), без RPC
+            token_balance = self.axiom_client.ledger.quantity(user_id, position['id'])
+            if token_balance is None:
+                return  # Позиция уже удалена
             
             if token_balance <= 0.0001:  # Практически ноль токенов
                 logger.info(f"🧹 Position {contract_address[:8]}... has minimal tokens left, removing from tracking")
                 self.storage.remove_position(user_id, position['id'])
             else:
-                # Обновляем количество токенов в позиции
-                self.storage.update_position(
-                    user_id, 
-                    position['id'], 
-                    {'token_amount': token_balance}
-                )
-                logger.debug(f"Updated token amount for {contract_address[:8]}...: {token_balance}")
+                logger.debug(f"Token amount for {contract_address[:8]}... after TP: {token_balance}")
                 
         except Exception as e:
             logger.error(f"Ошибка при проверке позиции после TP {contract_address}: {e}")
@@ -180,12 +396,13 @@ class PriceMonitor:
         logger.info(f"📊 Запуск мониторинга цен (интервал: {self.check_interval}с)")
         self.is_running = True
         
-        # Создаем HTTP сессию
-        self.session = aiohttp.ClientSession()
-        
         # Запускаем мониторинг
         self.monitoring_task = asyncio.create_task(self.check_prices())
         
+        # Потоковые котировки обрабатываются по мере прихода
+        if self.price_source is not None:
+            await self.price_source.start(self.handle_price_ticks)
+        
         logger.info("✅ Мониторинг цен запущен")
     
     async def stop(self):
@@ -196,6 +413,9 @@ class PriceMonitor:
         logger.info("🛑 Остановка мониторинга цен...")
         self.is_running = False
         
+        if self.price_source is not None:
+            await self.price_source.stop()
+        
         # Отменяем задачу мониторинга
         if self.monitoring_task:
             self.monitoring_task.cancel()
@@ -204,18 +424,17 @@ class PriceMonitor:
             except asyncio.CancelledError:
                 logger.info("📊 Задача мониторинга отменена")
         
-        # Закрываем HTTP сессию
-        if self.session:
-            await self.session.close()
-            self.session = None
+        # Дожидаемся уже начатых продаж, чтобы не оставить позиции в промежуточном состоянии
+        if self._trigger_tasks:
+            logger.info(f"⏳ Ожидаем завершения {len(self._trigger_tasks)} задач исполнения триггеров...")
+            await asyncio.gather(*self._trigger_tasks, return_exceptions=True)
         
         logger.info("✅ Мониторинг цен остановлен")
     
     async def force_check_position(self, user_id: int, contract_address: str):
         """Принудительная проверка конкретной позиции"""
         try:
-            positions = self.storage.get_positions(user_id)
-            position = next((p for p in positions if p['contract_address'] == contract_address), None)
+            position = self.storage.find_position(user_id, contract_address)
             
             if not position:
                 logger.warning(f"Position not found for force check: {contract_address}")
@@ -250,6 +469,14 @@ class PriceMonitor:
         except Exception as e:
             logger.error(f"Ошибка при принудительной проверке позиции {contract_address}: {e}")
     
+    def _collect_metrics(self):
+        """Возраст котировок отслеживаемых контрактов - обновляется перед каждой выгрузкой метрик"""
+        price_age_seconds.clear()
+        for contract_address in list(self.mint_index):
+            age = price_cache.get_age(contract_address)
+            if age is not None:
+                price_age_seconds.set(age, contract=contract_address)
+    
     def get_monitoring_stats(self) -> Dict:
         """Получаем статистику мониторинга"""
         try:
@@ -262,7 +489,13 @@ class PriceMonitor:
                 'check_interval': self.check_interval,
                 'total_positions': total_positions,
                 'active_users': active_users,
-                'session_active': self.session is not None
+                'session_active': is_session_active(),
+                'stream_connected': self.price_source.is_healthy() if self.price_source else False,
+                'fast_polled_contracts': sum(
+                    1 for interval in self._poll_intervals.values() if interval < self.check_interval
+                ),
+                'min_poll_interval': min(self._poll_intervals.values(), default=self.check_interval),
+                'avg_cycle_seconds': monitor_cycle_seconds.get_summary()['avg']
             }
         except Exception as e:
             logger.error(f"Ошибка получения статистики мониторинга: {e}")
@@ -271,5 +504,6 @@ class PriceMonitor:
                 'check_interval': self.check_interval,
                 'total_positions': 0,
                 'active_users': 0,
-                'session_active': False
+                'session_active': False,
+                'stream_connected': False
             }
\ No newline at end of file
@@ -0,0 +1,136 @@
+import asyncio
+import json
+import logging
+import time
+from abc import ABC, abstractmethod
+from typing import Awaitable, Callable, Dict, Iterable, Optional, Set
+
+import aiohttp
+
+from http_session import get_session
+
+logger = logging.getLogger(__name__)
+
+PriceCallback = Callable[[Dict[str, float]], Awaitable[None]]
+
+class PriceSource(ABC):
+    """
+    Интерфейс источника цен с push-доставкой.
+    Источник сам вызывает on_prices({контракт: цена}) по мере прихода котировок.
+    """
+
+    @abstractmethod
+    async def start(self, on_prices: PriceCallback):
+        ...
+
+    @abstractmethod
+    async def stop(self):
+        ...
+
+    @abstractmethod
+    async def subscribe(self, contract_addresses: Iterable[str]):
+        """Задаем полный набор контрактов, по которым нужны котировки"""
+
+    @abstractmethod
+    def is_healthy(self) -> bool:
+        """Источник подключен и котировки приходят"""
+
+class StreamingPriceSource(PriceSource):
+    """
+    Подписка на цены через WebSocket.
+    Протокол: клиент отправляет {"action": "subscribe", "ids": [...]},
+    сервер присылает {"id": контракт, "price": цена} или пачкой {"data": {контракт: {"price": цена}}}.
+    При обрыве соединения переподключается с экспоненциальной задержкой.
+    """
+
+    def __init__(self, url: str, reconnect_delay: float = 1.0, max_reconnect_delay: float = 30.0):
+        self.url = url
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+        self.subscriptions: Set[str] = set()
+        self.last_tick_at: Optional[float] = None
+        self._on_prices: Optional[PriceCallback] = None
+        self._ws: Optional[aiohttp.ClientWebSocketResponse] = None
+        self._task: Optional[asyncio.Task] = None
+        self._running = False
+
+    async def start(self, on_prices: PriceCallback):
+        if self._running:
+            return
+        self._on_prices = on_prices
+        self._running = True
+        self._task = asyncio.create_task(self._run())
+        logger.info(f"📡 Потоковый источник цен запущен: {self.url}")
+
+    async def stop(self):
+        self._running = False
+        if self._ws is not None and not self._ws.closed:
+            await self._ws.close()
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        logger.info("📡 Потоковый источник цен остановлен")
+
+    async def subscribe(self, contract_addresses: Iterable[str]):
+        new_subscriptions = set(contract_addresses)
+        if new_subscriptions == self.subscriptions:
+            return
+        self.subscriptions = new_subscriptions
+        await self._send_subscriptions()
+
+    def is_healthy(self) -> bool:
+        return self._ws is not None and not self._ws.closed
+
+    async def _send_subscriptions(self):
+        if self.is_healthy():
+            await self._ws.send_json({'action': 'subscribe', 'ids': sorted(self.subscriptions)})
+
+    async def _run(self):
+        delay = self.reconnect_delay
+        while self._running:
+            try:
+                async with get_session().ws_connect(self.url, heartbeat=15) as ws:
+                    self._ws = ws
+                    delay = self.reconnect_delay
+                    logger.info("📡 Подключение к потоку цен установлено")
+                    await self._send_subscriptions()
+                    async for message in ws:
+                        if message.type == aiohttp.WSMsgType.TEXT:
+                            await self._handle_message(message.data)
+                        elif message.type in (aiohttp.WSMsgType.CLOSED, aiohttp.WSMsgType.ERROR):
+                            break
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Поток цен недоступен: {e}")
+            finally:
+                self._ws = None
+
+            if self._running:
+                logger.info(f"📡 Переподключение к потоку цен через {delay:.1f}с")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.max_reconnect_delay)
+
+    async def _handle_message(self, raw: str):
+        try:
+            payload = json.loads(raw)
+        except json.JSONDecodeError:
+            logger.debug(f"Некорректное сообщение потока цен: {raw[:100]}")
+            return
+
+        prices = {}
+        if 'data' in payload:
+            for contract_address, token_data in (payload.get('data') or {}).items():
+                if token_data and token_data.get('price') is not None:
+                    prices[contract_address] = float(token_data['price'])
+        elif payload.get('id') and payload.get('price') is not None:
+            prices[payload['id']] = float(payload['price'])
+
+        prices = {k: v for k, v in prices.items() if v > 0 and k in self.subscriptions}
+        if prices and self._on_prices is not None:
+            self.last_tick_at = time.time()
+            await self._on_prices(prices)
@@ -0,0 +1,77 @@
+import asyncio
+import time
+from typing import Dict
+
+from config import TELEGRAM_GLOBAL_RATE, TELEGRAM_PER_CHAT_RATE, TELEGRAM_PER_CHAT_BURST
+
+class TokenBucket:
+    """
+    Ведро токенов: в среднем rate операций в секунду, не больше capacity подряд.
+    Токены резервируются заранее (баланс может уйти в минус), поэтому ожидающие
+    обслуживаются строго по очереди без дополнительных блокировок.
+    """
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = max(capacity if capacity is not None else rate, 1)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, tokens: float = 1) -> float:
+        """Резервируем токены и возвращаем, сколько секунд нужно подождать до их появления"""
+        self._refill(time.monotonic())
+        self.tokens -= tokens
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def is_idle(self) -> bool:
+        self._refill(time.monotonic())
+        return self.tokens >= self.capacity
+
+    def pause(self, seconds: float):
+        """Сдвигаем следующую выдачу токена минимум на seconds секунд"""
+        self._refill(time.monotonic())
+        self.tokens = min(self.tokens, 0) - seconds * self.rate
+
+    async def acquire(self, tokens: float = 1):
+        delay = self.reserve(tokens)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+class TelegramRateLimiter:
+    """
+    Ограничение исходящих сообщений под лимиты Telegram:
+    общий поток бота (около 30 сообщений в секунду) и отдельный лимит на каждый чат.
+    """
+
+    MAX_IDLE_CHATS = 1000  # После этого числа ведер простаивающие чаты забываются
+
+    def __init__(self, global_rate: float = 30, per_chat_rate: float = 1, per_chat_burst: float = 1):
+        self.global_bucket = TokenBucket(global_rate)
+        self.per_chat_rate = per_chat_rate
+        self.per_chat_burst = per_chat_burst
+        self._chat_buckets: Dict[int, TokenBucket] = {}
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self._chat_buckets) >= self.MAX_IDLE_CHATS:
+                self._chat_buckets = {k: b for k, b in self._chat_buckets.items() if not b.is_idle()}
+            bucket = self._chat_buckets[chat_id] = TokenBucket(self.per_chat_rate, self.per_chat_burst)
+        return bucket
+
+    async def acquire(self, chat_id: int):
+        """Ждем, пока отправка в чат уложится и в лимит чата, и в общий лимит бота"""
+        # Общий токен берем только после ожидания своего чата, чтобы не занимать его зря
+        await self._chat_bucket(chat_id).acquire()
+        await self.global_bucket.acquire()
+
+    def pause(self, chat_id: int, seconds: float):
+        """Telegram ответил 429 с retry_after: следующие отправки в этот чат ждут указанное время"""
+        self._chat_bucket(chat_id).pause(seconds)
+
+# Глобальный ограничитель: все исходящие сообщения бота проходят через него
+telegram_rate_limiter = TelegramRateLimiter(TELEGRAM_GLOBAL_RATE, TELEGRAM_PER_CHAT_RATE, TELEGRAM_PER_CHAT_BURST)
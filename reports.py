@@ -1,9 +1,18 @@
 import json
 import os
 from datetime import datetime, timedelta
-from typing import Dict, List, Optional, Tuple
+from typing import Dict, Iterator, List, Optional, Tuple
 from dataclasses import dataclass
 import logging
+import threading
+
+from config import (
+    STORAGE_BACKEND, SQLITE_DB_PATH, TRADE_JOURNAL_FSYNC_BATCH, TRADE_JOURNAL_FSYNC_INTERVAL,
+    TRADE_HISTORY_DIR, TRADE_HISTORY_COMPACT_AFTER_MONTHS
+)
+from sqlite_storage import get_database, migrate_trades, trade_to_row
+from trade_journal import PartitionedTradeJournal
+from trade_stats import TradeStatistics
 
 logger = logging.getLogger(__name__)
 
@@ -29,34 +38,46 @@ class TradeRecord:
             self.details = {}
 
 class ReportsManager:
-    def __init__(self, filename: str = 'trade_history.json'):
-        self.filename = filename
-        self.ensure_file_exists()
+    def __init__(self, directory: str = 'trade_history',
+                 legacy_files: Tuple[str, ...] = ('trade_history.jsonl', 'trade_history.json'),
+                 fsync_batch_size: int = 20, fsync_interval: float = 1.0, compact_after_months: int = 0):
+        self.filename = directory
+        # История разбита по месяцам; единый файл старого формата переносится при первом запуске
+        self.journal = PartitionedTradeJournal(directory, legacy_files, fsync_batch_size, fsync_interval)
+        self._stats = None  # TradeStatistics, строится лениво и дополняется при каждой записи
+        self._stats_lock = threading.RLock()
+        if compact_after_months > 0:
+            self.journal.compact(compact_after_months)
     
     def ensure_file_exists(self):
-        if not os.path.exists(self.filename):
-            with open(self.filename, 'w') as f:
-                json.dump([], f)
+        os.makedirs(self.filename, exist_ok=True)
+    
+    def iter_history(self, since: float = None) -> Iterator[dict]:
+        """Потоково читаем историю сделок (начиная с since - только нужные партиции)"""
+        return self.journal.iter_records(since=since)
     
     def load_history(self) -> List[dict]:
         try:
-            with open(self.filename, 'r') as f:
-                return json.load(f)
+            return list(self.iter_history())
         except Exception as e:
             logger.error(f"Ошибка загрузки истории: {e}")
             return []
     
     def save_history(self, history: List[dict]):
         try:
-            with open(self.filename, 'w') as f:
-                json.dump(history, f, indent=2)
+            self.journal.rewrite(history)
         except Exception as e:
             logger.error(f"Ошибка сохранения истории: {e}")
+        self._reset_statistics()
     
-    def add_trade_record(self, record: TradeRecord):
-        """Добавляем запись о сделке"""
-        history = self.load_history()
-        history.append({
+    def close(self):
+        """Сбрасываем журнал на диск и закрываем файл"""
+        self.journal.close()
+    
+    @staticmethod
+    def record_to_dict(record: TradeRecord) -> dict:
+        """Преобразуем TradeRecord в формат хранения истории"""
+        return {
             'id': record.id,
             'user_id': record.user_id,
             'contract_address': record.contract_address,
@@ -69,109 +90,72 @@ class ReportsManager:
             'timestamp': record.timestamp,
             'date': datetime.fromtimestamp(record.timestamp).strftime('%Y-%m-%d %H:%M:%S'),
             'details': record.details
-        })
-        self.save_history(history)
+        }
+    
+    def _append_trade(self, trade: dict):
+        """Сохраняем одну запись в хранилище истории"""
+        self.journal.append(trade)
+    
+    def _append_trades(self, trades: List[dict]):
+        """Сохраняем пачку записей; журнал сбрасывается на диск один раз в конце"""
+        for trade in trades:
+            self.journal.append(trade)
+        self.journal.sync()
+    
+    def _reset_statistics(self):
+        """История переписана целиком - агрегаты будут построены заново"""
+        with self._stats_lock:
+            self._stats = None
+    
+    def add_trade_record(self, record: TradeRecord):
+        """Добавляем запись о сделке и сразу учитываем ее в статистике"""
+        trade = self.record_to_dict(record)
+        with self._stats_lock:
+            self._append_trade(trade)
+            if self._stats is not None:
+                self._stats.add(trade)
         logger.info(f"📝 Добавлена запись о сделке: {record.action} для {record.contract_address[:8]}...")
     
+    def add_trade_records(self, records: List[TradeRecord]):
+        """Добавляем пачку записей (массовое закрытие): одна запись на диск и одно обновление статистики"""
+        if not records:
+            return
+        trades = [self.record_to_dict(record) for record in records]
+        with self._stats_lock:
+            self._append_trades(trades)
+            if self._stats is not None:
+                for trade in trades:
+                    self._stats.add(trade)
+        logger.info(f"📝 Добавлено записей о сделках: {len(trades)}")
+    
     def get_user_trades(self, user_id: int, days: int = None) -> List[dict]:
         """Получаем сделки пользователя за период"""
-        history = self.load_history()
-        user_trades = [t for t in history if t['user_id'] == user_id]
-        
-        if days:
-            cutoff = datetime.now() - timedelta(days=days)
-            user_trades = [t for t in user_trades if t['timestamp'] > cutoff.timestamp()]
+        cutoff = (datetime.now() - timedelta(days=days)).timestamp() if days else None
+        user_trades = [
+            t for t in self.iter_history(since=cutoff)
+            if t['user_id'] == user_id and (cutoff is None or t['timestamp'] > cutoff)
+        ]
         
         return sorted(user_trades, key=lambda x: x['timestamp'], reverse=True)
     
+    def get_contract_trades(self, user_id: int, contract_address: str) -> List[dict]:
+        """Получаем сделки пользователя по конкретному контракту"""
+        trades = [
+            t for t in self.iter_history()
+            if t['user_id'] == user_id and t['contract_address'] == contract_address
+        ]
+        return sorted(trades, key=lambda x: x['timestamp'])
+    
+    def _statistics(self) -> TradeStatistics:
+        """Агрегаты статистики; при первом обращении строятся по всей истории одним проходом"""
+        with self._stats_lock:
+            if self._stats is None:
+                self._stats = TradeStatistics.from_records(self.iter_history())
+            return self._stats
+    
     def get_user_statistics(self, user_id: int, days: int = None) -> Dict:
-        """Статистика по пользователю"""
-        trades = self.get_user_trades(user_id, days)
-        
-        if not trades:
-            return {
-                'total_trades': 0,
-                'open_positions': 0,
-                'closed_positions': 0,
-                'total_invested': 0,
-                'total_pnl_sol': 0,
-                'total_pnl_percent': 0,
-                'win_rate': 0,
-                'best_trade': None,
-                'worst_trade': None,
-                'avg_hold_time': 0
-            }
-        
-        # Группируем сделки по контрактам
-        positions = {}
-        for trade in trades:
-            contract = trade['contract_address']
-            if contract not in positions:
-                positions[contract] = []
-            positions[contract].append(trade)
-        
-        total_invested = 0
-        total_pnl_sol = 0
-        closed_trades = []
-        open_count = 0
-        
-        for contract, contract_trades in positions.items():
-            contract_trades.sort(key=lambda x: x['timestamp'])
-            
-            # Ищем пары открытие-закрытие
-            opens = [t for t in contract_trades if t['action'] == 'open']
-            closes = [t for t in contract_trades if t['action'] in ['close', 'sl']]
-            
-            for open_trade in opens:
-                total_invested += open_trade['amount_sol']
-                
-                # Ищем соответствующее закрытие
-                close_trade = None
-                for c in closes:
-                    if c['timestamp'] > open_trade['timestamp']:
-                        close_trade = c
-                        break
-                
-                if close_trade:
-                    pnl_sol = close_trade['pnl_sol']
-                    total_pnl_sol += pnl_sol
-                    closed_trades.append({
-                        'open_time': open_trade['timestamp'],
-                        'close_time': close_trade['timestamp'],
-                        'hold_time': close_trade['timestamp'] - open_trade['timestamp'],
-                        'pnl_sol': pnl_sol,
-                        'pnl_percent': close_trade['pnl_percent'],
-                        'invested': open_trade['amount_sol'],
-                        'contract': contract
-                    })
-                else:
-                    open_count += 1
-        
-        # Рассчитываем метрики
-        win_count = len([t for t in closed_trades if t['pnl_sol'] > 0])
-        win_rate = (win_count / len(closed_trades) * 100) if closed_trades else 0
-        
-        best_trade = max(closed_trades, key=lambda x: x['pnl_percent']) if closed_trades else None
-        worst_trade = min(closed_trades, key=lambda x: x['pnl_percent']) if closed_trades else None
-        
-        avg_hold_time = sum(t['hold_time'] for t in closed_trades) / len(closed_trades) if closed_trades else 0
-        avg_hold_hours = avg_hold_time / 3600
-        
-        total_pnl_percent = (total_pnl_sol / total_invested * 100) if total_invested > 0 else 0
-        
-        return {
-            'total_trades': len(trades),
-            'open_positions': open_count,
-            'closed_positions': len(closed_trades),
-            'total_invested': total_invested,
-            'total_pnl_sol': total_pnl_sol,
-            'total_pnl_percent': total_pnl_percent,
-            'win_rate': win_rate,
-            'best_trade': best_trade,
-            'worst_trade': worst_trade,
-            'avg_hold_time_hours': avg_hold_hours,
-            'recent_trades': trades[:10]  # Последние 10 сделок
-        }
+        """Статистика по пользователю из дневных агрегатов, без перечитывания истории"""
+        return self._statistics().get_user_statistics(user_id, days)
     
     def log_position_open(self, user_id: int, position: dict):
         """Логируем открытие позиции"""
@@ -194,11 +178,21 @@ class ReportsManager:
     
     def log_position_close(self, user_id: int, contract_address: str, action: str, 
                           amount_sol: float, token_amount: float, current_price: float, 
-                          pnl_percent: float, entry_price: float = None):
-        """Логируем закрытие позиции"""
+                          pnl_percent: float, entry_price: float = None, details: dict = None):
+        """Логируем закрытие позиции (details - данные исполнения, например подпись и размер пачки)"""
+        self.add_trade_record(self.build_close_record(
+            user_id, contract_address, action, amount_sol, token_amount,
+            current_price, pnl_percent, entry_price, details
+        ))
+    
+    @staticmethod
+    def build_close_record(user_id: int, contract_address: str, action: str,
+                           amount_sol: float, token_amount: float, current_price: float,
+                           pnl_percent: float, entry_price: float = None, details: dict = None) -> TradeRecord:
+        """Запись о закрытии позиции без сохранения - для пакетной записи через add_trade_records"""
         pnl_sol = amount_sol * (pnl_percent / 100) if entry_price else 0
         
-        record = TradeRecord(
+        return TradeRecord(
             id=f"{contract_address}_{action}_{int(datetime.now().timestamp())}",
             user_id=user_id,
             contract_address=contract_address,
@@ -208,9 +202,8 @@ class ReportsManager:
             price=current_price,
             pnl_percent=pnl_percent,
             pnl_sol=pnl_sol,
-            details={'entry_price': entry_price}
+            details=dict(details or {}, entry_price=entry_price)
         )
-        self.add_trade_record(record)
     
     def format_trade_summary(self, user_id: int, days: int = 7) -> str:
         """Форматируем краткий отчет"""
@@ -239,4 +232,93 @@ class ReportsManager:
         if stats['avg_hold_time_hours'] > 0:
             text += f"⏱️ Ср. время: {stats['avg_hold_time_hours']:.1f}ч"
         
-        return text
\ No newline at end of file
+        return text
+
+    def format_trade_summaries(self, user_ids: List[int], days: int = 7) -> Dict[int, str]:
+        """Краткие отчеты для группы пользователей: агрегаты строятся один раз на всех"""
+        self._statistics()
+        return {user_id: self.format_trade_summary(user_id, days) for user_id in user_ids}
+
+class SQLiteReportsManager(ReportsManager):
+    """История сделок в SQLite с индексами по (user_id, timestamp) и (user_id, contract_address)"""
+
+    def __init__(self, db_path: str = 'axiom.db', history_file: str = 'trade_history.jsonl',
+                 history_dir: str = 'trade_history'):
+        self.db = get_database(db_path)
+        self.filename = db_path
+        self._stats = None
+        self._stats_lock = threading.RLock()
+        if self.db.get_meta('trades_migrated') is None:
+            migrate_trades(self.db, history_file, history_dir=history_dir)
+
+    def ensure_file_exists(self):
+        pass
+
+    def iter_history(self, since: float = None) -> Iterator[dict]:
+        if since is None:
+            rows = self.db.execute('SELECT data FROM trades ORDER BY seq')
+        else:
+            rows = self.db.execute('SELECT data FROM trades WHERE timestamp >= ? ORDER BY seq', (since,))
+        for row in rows:
+            yield json.loads(row['data'])
+
+    def close(self):
+        pass
+
+    def save_history(self, history: List[dict]):
+        try:
+            self.db.executemany(
+                'INSERT INTO trades (id, user_id, contract_address, action, timestamp, data) VALUES (?, ?, ?, ?, ?, ?)',
+                [trade_to_row(t) for t in history], clear_table='trades'
+            )
+        except Exception as e:
+            logger.error(f"Ошибка сохранения истории: {e}")
+        self._reset_statistics()
+
+    def _append_trade(self, trade: dict):
+        self.db.execute(
+            'INSERT INTO trades (id, user_id, contract_address, action, timestamp, data) VALUES (?, ?, ?, ?, ?, ?)',
+            trade_to_row(trade)
+        )
+
+    def _append_trades(self, trades: List[dict]):
+        self.db.executemany(
+            'INSERT INTO trades (id, user_id, contract_address, action, timestamp, data) VALUES (?, ?, ?, ?, ?, ?)',
+            [trade_to_row(t) for t in trades]
+        )
+
+    def get_user_trades(self, user_id: int, days: int = None) -> List[dict]:
+        """Получаем сделки пользователя за период (по индексу user_id, timestamp)"""
+        if days:
+            cutoff = (datetime.now() - timedelta(days=days)).timestamp()
+            rows = self.db.execute(
+                'SELECT data FROM trades WHERE user_id = ? AND timestamp > ? ORDER BY timestamp DESC',
+                (user_id, cutoff)
+            )
+        else:
+            rows = self.db.execute(
+                'SELECT data FROM trades WHERE user_id = ? ORDER BY timestamp DESC', (user_id,)
+            )
+        return [json.loads(row['data']) for row in rows]
+
+    def get_contract_trades(self, user_id: int, contract_address: str) -> List[dict]:
+        """Получаем сделки пользователя по контракту (по индексу user_id, contract_address)"""
+        rows = self.db.execute(
+            'SELECT data FROM trades WHERE user_id = ? AND contract_address = ? ORDER BY timestamp',
+            (user_id, contract_address)
+        )
+        return [json.loads(row['data']) for row in rows]
+
+def create_reports_manager() -> ReportsManager:
+    """Создаем менеджер отчетов согласно STORAGE_BACKEND"""
+    if STORAGE_BACKEND == 'sqlite':
+        return SQLiteReportsManager(SQLITE_DB_PATH, history_dir=TRADE_HISTORY_DIR)
+    return ReportsManager(
+        TRADE_HISTORY_DIR,
+        fsync_batch_size=TRADE_JOURNAL_FSYNC_BATCH,
+        fsync_interval=TRADE_JOURNAL_FSYNC_INTERVAL,
+        compact_after_months=TRADE_HISTORY_COMPACT_AFTER_MONTHS
+    )
+
+# Глобальный экземпляр для использования в других модулях
+reports_manager = create_reports_manager()
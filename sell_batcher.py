@@ -0,0 +1,108 @@
+import logging
+import threading
+from typing import Callable, Dict, List, Tuple
+
+from metrics import sell_batch_size
+
+logger = logging.getLogger(__name__)
+
+# Числовые поля результата свопа с этими подстроками - цены, проценты, время: они не делятся между участниками
+NON_ADDITIVE_MARKERS = ('price', 'slippage', 'percent', 'impact', 'slot', 'decimals', 'time')
+
+def is_split_amount(key: str, value) -> bool:
+    """Поле результата - объем всего свопа (полученные SOL, комиссии и т.п.), который делится по долям"""
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return False
+    return not any(marker in key.lower() for marker in NON_ADDITIVE_MARKERS)
+
+class _SellBatch:
+    """Намерения продать один контракт, собранные за окно батчинга"""
+
+    def __init__(self):
+        self.amounts: List[float] = []
+        self.priority: int = None  # Самый срочный приоритет среди участников (меньше - раньше)
+        self.full = threading.Event()  # Набран max_batch - отправляем, не дожидаясь конца окна
+        self.done = threading.Event()
+        self.result: Dict = None
+        self.error: Exception = None
+
+class SellBatcher:
+    """
+    Объединяет продажи одного контракта (с одинаковым слиппеджем), пришедшие в течение window секунд,
+    в один своп: SL/TP нескольких позиций по одной цене платят одну комиссию и одно подтверждение.
+    Первый поток-участник ждет окно и отправляет суммарный объем, остальные ждут результата;
+    каждому возвращается общий результат с его долей. Вызывается из рабочих потоков AxiomClient
+    до очереди исполнения: ожидание окна не занимает ее слотов, а пачка - одна операция в очереди.
+    """
+
+    def __init__(self, execute: Callable[[str, float, float, int], Dict], window: float = 0.25, max_batch: int = 20):
+        self.execute = execute  # (контракт, количество токенов, слиппедж, приоритет) -> результат SDK
+        self.window = window
+        self.max_batch = max_batch
+        self._open: Dict[Tuple[str, float], _SellBatch] = {}
+        self._lock = threading.Lock()
+
+    def sell(self, contract_address: str, amount_tokens: float, slippage_percent: float, priority: int = 0) -> Dict:
+        if self.window <= 0:
+            return self._allocate(
+                self.execute(contract_address, amount_tokens, slippage_percent, priority), [amount_tokens], 0
+            )
+
+        key = (contract_address, slippage_percent)
+        with self._lock:
+            batch = self._open.get(key)
+            leader = batch is None
+            if leader:
+                batch = self._open[key] = _SellBatch()
+            index = len(batch.amounts)
+            batch.amounts.append(amount_tokens)
+            if batch.priority is None or priority < batch.priority:
+                batch.priority = priority
+            if len(batch.amounts) >= self.max_batch:
+                del self._open[key]  # Следующие продажи соберутся в новую пачку
+                batch.full.set()
+
+        if leader:
+            self._submit(key, batch)
+        else:
+            batch.done.wait()
+
+        if batch.error is not None:
+            raise batch.error
+        return self._allocate(batch.result, batch.amounts, index)
+
+    def _submit(self, key: Tuple[str, float], batch: _SellBatch):
+        batch.full.wait(self.window)
+        with self._lock:
+            if self._open.get(key) is batch:
+                del self._open[key]
+            amounts = list(batch.amounts)
+            priority = batch.priority
+
+        contract_address, slippage_percent = key
+        sell_batch_size.observe(len(amounts))
+        if len(amounts) > 1:
+            logger.info(f"📦 Объединяем {len(amounts)} продаж {contract_address[:8]}... в один своп")
+        try:
+            batch.result = self.execute(contract_address, sum(amounts), slippage_percent, priority)
+        except Exception as e:
+            batch.error = e
+        finally:
+            batch.done.set()
+
+    @staticmethod
+    def _allocate(result: Dict, amounts: List[float], index: int) -> Dict:
+        """
+        Доля участника в общем свопе: его количество токенов, а объемные поля результата
+        (полученные SOL, комиссии) - пропорционально доле в суммарном объеме
+        """
+        total = sum(amounts)
+        share = amounts[index] / total if total > 0 else 1.0 / len(amounts)
+        allocated = {
+            key: value * share if is_split_amount(key, value) else value
+            for key, value in (result or {}).items()
+        }
+        allocated['amount_tokens'] = amounts[index]
+        allocated['batch_size'] = len(amounts)
+        allocated['batch_share'] = share
+        return allocated
@@ -0,0 +1,241 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from metrics import storage_flush_seconds
+from trade_journal import PartitionedTradeJournal
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS positions (
+    user_id TEXT NOT NULL,
+    id TEXT NOT NULL,
+    contract_address TEXT NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (user_id, id)
+);
+CREATE INDEX IF NOT EXISTS idx_positions_user_contract ON positions (user_id, contract_address);
+
+CREATE TABLE IF NOT EXISTS trades (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    id TEXT NOT NULL,
+    user_id INTEGER NOT NULL,
+    contract_address TEXT NOT NULL,
+    action TEXT NOT NULL,
+    timestamp REAL NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_trades_user_timestamp ON trades (user_id, timestamp);
+CREATE INDEX IF NOT EXISTS idx_trades_user_contract ON trades (user_id, contract_address);
+
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+class SQLiteDatabase:
+    """Общее подключение к SQLite (WAL) для позиций и истории сделок"""
+
+    def __init__(self, db_path: str = 'axiom.db'):
+        self.db_path = db_path
+        self.lock = threading.RLock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.executescript(SCHEMA)
+
+    def execute(self, sql: str, params=()) -> List[sqlite3.Row]:
+        with self.lock:
+            return self.conn.execute(sql, params).fetchall()
+
+    def executemany(self, sql: str, rows, clear_table: str = None):
+        """Пакетная вставка в одной транзакции (опционально с предварительной очисткой таблицы)"""
+        with self.lock:
+            self.conn.execute('BEGIN')
+            try:
+                if clear_table:
+                    self.conn.execute(f'DELETE FROM {clear_table}')
+                self.conn.executemany(sql, rows)
+                self.conn.execute('COMMIT')
+            except Exception:
+                self.conn.execute('ROLLBACK')
+                raise
+
+    def get_meta(self, key: str) -> Optional[str]:
+        rows = self.execute('SELECT value FROM meta WHERE key = ?', (key,))
+        return rows[0]['value'] if rows else None
+
+    def set_meta(self, key: str, value: str):
+        self.execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', (key, value))
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+_databases: Dict[str, SQLiteDatabase] = {}
+
+def get_database(db_path: str) -> SQLiteDatabase:
+    """Одно подключение на файл базы для всех хранилищ процесса"""
+    db_path = os.path.abspath(db_path)
+    if db_path not in _databases:
+        _databases[db_path] = SQLiteDatabase(db_path)
+    return _databases[db_path]
+
+def trade_to_row(trade: dict) -> tuple:
+    """Строка таблицы trades из записи истории"""
+    return (
+        trade['id'], trade['user_id'], trade['contract_address'],
+        trade['action'], trade['timestamp'], json.dumps(trade)
+    )
+
+class SQLitePositionStorage:
+    """Хранилище позиций в SQLite с тем же интерфейсом, что и PositionStorage"""
+
+    def __init__(self, db_path: str = 'axiom.db', positions_file: str = 'positions.json'):
+        self.db = get_database(db_path)
+        self.filename = db_path
+        self.version = 0  # Растет при добавлении/удалении позиций
+        if self.db.get_meta('positions_migrated') is None:
+            migrate_positions(self.db, positions_file)
+
+    @staticmethod
+    def _row_to_position(row: sqlite3.Row) -> Dict:
+        return json.loads(row['data'])
+
+    def load_positions(self) -> Dict:
+        positions = {}
+        for row in self.db.execute('SELECT user_id, data FROM positions ORDER BY rowid'):
+            positions.setdefault(row['user_id'], []).append(self._row_to_position(row))
+        return positions
+
+    def save_positions(self, positions: Dict):
+        rows = [
+            (user_id, position['id'], position['contract_address'], json.dumps(position))
+            for user_id, user_positions in positions.items()
+            for position in user_positions
+        ]
+        with storage_flush_seconds.time(backend='sqlite'):
+            self.db.executemany(
+                'INSERT INTO positions (user_id, id, contract_address, data) VALUES (?, ?, ?, ?)',
+                rows, clear_table='positions'
+            )
+        self.version += 1
+
+    def add_position(self, user_id: int, position_data: Dict):
+        self.db.execute(
+            'INSERT OR REPLACE INTO positions (user_id, id, contract_address, data) VALUES (?, ?, ?, ?)',
+            (str(user_id), position_data['id'], position_data['contract_address'], json.dumps(position_data))
+        )
+        self.version += 1
+
+    def remove_position(self, user_id: int, position_id: str):
+        self.db.execute('DELETE FROM positions WHERE user_id = ? AND id = ?', (str(user_id), position_id))
+        self.version += 1
+
+    def get_positions(self, user_id: int) -> List[Dict]:
+        rows = self.db.execute('SELECT data FROM positions WHERE user_id = ? ORDER BY rowid', (str(user_id),))
+        return [self._row_to_position(row) for row in rows]
+
+    def get_position(self, user_id: int, position_id: str) -> Optional[Dict]:
+        rows = self.db.execute('SELECT data FROM positions WHERE user_id = ? AND id = ?', (str(user_id), position_id))
+        return self._row_to_position(rows[0]) if rows else None
+
+    def find_position(self, user_id: int, contract_address: str) -> Optional[Dict]:
+        rows = self.db.execute(
+            'SELECT data FROM positions WHERE user_id = ? AND contract_address = ? ORDER BY rowid LIMIT 1',
+            (str(user_id), contract_address)
+        )
+        return self._row_to_position(rows[0]) if rows else None
+
+    def update_position(self, user_id: int, position_id: str, updates: Dict):
+        with self.db.lock:
+            position = self.get_position(user_id, position_id)
+            if position is None:
+                return
+            position.update(updates)
+            with storage_flush_seconds.time(backend='sqlite'):
+                self.db.execute(
+                    'UPDATE positions SET data = ? WHERE user_id = ? AND id = ?',
+                    (json.dumps(position), str(user_id), position_id)
+                )
+
+    def flush(self) -> bool:
+        """Каждое изменение уже зафиксировано в базе"""
+        return False
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+def migrate_positions(db: SQLiteDatabase, positions_file: str = 'positions.json') -> int:
+    """Однократно переносим позиции из JSON файла в SQLite"""
+    count = 0
+    if os.path.exists(positions_file):
+        with open(positions_file, 'r') as f:
+            data = json.load(f)
+        rows = [
+            (user_id, position['id'], position['contract_address'], json.dumps(position))
+            for user_id, positions in data.items()
+            for position in positions
+        ]
+        db.executemany(
+            'INSERT OR REPLACE INTO positions (user_id, id, contract_address, data) VALUES (?, ?, ?, ?)', rows
+        )
+        count = len(rows)
+    db.set_meta('positions_migrated', datetime.now().isoformat())
+    logger.info(f"🗄️ Перенесено позиций в SQLite: {count}")
+    return count
+
+def _read_history_file(history_file: str) -> List[dict]:
+    """Читаем историю из журнала JSON Lines или из старого JSON списка"""
+    with open(history_file, 'r', encoding='utf-8') as f:
+        if history_file.endswith('.jsonl'):
+            return [json.loads(line) for line in f if line.strip()]
+        return json.load(f)
+
+def migrate_trades(db: SQLiteDatabase, history_file: str = 'trade_history.jsonl',
+                   legacy_file: str = 'trade_history.json', history_dir: str = 'trade_history') -> int:
+    """Однократно переносим историю сделок (помесячные партиции, журнал или старый JSON файл) в SQLite"""
+    count = 0
+    source = history_file if os.path.exists(history_file) else legacy_file
+    history = None
+    if history_dir and os.path.exists(os.path.join(history_dir, PartitionedTradeJournal.MANIFEST)):
+        history = list(PartitionedTradeJournal(history_dir).iter_records())
+    elif source and os.path.exists(source):
+        history = _read_history_file(source)
+    if history is not None:
+        db.executemany(
+            'INSERT INTO trades (id, user_id, contract_address, action, timestamp, data) VALUES (?, ?, ?, ?, ?, ?)',
+            [trade_to_row(t) for t in history]
+        )
+        count = len(history)
+    db.set_meta('trades_migrated', datetime.now().isoformat())
+    logger.info(f"🗄️ Перенесено сделок в SQLite: {count}")
+    return count
+
+def migrate_json_to_sqlite(db_path: str = 'axiom.db', positions_file: str = 'positions.json',
+                           history_file: str = 'trade_history.jsonl',
+                           history_dir: str = 'trade_history') -> Dict[str, int]:
+    """Однократная миграция JSON файлов в SQLite. Повторный запуск ничего не делает"""
+    db = get_database(db_path)
+    result = {'positions': 0, 'trades': 0}
+    if db.get_meta('positions_migrated') is None:
+        result['positions'] = migrate_positions(db, positions_file)
+    if db.get_meta('trades_migrated') is None:
+        result['trades'] = migrate_trades(db, history_file, history_dir=history_dir)
+    return result
+
+if __name__ == "__main__":
+    import sys
+    logging.basicConfig(level=logging.INFO)
+    target = sys.argv[1] if len(sys.argv) > 1 else 'axiom.db'
+    print(migrate_json_to_sqlite(target))
@@ -1,48 +1,253 @@
+import asyncio
 import json
+import logging
 import os
+import tempfile
+import threading
+import time
 from typing import Dict, List, Optional
 
+from config import POSITIONS_FLUSH_INTERVAL, STORAGE_BACKEND, SQLITE_DB_PATH
+from metrics import storage_flush_seconds
+
+logger = logging.getLogger(__name__)
+
 class PositionStorage:
-    def __init__(self, filename: str = 'positions.json'):
+    """
+    Хранилище позиций в памяти с отложенной записью на диск.
+    Позиции индексированы по user_id и id позиции, чтение - поиск в словаре.
+    Изменения помечаются как "грязные" и сбрасываются в файл одной атомарной
+    записью (временный файл + rename) раз в flush_interval секунд и при остановке.
+    Открытие и закрытие позиции сразу дописываются одной строкой в журнал (filename + '.wal'):
+    сделка не ждет перезаписи всех позиций, а после сбоя журнал накатывается на снимок.
+    """
+
+    def __init__(self, filename: str = 'positions.json', flush_interval: float = 5.0):
         self.filename = filename
+        self.flush_interval = flush_interval
+        self._positions: Dict[str, Dict[str, Dict]] = {}  # user_id -> {position_id -> позиция}
+        self._dirty_entries = set()  # (user_id, position_id) измененных позиций
+        self._dirty = False
+        self._flush_task = None
+        self.version = 0  # Растет при добавлении/удалении позиций
+        self._lock = threading.RLock()  # Позиции меняются и из пула потоков AsyncAxiomClient
+        self._flush_lock = threading.Lock()  # Записи на диск идут строго по очереди
+        self.wal_filename = filename + '.wal'
+        self._wal = None  # Журнал открытий/закрытий с последнего снимка (пишется под _lock)
         self.ensure_file_exists()
-    
+        self._load_from_disk()
+
     def ensure_file_exists(self):
         if not os.path.exists(self.filename):
             with open(self.filename, 'w') as f:
                 json.dump({}, f)
-    
-    def load_positions(self) -> Dict:
+
+    def _load_from_disk(self):
         with open(self.filename, 'r') as f:
-            return json.load(f)
-    
+            data = json.load(f)
+        self._positions = {
+            user_id: {position['id']: position for position in positions}
+            for user_id, positions in data.items()
+        }
+        self._dirty_entries.clear()
+        self._dirty = False
+        self._replay_wal()
+
+    def _replay_wal(self):
+        """Накатываем на снимок открытия и закрытия, записанные после него"""
+        if not os.path.exists(self.wal_filename):
+            return
+        replayed, valid_bytes = 0, 0
+        with open(self.wal_filename, 'rb') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break  # Недописанная при сбое строка - последняя в журнале
+                valid_bytes += len(line)
+                user_positions = self._positions.setdefault(record['user_id'], {})
+                if record['op'] == 'add':
+                    # Запись могла уже попасть в снимок вместе с последующими изменениями
+                    user_positions.setdefault(record['position']['id'], record['position'])
+                else:
+                    user_positions.pop(record['position_id'], None)
+                replayed += 1
+        # Отрезаем недописанный хвост и продолжаем журнал: накатанное уйдет при следующем снимке
+        self._wal = open(self.wal_filename, 'r+b')
+        self._wal.truncate(valid_bytes)
+        self._wal.seek(valid_bytes)
+        if replayed:
+            self._dirty = True
+            logger.info(f"💾 Из журнала позиций восстановлено {replayed} операций")
+
+    def _append_wal(self, record: Dict):
+        """Дописываем операцию в журнал и синхронизируем с диском (вызывается под _lock)"""
+        if self._wal is None:
+            self._wal = open(self.wal_filename, 'ab')
+        self._wal.write(json.dumps(record).encode() + b'\n')
+        self._wal.flush()
+        os.fsync(self._wal.fileno())
+
+    def _compact_wal(self, offset: int):
+        """Операции до offset уже в снимке - оставляем в журнале только более поздние"""
+        if self._wal is None:
+            return
+        self._wal.close()
+        self._wal = None
+        with open(self.wal_filename, 'rb') as f:
+            f.seek(offset)
+            rest = f.read()
+        if not rest:
+            os.remove(self.wal_filename)
+            return
+        tmp_path = self.wal_filename + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(rest)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.wal_filename)
+
+    def _mark_dirty(self, user_id: Optional[str], position_id: Optional[str] = None):
+        self._dirty = True
+        if position_id is not None:
+            self._dirty_entries.add((user_id, position_id))
+
+    def load_positions(self) -> Dict:
+        """Снимок всех позиций в формате файла: {user_id: [позиции]}"""
+        with self._lock:
+            return {
+                user_id: [dict(position) for position in positions.values()]
+                for user_id, positions in self._positions.items()
+            }
+
     def save_positions(self, positions: Dict):
-        with open(self.filename, 'w') as f:
-            json.dump(positions, f, indent=2)
-    
+        with self._lock:
+            self._positions = {
+                user_id: {position['id']: dict(position) for position in user_positions}
+                for user_id, user_positions in positions.items()
+            }
+            self._mark_dirty(None)
+            self.version += 1
+        self.flush()
+
     def add_position(self, user_id: int, position_data: Dict):
-        positions = self.load_positions()
-        if str(user_id) not in positions:
-            positions[str(user_id)] = []
-        positions[str(user_id)].append(position_data)
-        self.save_positions(positions)
-    
+        with self._lock:
+            user_key = str(user_id)
+            self._positions.setdefault(user_key, {})[position_data['id']] = dict(position_data)
+            self._mark_dirty(user_key, position_data['id'])
+            self.version += 1
+            # Открытие позиции сразу фиксируем в журнале, чтобы не потерять купленные токены при сбое
+            self._append_wal({'op': 'add', 'user_id': user_key, 'position': position_data})
+
     def remove_position(self, user_id: int, position_id: str):
-        positions = self.load_positions()
-        if str(user_id) in positions:
-            user_positions = positions[str(user_id)]
-            positions[str(user_id)] = [p for p in user_positions if p['id'] != position_id]
-            self.save_positions(positions)
-    
+        with self._lock:
+            user_key = str(user_id)
+            user_positions = self._positions.get(user_key)
+            removed = user_positions is not None and user_positions.pop(position_id, None) is not None
+            if removed:
+                self._dirty_entries.discard((user_key, position_id))
+                self._mark_dirty(user_key)
+                self.version += 1
+                self._append_wal({'op': 'remove', 'user_id': user_key, 'position_id': position_id})
+
     def get_positions(self, user_id: int) -> List[Dict]:
-        positions = self.load_positions()
-        return positions.get(str(user_id), [])
-    
+        with self._lock:
+            user_positions = self._positions.get(str(user_id), {})
+            return [dict(position) for position in user_positions.values()]
+
+    def get_position(self, user_id: int, position_id: str) -> Optional[Dict]:
+        with self._lock:
+            position = self._positions.get(str(user_id), {}).get(position_id)
+            return dict(position) if position is not None else None
+
+    def find_position(self, user_id: int, contract_address: str) -> Optional[Dict]:
+        """Первая позиция пользователя по адресу контракта"""
+        with self._lock:
+            for position in self._positions.get(str(user_id), {}).values():
+                if position['contract_address'] == contract_address:
+                    return dict(position)
+            return None
+
     def update_position(self, user_id: int, position_id: str, updates: Dict):
-        positions = self.load_positions()
-        if str(user_id) in positions:
-            for i, position in enumerate(positions[str(user_id)]):
-                if position['id'] == position_id:
-                    positions[str(user_id)][i].update(updates)
-                    break
-            self.save_positions(positions)
\ No newline at end of file
+        with self._lock:
+            user_key = str(user_id)
+            position = self._positions.get(user_key, {}).get(position_id)
+            if position is not None:
+                position.update(updates)
+                self._mark_dirty(user_key, position_id)
+
+    def flush(self) -> bool:
+        """Атомарно записываем все позиции на диск, если есть несохраненные изменения"""
+        with self._flush_lock:
+            return self._flush_locked()
+
+    def _flush_locked(self) -> bool:
+        with self._lock:
+            if not self._dirty:
+                return False
+            # Снимок берем под блокировкой, запись на диск - уже без нее
+            snapshot = self.load_positions()
+            wal_offset = self._wal.tell() if self._wal is not None else 0
+            dirty_count = len(self._dirty_entries)
+            self._dirty_entries.clear()
+            self._dirty = False
+
+        started = time.perf_counter()
+        directory = os.path.dirname(os.path.abspath(self.filename))
+        fd, tmp_path = tempfile.mkstemp(prefix='.positions_', suffix='.tmp', dir=directory)
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(snapshot, f, indent=2)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.filename)
+            with self._lock:
+                self._compact_wal(wal_offset)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            with self._lock:
+                self._dirty = True
+            raise
+
+        elapsed = time.perf_counter() - started
+        storage_flush_seconds.observe(elapsed, backend='json')
+        logger.debug(f"💾 Позиции сохранены ({dirty_count} изменений) за {elapsed * 1000:.1f} мс")
+        return True
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                # Сериализация всех позиций не должна останавливать event loop
+                await asyncio.to_thread(self.flush)
+            except Exception as e:
+                logger.error(f"Ошибка сохранения позиций: {e}")
+
+    async def start(self):
+        """Запускаем периодический сброс изменений на диск"""
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_loop())
+            logger.info(f"💾 Отложенная запись позиций запущена (интервал: {self.flush_interval}с)")
+
+    async def stop(self):
+        """Останавливаем периодический сброс и сохраняем оставшиеся изменения"""
+        if self._flush_task:
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+            self._flush_task = None
+        await asyncio.to_thread(self.flush)
+        logger.info("💾 Позиции сохранены на диск")
+
+def create_position_storage():
+    """Создаем хранилище позиций согласно STORAGE_BACKEND"""
+    if STORAGE_BACKEND == 'sqlite':
+        from sqlite_storage import SQLitePositionStorage
+        return SQLitePositionStorage(SQLITE_DB_PATH)
+    return PositionStorage(flush_interval=POSITIONS_FLUSH_INTERVAL)
+
+# Глобальный экземпляр: все модули должны работать с одним хранилищем в памяти
+position_storage = create_position_storage()
@@ -0,0 +1,28 @@
+import logging
+from typing import Optional
+
+from aiogram import Bot
+
+from config import BOT_TOKEN
+
+logger = logging.getLogger(__name__)
+
+# Единственный экземпляр бота процесса: его HTTP сессию к Telegram используют
+# и обработчики команд (bot.py), и отправка уведомлений (notifications.py)
+_bot: Optional[Bot] = None
+
+def get_bot() -> Bot:
+    """Возвращаем общий Bot, создавая его при первом обращении"""
+    global _bot
+    if _bot is None:
+        _bot = Bot(token=BOT_TOKEN)
+        logger.info("🤖 Telegram Bot создан")
+    return _bot
+
+async def close_bot():
+    """Закрываем HTTP сессию бота при остановке"""
+    global _bot
+    if _bot is not None:
+        await _bot.session.close()
+        logger.info("🤖 Сессия Telegram закрыта")
+    _bot = None
@@ -0,0 +1,73 @@
+import os
+import tempfile
+import unittest
+
+# config.py требует переменные окружения бота уже при импорте
+os.environ.setdefault('BOT_TOKEN', '1:test')
+os.environ.setdefault('ALLOWED_USER_IDS', '1')
+os.environ.setdefault('WALLET_ADDRESS', 'wallet')
+os.environ.setdefault('PRIVATE_KEY', 'key')
+
+from storage import PositionStorage
+from token_ledger import TokenLedger
+
+MINT = 'MINT'
+
+class FakeBalances:
+    def __init__(self, balances):
+        self.balances = balances
+
+    def get_balance(self, contract_address, max_age=None):
+        return self.balances.get(contract_address, 0.0)
+
+class TokenLedgerTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.storage = PositionStorage(os.path.join(self.tmp.name, 'positions.json'))
+        self.balances = FakeBalances({MINT: 1000.0})
+        self.ledger = TokenLedger(self.storage, self.balances, reconcile_interval=0, settle_time=0)
+
+    def tearDown(self):
+        self.storage.flush()
+        self.tmp.cleanup()
+
+    def add(self, user_id, position_id, token_amount=0.0, invested_sol=1.0, fill_pending=False):
+        self.storage.add_position(user_id, {
+            'id': position_id, 'contract_address': MINT, 'token_amount': token_amount,
+            'invested_sol': invested_sol, 'fill_pending': fill_pending
+        })
+        return self.storage.get_position(user_id, position_id)
+
+    def test_partial_take_profit_on_pending_fill(self):
+        position = self.add(1, 'p1', fill_pending=True)
+        available = self.ledger.available(1, position)
+        self.assertAlmostEqual(available, 1000.0)
+
+        # TP 25%: close_position продает долю available и списывает ее через record_sell
+        remaining = self.ledger.record_sell(1, 'p1', available * 0.25, available)
+        self.assertAlmostEqual(remaining, 750.0)
+        self.assertAlmostEqual(self.ledger.quantity(1, 'p1'), 750.0)
+        self.assertFalse(self.storage.get_position(1, 'p1')['fill_pending'])
+
+        # После продажи в кошельке 750 - сверка не меняет подтвержденный остаток
+        self.balances.balances[MINT] = 750.0
+        self.ledger.reconcile(self.balances.balances)
+        self.assertAlmostEqual(self.ledger.quantity(1, 'p1'), 750.0)
+
+    def test_pending_share_excludes_other_holders(self):
+        self.add(1, 'confirmed', token_amount=200.0)
+        pending = self.add(2, 'small', invested_sol=1.0, fill_pending=True)
+        self.add(2, 'large', invested_sol=3.0, fill_pending=True)
+        self.assertAlmostEqual(self.ledger.available(2, pending), 200.0)
+
+    def test_reconcile_splits_pending_by_invested_sol(self):
+        self.add(1, 'confirmed', token_amount=200.0)
+        self.add(2, 'small', invested_sol=1.0, fill_pending=True)
+        self.add(2, 'large', invested_sol=3.0, fill_pending=True)
+        self.ledger.reconcile(self.balances.balances)
+        self.assertAlmostEqual(self.ledger.quantity(2, 'small'), 200.0)
+        self.assertAlmostEqual(self.ledger.quantity(2, 'large'), 600.0)
+        self.assertAlmostEqual(self.ledger.quantity(1, 'confirmed'), 200.0)
+
+if __name__ == '__main__':
+    unittest.main()
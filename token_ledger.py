@@ -0,0 +1,240 @@
+import asyncio
+import logging
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from typing import Dict, List, Optional, Tuple
+
+from config import LEDGER_RECONCILE_INTERVAL, LEDGER_SETTLE_TIME, LEDGER_TOLERANCE
+from storage import position_storage
+from wallet_balances import wallet_balances
+
+logger = logging.getLogger(__name__)
+
+DUST = 1e-9  # Остаток, который считаем нулем
+
+class TokenLedger:
+    """
+    Учет токенов по позициям общего кошелька. Количество позиции (token_amount в хранилище)
+    ведется по подтвержденным сделкам: покупка - прирост баланса кошелька, продажа - проданный объем.
+    Частичные продажи и TP считаются по учету без RPC, а периодическая сверка
+    со снимком балансов исправляет расхождения с цепочкой.
+    """
+
+    def __init__(self, storage, balances, reconcile_interval: float = 300,
+                 settle_time: float = 30, tolerance: float = 0.01):
+        self.storage = storage
+        self.balances = balances
+        self.reconcile_interval = reconcile_interval
+        self.settle_time = settle_time  # Сколько ждать после сделки, прежде чем сверять контракт
+        self.tolerance = tolerance  # Относительное расхождение, которое не исправляем
+        self._lock = threading.RLock()
+        self._in_flight: Dict[str, int] = {}  # контракт -> сделок в процессе
+        self._last_trade: Dict[str, float] = {}  # контракт -> time.monotonic() последней сделки
+        self._suspect: Dict[str, int] = {}  # контракт -> знак расхождения на прошлой сверке
+        self._buy_locks: Dict[str, threading.Lock] = {}  # контракт -> покупка с подтверждением (потоки)
+        self._async_buy_locks: Dict[str, asyncio.Lock] = {}  # то же для покупок из event loop
+        self._close_locks: Dict[Tuple[int, str], threading.Lock] = {}  # (пользователь, контракт) -> продажа
+        self._task: Optional[asyncio.Task] = None
+
+    @staticmethod
+    def filled_amount(pre_balance: float, post_balance: Optional[float]) -> Tuple[float, bool]:
+        """Количество купленных токенов по изменению баланса: (количество, ждет ли сверки)"""
+        filled = post_balance - pre_balance if post_balance is not None else 0.0
+        if filled > DUST:
+            return filled, False
+        # Покупка не подтвердилась вовремя - количество позиции назначит сверка
+        return 0.0, True
+
+    @contextmanager
+    def trading(self, contract_address: str):
+        """Сделка по контракту в процессе: сверка не трогает его до settle_time после завершения"""
+        with self._lock:
+            self._in_flight[contract_address] = self._in_flight.get(contract_address, 0) + 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._in_flight[contract_address] -= 1
+                if not self._in_flight[contract_address]:
+                    del self._in_flight[contract_address]
+                self._last_trade[contract_address] = time.monotonic()
+
+    @contextmanager
+    def buying(self, contract_address: str):
+        """
+        Покупка контракта вместе с ожиданием подтверждения. Количество покупки - прирост баланса,
+        поэтому покупки одного контракта идут по одной: иначе каждая засчитает себе и чужой прирост
+        """
+        with self._lock:
+            lock = self._buy_locks.setdefault(contract_address, threading.Lock())
+        with lock, self.trading(contract_address):
+            yield
+
+    @asynccontextmanager
+    async def buying_async(self, contract_address: str):
+        """Асинхронная версия buying: ожидание очереди покупок не блокирует event loop"""
+        lock = self._async_buy_locks.setdefault(contract_address, asyncio.Lock())
+        async with lock:
+            with self.trading(contract_address):
+                yield
+
+    @contextmanager
+    def closing(self, user_id: int, contract_address: str):
+        """
+        Продажа из позиций пользователя по контракту: от чтения позиции до списания проданного.
+        Триггеры монитора, ручное и массовое закрытие иначе продали бы одну позицию дважды
+        """
+        with self._lock:
+            lock = self._close_locks.setdefault((user_id, contract_address), threading.Lock())
+        with lock:
+            yield
+
+    def quantity(self, user_id: int, position_id: str) -> Optional[float]:
+        """Токенов в позиции по учету; None - позиции больше нет"""
+        position = self.storage.get_position(user_id, position_id)
+        return position.get('token_amount', 0) if position is not None else None
+
+    def available(self, user_id: int, position: Dict) -> float:
+        """
+        Сколько токенов позиции можно продать. Для покупки, еще не подтвержденной сверкой,
+        берем ее долю нераспределенного остатка кошелька по контракту (единственный случай с RPC).
+        """
+        if not position.get('fill_pending'):
+            return position.get('token_amount', 0)
+
+        contract_address = position['contract_address']
+        with self._lock:
+            holders = self._holders(self.storage.load_positions()).get(contract_address, [])
+        pending = [p for p in holders if p.get('fill_pending')]
+        if not any(p['id'] == position['id'] for p in pending):
+            pending.append(dict(position, user_id=user_id))
+        assigned = sum(p.get('token_amount', 0) for p in holders if not p.get('fill_pending'))
+        unassigned = max(self.balances.get_balance(contract_address) - assigned, 0.0)
+        return unassigned * self._pending_weights(pending)[position['id']]
+
+    def record_sell(self, user_id: int, position_id: str, amount: float, available: float) -> Optional[float]:
+        """
+        Списываем проданные токены с позиции; возвращаем остаток (None - позиции нет).
+        available - сколько позиции принадлежало перед продажей (результат available()):
+        у неподтвержденной покупки в учете еще 0, остаток считаем от ее доли в кошельке
+        """
+        with self._lock:
+            position = self.storage.get_position(user_id, position_id)
+            if position is None:
+                return None
+            held = available if position.get('fill_pending') else position.get('token_amount', 0)
+            remaining = max(held - amount, 0.0)
+            self.storage.update_position(user_id, position_id, {'token_amount': remaining, 'fill_pending': False})
+            return remaining
+
+    @staticmethod
+    def _pending_weights(pending: List[Dict]) -> Dict[str, float]:
+        """Доли неподтвержденных покупок в нераспределенном остатке - по вложенным SOL"""
+        invested = {p['id']: max(p.get('invested_sol', 0), 0.0) for p in pending}
+        total = sum(invested.values())
+        if total <= 0:
+            return {position_id: 1.0 / len(invested) for position_id in invested}
+        return {position_id: amount / total for position_id, amount in invested.items()}
+
+    @staticmethod
+    def _holders(positions_data: Dict) -> Dict[str, List[Dict]]:
+        """Позиции всех пользователей, сгруппированные по контракту (с user_id внутри)"""
+        holders: Dict[str, List[Dict]] = {}
+        for user_id, positions in positions_data.items():
+            for position in positions:
+                holders.setdefault(position['contract_address'], []).append(dict(position, user_id=int(user_id)))
+        return holders
+
+    def _is_settled(self, contract_address: str, now: float) -> bool:
+        if contract_address in self._in_flight:
+            return False
+        last_trade = self._last_trade.get(contract_address)
+        return last_trade is None or now - last_trade >= self.settle_time
+
+    def reconcile(self, balances: Dict[str, float]) -> Dict:
+        """
+        Сверяем учет с балансами кошелька. Неподтвержденные покупки делят нераспределенный
+        остаток пропорционально вложенным SOL, а недостача пропорционально списывается с позиций контракта. Недостача исправляется,
+        только если она повторилась на двух сверках подряд: разовый сбой RPC не обнуляет позиции.
+        """
+        stats = {'checked': 0, 'adjusted': 0, 'skipped': 0}
+        now = time.monotonic()
+        with self._lock:
+            for contract_address, holders in self._holders(self.storage.load_positions()).items():
+                if not self._is_settled(contract_address, now):
+                    stats['skipped'] += 1
+                    continue
+                stats['checked'] += 1
+
+                chain = balances.get(contract_address, 0.0)
+                pending = [p for p in holders if p.get('fill_pending')]
+                confirmed = [p for p in holders if not p.get('fill_pending')]
+                ledger = sum(p.get('token_amount', 0) for p in confirmed)
+
+                if pending and chain - ledger > DUST:
+                    weights = self._pending_weights(pending)
+                    for p in pending:
+                        self.storage.update_position(
+                            p['user_id'], p['id'], {'token_amount': (chain - ledger) * weights[p['id']], 'fill_pending': False}
+                        )
+                    logger.info(
+                        f"⚖️ {contract_address[:8]}...: {chain - ledger:.4f} токенов распределены между "
+                        f"{len(pending)} неподтвержденными покупками по вложенным SOL"
+                    )
+                    stats['adjusted'] += len(pending)
+                    self._suspect.pop(contract_address, None)
+                    continue
+
+                if ledger - chain > max(ledger * self.tolerance, DUST):
+                    if self._suspect.get(contract_address) != -1:
+                        self._suspect[contract_address] = -1  # Подтвердим на следующей сверке
+                        continue
+                    scale = chain / ledger
+                    for p in confirmed:
+                        self.storage.update_position(
+                            p['user_id'], p['id'], {'token_amount': p.get('token_amount', 0) * scale}
+                        )
+                    logger.warning(
+                        f"⚖️ {contract_address[:8]}...: в кошельке {chain:.4f} токенов, по учету {ledger:.4f} - "
+                        f"позиции уменьшены пропорционально"
+                    )
+                    stats['adjusted'] += len(confirmed)
+                self._suspect.pop(contract_address, None)
+        return stats
+
+    def reconcile_now(self) -> Dict:
+        """Перечитываем кошелек одним RPC запросом и сверяем учет (блокирующий вызов)"""
+        return self.reconcile(self.balances.refresh(max_age=0))
+
+    async def _reconcile_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.reconcile_interval)
+            try:
+                stats = await loop.run_in_executor(None, self.reconcile_now)
+                logger.debug(f"Сверка учета токенов: {stats}")
+            except Exception as e:
+                logger.error(f"Ошибка сверки учета токенов: {e}")
+
+    async def start(self):
+        if self._task is None and self.reconcile_interval > 0:
+            self._task = asyncio.create_task(self._reconcile_loop())
+            logger.info(f"⚖️ Сверка учета токенов с кошельком каждые {self.reconcile_interval}с")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+# Глобальный учет токенов по позициям торгового кошелька
+token_ledger = TokenLedger(
+    position_storage, wallet_balances,
+    reconcile_interval=LEDGER_RECONCILE_INTERVAL,
+    settle_time=LEDGER_SETTLE_TIME,
+    tolerance=LEDGER_TOLERANCE
+)
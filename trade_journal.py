@@ -0,0 +1,329 @@
+import gzip
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from datetime import datetime
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+def iter_jsonl(lines: Iterable[str], filename: str) -> Iterator[dict]:
+    """Разбираем строки JSON Lines, пропуская поврежденные"""
+    for line_number, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except json.JSONDecodeError:
+            # Недописанная строка после сбоя - пропускаем
+            logger.warning(f"Пропущена поврежденная строка {line_number} в {filename}")
+
+class TradeJournal:
+    """
+    Журнал сделок в формате JSON Lines: одна запись - одна строка, только дозапись.
+    fsync выполняется пачками: после fsync_batch_size записей или fsync_interval секунд
+    после первой несинхронизированной записи (по таймеру, даже если новых сделок нет).
+    """
+
+    def __init__(self, filename: str = 'trade_history.jsonl', legacy_filename: str = 'trade_history.json',
+                 fsync_batch_size: int = 20, fsync_interval: float = 1.0):
+        self.filename = filename
+        self.fsync_batch_size = fsync_batch_size
+        self.fsync_interval = fsync_interval
+        self._lock = threading.Lock()
+        self._file = None
+        self._pending_sync = 0
+        self._last_sync = time.monotonic()
+        self._sync_timer: Optional[threading.Timer] = None
+        self._convert_legacy(legacy_filename)
+
+    def _convert_legacy(self, legacy_filename: str):
+        """Однократно переносим историю из старого trade_history.json в журнал"""
+        if os.path.exists(self.filename) or not legacy_filename or not os.path.exists(legacy_filename):
+            return
+        try:
+            with open(legacy_filename, 'r') as f:
+                history = json.load(f)
+            self.rewrite(history)
+            logger.info(f"📝 История сделок перенесена в журнал {self.filename}: {len(history)} записей")
+        except Exception as e:
+            logger.error(f"Ошибка переноса истории из {legacy_filename}: {e}")
+
+    def _open(self):
+        if self._file is None:
+            self._file = open(self.filename, 'a', encoding='utf-8')
+        return self._file
+
+    def append(self, record: dict):
+        """Дописываем запись в конец журнала - O(1) независимо от размера истории"""
+        line = json.dumps(record, ensure_ascii=False)
+        with self._lock:
+            f = self._open()
+            f.write(line + '\n')
+            f.flush()
+            self._pending_sync += 1
+            if (self._pending_sync >= self.fsync_batch_size
+                    or time.monotonic() - self._last_sync >= self.fsync_interval):
+                self._sync_locked()
+            elif self._sync_timer is None:
+                # Хвост пачки синхронизируем не позже fsync_interval, даже если сделок больше не будет
+                self._sync_timer = threading.Timer(self.fsync_interval, self.sync)
+                self._sync_timer.daemon = True
+                self._sync_timer.start()
+
+    def _sync_locked(self):
+        if self._sync_timer is not None:
+            self._sync_timer.cancel()
+            self._sync_timer = None
+        if self._file is not None and self._pending_sync:
+            os.fsync(self._file.fileno())
+        self._pending_sync = 0
+        self._last_sync = time.monotonic()
+
+    def sync(self):
+        """Принудительно сбрасываем накопленные записи на диск"""
+        with self._lock:
+            self._sync_locked()
+
+    def iter_records(self) -> Iterator[dict]:
+        """Потоково читаем журнал, не загружая его целиком в память"""
+        if not os.path.exists(self.filename):
+            return
+        with open(self.filename, 'r', encoding='utf-8') as f:
+            yield from iter_jsonl(f, self.filename)
+
+    def rewrite(self, records: List[dict]):
+        """Атомарно перезаписываем журнал целиком (временный файл + rename)"""
+        directory = os.path.dirname(os.path.abspath(self.filename))
+        with self._lock:
+            self._close_locked()
+            fd, tmp_path = tempfile.mkstemp(prefix='.trade_history_', suffix='.tmp', dir=directory)
+            try:
+                with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                    for record in records:
+                        f.write(json.dumps(record, ensure_ascii=False) + '\n')
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_path, self.filename)
+            except Exception:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+
+    def _close_locked(self):
+        if self._file is not None:
+            self._sync_locked()
+            self._file.close()
+            self._file = None
+
+    def close(self):
+        with self._lock:
+            self._close_locked()
+
+def partition_key(timestamp: float) -> str:
+    """Партиция истории (месяц по локальному времени) для записи с таким временем"""
+    return datetime.fromtimestamp(timestamp).strftime('%Y-%m')
+
+def partition_bounds(key: str) -> Tuple[float, float]:
+    """Начало и конец месяца партиции (timestamp)"""
+    start = datetime.strptime(key, '%Y-%m')
+    end = start.replace(year=start.year + 1, month=1) if start.month == 12 else start.replace(month=start.month + 1)
+    return start.timestamp(), end.timestamp()
+
+def months_ago_key(months: int) -> str:
+    now = datetime.now()
+    index = now.year * 12 + now.month - 1 - months
+    return f"{index // 12:04d}-{index % 12 + 1:02d}"
+
+class PartitionedTradeJournal:
+    """
+    История сделок, разбитая по месяцам: <directory>/YYYY-MM.jsonl и небольшой manifest.json.
+    Запись попадает в партицию месяца сделки (TradeJournal со своим пакетным fsync),
+    чтение за период открывает только пересекающиеся с ним партиции.
+    Старые партиции можно сжать в YYYY-MM.jsonl.gz - они остаются доступны для чтения.
+    """
+
+    MANIFEST = 'manifest.json'
+
+    def __init__(self, directory: str = 'trade_history', legacy_files: Iterable[str] = (),
+                 fsync_batch_size: int = 20, fsync_interval: float = 1.0):
+        self.directory = directory
+        self.fsync_batch_size = fsync_batch_size
+        self.fsync_interval = fsync_interval
+        self._lock = threading.RLock()
+        self._journals: Dict[str, TradeJournal] = {}
+        self._manifest_path = os.path.join(directory, self.MANIFEST)
+        os.makedirs(directory, exist_ok=True)
+
+        if os.path.exists(self._manifest_path):
+            with open(self._manifest_path, 'r', encoding='utf-8') as f:
+                self.partitions: Dict[str, Dict] = json.load(f).get('partitions', {})
+        else:
+            self.partitions = {}
+            self._import_legacy(legacy_files)
+            self._write_manifest()
+
+    def _import_legacy(self, legacy_files: Iterable[str]):
+        """Однократно раскладываем историю из единого файла (JSON Lines или старый JSON) по партициям"""
+        for legacy_file in legacy_files or ():
+            if not legacy_file or not os.path.exists(legacy_file):
+                continue
+            try:
+                if legacy_file.endswith('.jsonl'):
+                    records = TradeJournal(legacy_file, None).iter_records()
+                else:
+                    with open(legacy_file, 'r', encoding='utf-8') as f:
+                        records = json.load(f)
+                count = self._write_partitions(records)
+                logger.info(f"📝 История сделок из {legacy_file} разложена по месяцам: {count} записей")
+            except Exception as e:
+                logger.error(f"Ошибка переноса истории из {legacy_file}: {e}")
+            return
+
+    def _path(self, entry: Dict) -> str:
+        return os.path.join(self.directory, entry['file'])
+
+    def _write_manifest(self):
+        fd, tmp_path = tempfile.mkstemp(prefix='.manifest_', suffix='.tmp', dir=self.directory)
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump({'version': 1, 'partitions': self.partitions}, f, indent=2, sort_keys=True)
+            os.replace(tmp_path, self._manifest_path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def _journal(self, key: str) -> TradeJournal:
+        """Журнал партиции для дозаписи; сжатая партиция при этом распаковывается обратно"""
+        journal = self._journals.get(key)
+        if journal is not None:
+            return journal
+        entry = self.partitions.get(key)
+        if entry is None:
+            entry = self.partitions[key] = {'file': f"{key}.jsonl", 'compressed': False}
+            self._write_manifest()
+        elif entry.get('compressed'):
+            self._decompress(key)
+        journal = self._journals[key] = TradeJournal(
+            self._path(self.partitions[key]), None, self.fsync_batch_size, self.fsync_interval
+        )
+        return journal
+
+    def append(self, record: dict):
+        """Дописываем запись в партицию ее месяца"""
+        with self._lock:
+            journal = self._journal(partition_key(record['timestamp']))
+        journal.append(record)
+
+    def sync(self):
+        with self._lock:
+            for journal in self._journals.values():
+                journal.sync()
+
+    def iter_records(self, since: Optional[float] = None, until: Optional[float] = None) -> Iterator[dict]:
+        """Потоково читаем записи за период [since, until], открывая только нужные партиции"""
+        with self._lock:
+            partitions = sorted(self.partitions.items())
+        for key, entry in partitions:
+            start, end = partition_bounds(key)
+            if (since is not None and end <= since) or (until is not None and start > until):
+                continue
+            for record in self._iter_partition(entry):
+                timestamp = record.get('timestamp', 0)
+                if (since is None or timestamp >= since) and (until is None or timestamp <= until):
+                    yield record
+
+    def _iter_partition(self, entry: Dict) -> Iterator[dict]:
+        path = self._path(entry)
+        if not os.path.exists(path):
+            return
+        if entry.get('compressed'):
+            with gzip.open(path, 'rt', encoding='utf-8') as f:
+                yield from iter_jsonl(f, path)
+        else:
+            yield from TradeJournal(path, None).iter_records()
+
+    def _write_partitions(self, records: Iterable[dict]) -> int:
+        """Записываем записи по партициям целиком (каждая партиция - атомарной заменой файла)"""
+        grouped: Dict[str, List[dict]] = {}
+        for record in records:
+            grouped.setdefault(partition_key(record['timestamp']), []).append(record)
+        for key, partition_records in grouped.items():
+            entry = {'file': f"{key}.jsonl", 'compressed': False}
+            TradeJournal(self._path(entry), None).rewrite(partition_records)
+            self.partitions[key] = entry
+        return sum(len(r) for r in grouped.values())
+
+    def rewrite(self, records: List[dict]):
+        """Полностью заменяем историю"""
+        with self._lock:
+            self._close_journals()
+            old_files = {entry['file'] for entry in self.partitions.values()}
+            self.partitions = {}
+            self._write_partitions(records)
+            for stale_file in old_files - {entry['file'] for entry in self.partitions.values()}:
+                stale_path = os.path.join(self.directory, stale_file)
+                if os.path.exists(stale_path):
+                    os.remove(stale_path)
+            self._write_manifest()
+
+    def compact(self, older_than_months: int) -> int:
+        """Сжимаем в gzip партиции старше older_than_months месяцев; возвращаем их количество"""
+        cutoff_key = months_ago_key(older_than_months)
+        compacted = 0
+        with self._lock:
+            for key, entry in sorted(self.partitions.items()):
+                if key >= cutoff_key or entry.get('compressed'):
+                    continue
+                journal = self._journals.pop(key, None)
+                if journal is not None:
+                    journal.close()
+                source = self._path(entry)
+                target = f"{source}.gz"
+                fd, tmp_path = tempfile.mkstemp(prefix='.partition_', suffix='.tmp', dir=self.directory)
+                os.close(fd)
+                try:
+                    with open(source, 'rb') as src, gzip.open(tmp_path, 'wb') as dst:
+                        while True:
+                            chunk = src.read(1024 * 1024)
+                            if not chunk:
+                                break
+                            dst.write(chunk)
+                    os.replace(tmp_path, target)
+                except Exception:
+                    if os.path.exists(tmp_path):
+                        os.remove(tmp_path)
+                    raise
+                self.partitions[key] = {'file': os.path.basename(target), 'compressed': True}
+                self._write_manifest()
+                os.remove(source)
+                compacted += 1
+        if compacted:
+            logger.info(f"🗜️ Сжато партиций истории сделок: {compacted}")
+        return compacted
+
+    def _decompress(self, key: str):
+        """Возвращаем сжатую партицию в обычный журнал (запоздавшая запись за старый месяц)"""
+        entry = self.partitions[key]
+        source = self._path(entry)
+        with gzip.open(source, 'rt', encoding='utf-8') as f:
+            records = list(iter_jsonl(f, source))
+        plain = {'file': f"{key}.jsonl", 'compressed': False}
+        TradeJournal(self._path(plain), None).rewrite(records)
+        self.partitions[key] = plain
+        self._write_manifest()
+        os.remove(source)
+
+    def _close_journals(self):
+        for journal in self._journals.values():
+            journal.close()
+        self._journals.clear()
+
+    def close(self):
+        with self._lock:
+            self._close_journals()
@@ -0,0 +1,196 @@
+import heapq
+import threading
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Deque, Dict, Iterable, List, Optional, Tuple
+
+CLOSE_ACTIONS = ('close', 'sl')  # Закрытия, с которыми сопоставляются открытия
+RECENT_TRADES = 10
+
+def day_of(timestamp: float) -> int:
+    """Номер дня (по локальному времени) для разбивки статистики"""
+    return datetime.fromtimestamp(timestamp).date().toordinal()
+
+class DayBucket:
+    """Агрегаты пользователя за один день. Сделка открытие-закрытие учитывается в день открытия"""
+
+    __slots__ = ('trades', 'opens', 'invested', 'closed', 'pnl_sol', 'wins', 'hold_time', 'best', 'worst')
+
+    def __init__(self):
+        self.trades = 0  # Все записи истории за день
+        self.opens = 0
+        self.invested = 0.0
+        self.closed = 0
+        self.pnl_sol = 0.0
+        self.wins = 0
+        self.hold_time = 0.0
+        self.best: Optional[Dict] = None
+        self.worst: Optional[Dict] = None
+
+class TradeStatistics:
+    """
+    Инкрементальная статистика сделок по пользователям с разбивкой по дням.
+    Каждая запись учитывается один раз при добавлении: открытие ждет первого закрытия/SL
+    по тому же контракту, после чего пара попадает в корзину дня открытия.
+    Статистика за N дней - сумма корзин за эти дни, O(N) вместо перебора всей истории.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._buckets: Dict[int, Dict[int, DayBucket]] = {}  # user_id -> {день -> корзина}
+        self._pending_opens: Dict[Tuple[int, str], List[Tuple[float, float]]] = {}  # -> [(время, SOL)]
+        self._recent: Dict[int, Deque[dict]] = {}
+
+    @classmethod
+    def from_records(cls, records: Iterable[dict]) -> 'TradeStatistics':
+        """Строим статистику по истории одним проходом (записи упорядочиваются по времени)"""
+        stats = cls()
+        rows = []
+        recent: Dict[int, list] = {}
+        for seq, trade in enumerate(records):
+            rows.append((
+                trade['timestamp'], seq, trade['user_id'], trade['contract_address'], trade['action'],
+                trade.get('amount_sol', 0), trade.get('pnl_sol', 0), trade.get('pnl_percent', 0)
+            ))
+            # Для "последних сделок" держим только RECENT_TRADES самых свежих записей пользователя
+            heap = recent.setdefault(trade['user_id'], [])
+            item = (trade['timestamp'], seq, trade)
+            if len(heap) < RECENT_TRADES:
+                heapq.heappush(heap, item)
+            else:
+                heapq.heappushpop(heap, item)
+
+        rows.sort()
+        for timestamp, _, user_id, contract_address, action, amount_sol, pnl_sol, pnl_percent in rows:
+            stats._account(user_id, contract_address, action, timestamp, amount_sol, pnl_sol, pnl_percent)
+        for user_id, heap in recent.items():
+            stats._recent[user_id] = deque((trade for _, _, trade in sorted(heap)), maxlen=RECENT_TRADES)
+        return stats
+
+    def add(self, trade: dict):
+        """Учитываем новую запись истории"""
+        with self._lock:
+            self._account(
+                trade['user_id'], trade['contract_address'], trade['action'], trade['timestamp'],
+                trade.get('amount_sol', 0), trade.get('pnl_sol', 0), trade.get('pnl_percent', 0)
+            )
+            self._recent.setdefault(trade['user_id'], deque(maxlen=RECENT_TRADES)).append(trade)
+
+    def _bucket(self, user_id: int, timestamp: float) -> DayBucket:
+        user_buckets = self._buckets.setdefault(user_id, {})
+        day = day_of(timestamp)
+        bucket = user_buckets.get(day)
+        if bucket is None:
+            bucket = user_buckets[day] = DayBucket()
+        return bucket
+
+    def _account(self, user_id: int, contract_address: str, action: str, timestamp: float,
+                 amount_sol: float, pnl_sol: float, pnl_percent: float):
+        self._bucket(user_id, timestamp).trades += 1
+
+        key = (user_id, contract_address)
+        if action == 'open':
+            bucket = self._bucket(user_id, timestamp)
+            bucket.opens += 1
+            bucket.invested += amount_sol
+            self._pending_opens.setdefault(key, []).append((timestamp, amount_sol))
+            return
+
+        if action not in CLOSE_ACTIONS or key not in self._pending_opens:
+            return
+
+        # Закрытие относится ко всем еще не закрытым открытиям, сделанным раньше него
+        remaining = []
+        for opened_at, invested in self._pending_opens[key]:
+            if opened_at < timestamp:
+                self._account_closed(user_id, contract_address, opened_at, timestamp,
+                                     invested, pnl_sol, pnl_percent)
+            else:
+                remaining.append((opened_at, invested))
+        if remaining:
+            self._pending_opens[key] = remaining
+        else:
+            del self._pending_opens[key]
+
+    def _account_closed(self, user_id: int, contract_address: str, opened_at: float, closed_at: float,
+                        invested: float, pnl_sol: float, pnl_percent: float):
+        bucket = self._bucket(user_id, opened_at)
+        bucket.closed += 1
+        bucket.pnl_sol += pnl_sol
+        bucket.hold_time += closed_at - opened_at
+        if pnl_sol > 0:
+            bucket.wins += 1
+
+        closed_trade = {
+            'open_time': opened_at,
+            'close_time': closed_at,
+            'hold_time': closed_at - opened_at,
+            'pnl_sol': pnl_sol,
+            'pnl_percent': pnl_percent,
+            'invested': invested,
+            'contract': contract_address
+        }
+        if bucket.best is None or pnl_percent > bucket.best['pnl_percent']:
+            bucket.best = closed_trade
+        if bucket.worst is None or pnl_percent < bucket.worst['pnl_percent']:
+            bucket.worst = closed_trade
+
+    def get_user_statistics(self, user_id: int, days: int = None) -> Dict:
+        """
+        Статистика пользователя за последние days дней (None - за все время).
+        Период округляется до целых календарных дней: первый день учитывается полностью.
+        """
+        with self._lock:
+            user_buckets = self._buckets.get(user_id, {})
+            if days:
+                cutoff = datetime.now() - timedelta(days=days)
+                first_day = cutoff.date().toordinal()
+                last_day = max(user_buckets, default=first_day)
+                buckets = [user_buckets[d] for d in range(first_day, last_day + 1) if d in user_buckets]
+                cutoff_timestamp = cutoff.timestamp()
+            else:
+                buckets = list(user_buckets.values())
+                cutoff_timestamp = None
+
+            total_trades = sum(b.trades for b in buckets)
+            if not total_trades:
+                return {
+                    'total_trades': 0,
+                    'open_positions': 0,
+                    'closed_positions': 0,
+                    'total_invested': 0,
+                    'total_pnl_sol': 0,
+                    'total_pnl_percent': 0,
+                    'win_rate': 0,
+                    'best_trade': None,
+                    'worst_trade': None,
+                    'avg_hold_time': 0
+                }
+
+            opens = sum(b.opens for b in buckets)
+            closed = sum(b.closed for b in buckets)
+            wins = sum(b.wins for b in buckets)
+            total_invested = sum(b.invested for b in buckets)
+            total_pnl_sol = sum(b.pnl_sol for b in buckets)
+            hold_time = sum(b.hold_time for b in buckets)
+            best_candidates = [b.best for b in buckets if b.best is not None]
+            worst_candidates = [b.worst for b in buckets if b.worst is not None]
+
+            recent_trades = [
+                dict(t) for t in reversed(self._recent.get(user_id, ()))
+                if cutoff_timestamp is None or t['timestamp'] > cutoff_timestamp
+            ]
+
+        return {
+            'total_trades': total_trades,
+            'open_positions': opens - closed,
+            'closed_positions': closed,
+            'total_invested': total_invested,
+            'total_pnl_sol': total_pnl_sol,
+            'total_pnl_percent': (total_pnl_sol / total_invested * 100) if total_invested > 0 else 0,
+            'win_rate': (wins / closed * 100) if closed else 0,
+            'best_trade': dict(max(best_candidates, key=lambda x: x['pnl_percent'])) if best_candidates else None,
+            'worst_trade': dict(min(worst_candidates, key=lambda x: x['pnl_percent'])) if worst_candidates else None,
+            'avg_hold_time_hours': (hold_time / closed / 3600) if closed else 0,
+            'recent_trades': recent_trades  # Последние 10 сделок
+        }
@@ -0,0 +1,90 @@
+import bisect
+from typing import Dict, List, Optional, Tuple
+
+# Запас на погрешность float при сравнении с порогами; окончательное решение за evaluate_triggers
+PRICE_EPSILON = 1e-9
+
+Holder = Tuple[int, Dict]  # (user_id, позиция)
+
+def position_thresholds(position: Dict) -> Tuple[Optional[float], Optional[float]]:
+    """
+    Абсолютные цены срабатывания позиции: (нижний порог - SL, ближайший верхний - безубыток или TP).
+    Пересчитываются из entry_price один раз при построении индекса, а не на каждой котировке.
+    """
+    entry_price = position.get('entry_price', 0)
+    if entry_price <= 0:
+        return None, None
+
+    lower = entry_price * (1 - position.get('sl', 15) / 100)
+
+    upper_prices = []
+    if not position.get('breakeven_moved', False):
+        upper_prices.append(entry_price * (1 + position.get('breakeven_percent', 15) / 100))
+    tp_executed = position.get('tp_executed', [])
+    for i, tp_config in enumerate(position.get('tp_levels', [])):
+        tp_level = tp_config.get('level', 0) if isinstance(tp_config, dict) else tp_config
+        if i not in tp_executed and tp_level > 0:
+            upper_prices.append(entry_price * tp_level)  # TP задан множителем цены входа
+
+    return lower, min(upper_prices) if upper_prices else None
+
+class MintTriggers:
+    """Пороги всех позиций одного контракта, отсортированные по цене"""
+
+    __slots__ = ('lower_prices', 'lower_holders', 'upper_prices', 'upper_holders')
+
+    def __init__(self, holders: List[Holder]):
+        lower, upper = [], []
+        for holder in holders:
+            lower_price, upper_price = position_thresholds(holder[1])
+            if lower_price is not None:
+                lower.append((lower_price, holder))
+            if upper_price is not None:
+                upper.append((upper_price, holder))
+        lower.sort(key=lambda item: item[0])
+        upper.sort(key=lambda item: item[0])
+        self.lower_prices = [price for price, _ in lower]
+        self.lower_holders = [holder for _, holder in lower]
+        self.upper_prices = [price for price, _ in upper]
+        self.upper_holders = [holder for _, holder in upper]
+
+    def crossed(self, price: float) -> List[Holder]:
+        """Позиции, у которых цена пересекла SL (порог >= цены) или верхний порог (порог <= цены)"""
+        result = self.lower_holders[bisect.bisect_left(self.lower_prices, price * (1 - PRICE_EPSILON)):]
+        result += self.upper_holders[:bisect.bisect_right(self.upper_prices, price * (1 + PRICE_EPSILON))]
+        if len(result) > 1:
+            # Позиция может пересечь оба порога при странных настройках - оставляем одну запись
+            result = list({position['id']: (user_id, position) for user_id, position in result}.values())
+        return result
+
+    def distance(self, price: float) -> Optional[float]:
+        """Относительное движение цены до ближайшего порога; 0 - порог уже пересечен"""
+        if price <= 0:
+            return 0.0
+        distances = []
+        if self.lower_prices:
+            distances.append((price - self.lower_prices[-1]) / price)
+        if self.upper_prices:
+            distances.append((self.upper_prices[0] - price) / price)
+        return max(min(distances), 0.0) if distances else None
+
+class TriggerIndex:
+    """
+    Индекс триггеров по контрактам: поиск сработавших позиций бинарным поиском
+    вместо обхода tp_levels/sl/breakeven каждой позиции на каждой котировке.
+    """
+
+    def __init__(self, mints: Dict[str, MintTriggers] = None):
+        self.mints = mints or {}
+
+    @classmethod
+    def build(cls, mint_index: Dict[str, List[Holder]]) -> 'TriggerIndex':
+        return cls({contract_address: MintTriggers(holders) for contract_address, holders in mint_index.items()})
+
+    def crossed(self, contract_address: str, price: float) -> List[Holder]:
+        triggers = self.mints.get(contract_address)
+        return triggers.crossed(price) if triggers else []
+
+    def distance(self, contract_address: str, price: float) -> Optional[float]:
+        triggers = self.mints.get(contract_address)
+        return triggers.distance(price) if triggers else None
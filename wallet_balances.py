@@ -0,0 +1,120 @@
+import logging
+import threading
+import time
+from typing import Dict, List, Optional
+
+from config import WALLET_ADDRESS, SOLANA_RPC_URL, WALLET_BALANCE_TTL, HTTP_TOTAL_TIMEOUT
+from http_session import get_sync_session
+from metrics import rpc_request_seconds
+
+logger = logging.getLogger(__name__)
+
+# Программы токенов Solana: классический SPL Token и Token-2022
+TOKEN_PROGRAM_IDS = (
+    'TokenkegQfeZyiNwAJbNbGKPFXCWuBvf9Ss623VQ5DA',
+    'TokenzQdBNbLqP5VEhdkAS6EPFLC1PHnBqCXEpPxuEb',
+)
+
+def _token_accounts_request(wallet_address: str) -> List[dict]:
+    """Пакетный JSON-RPC запрос: токен-аккаунты кошелька по обеим программам за один HTTP вызов"""
+    return [
+        {
+            'jsonrpc': '2.0',
+            'id': i,
+            'method': 'getTokenAccountsByOwner',
+            'params': [
+                wallet_address,
+                {'programId': program_id},
+                {'encoding': 'jsonParsed', 'commitment': 'confirmed'}
+            ]
+        }
+        for i, program_id in enumerate(TOKEN_PROGRAM_IDS)
+    ]
+
+def _parse_token_accounts(responses: List[dict]) -> Dict[str, float]:
+    """Суммируем балансы по mint (у кошелька может быть несколько аккаунтов одного токена)"""
+    balances: Dict[str, float] = {}
+    for response in responses:
+        if 'error' in response:
+            raise Exception(f"RPC ошибка: {response['error']}")
+        for account in response['result']['value']:
+            info = account['account']['data']['parsed']['info']
+            token_amount = info['tokenAmount']
+            if token_amount.get('uiAmountString') is not None:
+                amount = float(token_amount['uiAmountString'])
+            else:
+                amount = int(token_amount['amount']) / 10 ** token_amount['decimals']
+            balances[info['mint']] = balances.get(info['mint'], 0.0) + amount
+    return balances
+
+def fetch_wallet_balances(wallet_address: str, rpc_url: str = SOLANA_RPC_URL) -> Dict[str, float]:
+    """Балансы всех токенов кошелька (mint -> количество) одним запросом к Solana RPC"""
+    with rpc_request_seconds.time(method='getTokenAccountsByOwner'):
+        response = get_sync_session().post(
+            rpc_url, json=_token_accounts_request(wallet_address), timeout=HTTP_TOTAL_TIMEOUT
+        )
+    response.raise_for_status()
+    return _parse_token_accounts(response.json())
+
+class WalletBalanceSnapshot:
+    """
+    Снимок балансов всех токенов кошелька. Обновляется одним RPC запросом, живет ttl секунд
+    и сбрасывается после наших сделок, поэтому торговля и мониторинг читают балансы из памяти.
+    Используется из рабочих потоков AxiomClient: одновременные промахи делят одно обновление.
+    """
+
+    def __init__(self, wallet_address: str, rpc_url: str = SOLANA_RPC_URL, ttl: float = 5):
+        self.wallet_address = wallet_address
+        self.rpc_url = rpc_url
+        self.ttl = ttl
+        self._balances: Dict[str, float] = {}
+        self._fetched_at = 0.0  # time.monotonic() последнего обновления; 0 - снимка нет
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self.refreshes = 0
+
+    def get_cached(self, contract_address: str, max_age: float = None) -> Optional[float]:
+        """Баланс из снимка, если он не старше max_age (по умолчанию ttl), иначе None"""
+        max_age = self.ttl if max_age is None else max_age
+        with self._lock:
+            if self._fetched_at and time.monotonic() - self._fetched_at <= max_age:
+                return self._balances.get(contract_address, 0.0)
+        return None
+
+    def get_balance(self, contract_address: str, max_age: float = None) -> float:
+        """Баланс токена; при устаревшем снимке кошелек перечитывается целиком"""
+        balance = self.get_cached(contract_address, max_age)
+        if balance is not None:
+            return balance
+        return self.refresh(max_age).get(contract_address, 0.0)
+
+    def refresh(self, max_age: float = None) -> Dict[str, float]:
+        """Перечитываем балансы; если снимок обновил другой поток, пока мы ждали, берем его"""
+        max_age = self.ttl if max_age is None else max_age
+        requested_at = time.monotonic()
+        with self._refresh_lock:
+            with self._lock:
+                if self._fetched_at >= requested_at or (
+                        self._fetched_at and max_age > 0 and requested_at - self._fetched_at <= max_age):
+                    return dict(self._balances)
+
+            balances = fetch_wallet_balances(self.wallet_address, self.rpc_url)
+            with self._lock:
+                self._balances = balances
+                self._fetched_at = time.monotonic()
+                self.refreshes += 1
+            logger.debug(f"Снимок балансов кошелька обновлен: {len(balances)} токенов")
+            return dict(balances)
+
+    def invalidate(self):
+        """Наша сделка изменила балансы - следующее чтение пойдет в RPC"""
+        with self._lock:
+            self._fetched_at = 0.0
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            age = time.monotonic() - self._fetched_at if self._fetched_at else None
+            return {'tokens': len(self._balances), 'age': age, 'refreshes': self.refreshes}
+
+# Глобальный снимок балансов торгового кошелька
+wallet_balances = WalletBalanceSnapshot(WALLET_ADDRESS, SOLANA_RPC_URL, ttl=WALLET_BALANCE_TTL)